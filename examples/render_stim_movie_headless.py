@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+from flystim.headless import OffscreenRenderer
+from flystim.screen import Screen
+import numpy as np
+import os
+import sys
+import tempfile
+
+
+def main():
+    """
+    Render a stimulus movie offscreen, without launching a stim server or opening a window.
+
+    Usage: render_stim_movie_headless.py [save_dir], the movie is saved to a temporary directory by default
+    """
+    save_dir = sys.argv[1] if len(sys.argv) > 1 else tempfile.mkdtemp(prefix='flystim_')
+
+    screen = Screen(fullscreen=False, server_number=0, id=0, vsync=False)
+    # uses an EGL context if no X server is available
+    renderer = OffscreenRenderer(screen, width=640, height=480)
+
+    # contrast-reversing grating
+    tf = 1 # Hz
+    t = np.linspace(0, 6, 100)
+    c = np.sin(2*np.pi*tf*t)
+    tv_pairs = list(zip(t, c))
+    contrast_traj = {'name': 'tv_pairs', 'tv_pairs': tv_pairs, 'kind': 'linear'}
+
+    renderer.load_stim(name='CylindricalGrating', period=10, mean=0.5, contrast=contrast_traj, offset=0.0, profile='square',
+                       color=[1, 1, 1, 1], cylinder_radius=1, cylinder_height=10, theta=0, phi=0, angle=0)
+
+    timepoints = np.arange(0, 2, 1/120) # sec
+    file_path = os.path.join(save_dir, 'crg_test.npy')
+    shape = renderer.render_movie(file_path, timepoints, downsample_xy=8)
+    renderer.release()
+    print('Saved {} movie to {}'.format(shape, file_path))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,67 @@ See flystim.stimuli for available child stimulus classes. Overwrite methods in c
 
 """
 
+import time
 import moderngl
+import numpy as np
+
+from flystim.buffer import DynamicBuffer
+from flystim.lod import LevelOfDetail
+from flystim.profiling import null_profiler
+from flystim.shapes import GlVertices, VERTEX_DTYPE, TEXTURED_VERTEX_DTYPE
+from flystim.util import model_mat
+
+# size of the per-subscreen uniform arrays used for single-pass rendering, see BaseProgram.render_single_pass
+MAX_SUBSCREENS = 16
+
+
+class ProgramCache:
+    """
+    Shader programs shared by all stimuli drawn in one GL context, keyed by shader source.
+
+    Programs are reference counted. A program whose count drops to zero stays compiled so that the next stimulus
+    using the same shaders (e.g. in the next epoch) doesn't pay for compiling and linking it again.
+    """
+
+    def __init__(self):
+        self.programs = {}  # (vertex_shader, fragment_shader): program
+        self.ref_counts = {}  # program: number of stimuli using it
+
+    def acquire(self, ctx, vertex_shader, fragment_shader):
+        key = (vertex_shader, fragment_shader)
+        if key not in self.programs:
+            prog = ctx.program(vertex_shader=vertex_shader, fragment_shader=fragment_shader)
+            self.programs[key] = prog
+            self.ref_counts[prog] = 0
+
+        prog = self.programs[key]
+        self.ref_counts[prog] += 1
+        return prog
+
+    def release(self, prog):
+        self.ref_counts[prog] -= 1
+
+    def clear(self):
+        """
+        Release all programs that are not currently in use.
+        """
+        for key, prog in list(self.programs.items()):
+            if self.ref_counts[prog] == 0:
+                prog.release()
+                del self.programs[key]
+                del self.ref_counts[prog]
+
+
+def get_program_cache(ctx):
+    """
+    :param ctx: ModernGL context
+    :returns: ProgramCache attached to ctx, created on first use
+    """
+    if ctx.extra is None:
+        ctx.extra = {}
+    if 'program_cache' not in ctx.extra:
+        ctx.extra['program_cache'] = ProgramCache()
+    return ctx.extra['program_cache']
 
 
 class BaseProgram:
@@ -25,6 +85,35 @@ class BaseProgram:
         self.texture = None
         self.draw_mode = 'TRIANGLES'  # TRIANGLES, POINTS
         self.point_size = 2  # pixels on screen, only for POINTS draw_mode
+        self.use_instancing = False  # draw stim_object once per instance, see set_instances
+        self.single_pass = False  # draw all subscreens with one draw call, set in initialize
+        self.vbo = None
+        self.vao = None
+        self.ibo = None
+
+        # per-instance attributes, only used if use_instancing is True
+        self.instance_vbo = None
+        self.instance_data = np.zeros((0, 10), dtype='f4')
+        self.instances_dirty = False
+
+        # stim_object (and its generation) currently held in the VBO, see paint_at
+        self.uploaded_object = None
+        self.uploaded_generation = None
+        self.vertex_count = 0  # number of vertices to draw, or of indices if the stim object has indices
+        self.indexed = False  # whether the VAO draws through the index buffer
+
+        # reusable vertex data that eval_at can fill in place, see stage_vertices
+        self.staging = None
+        self.staging_object = GlVertices()
+
+        # transforms applied on the GPU, see set_transform and set_texture_shift
+        self.model_matrix = np.eye(4)
+        self.texture_shift = (0, 0)
+
+        # tessellation chosen from the pixel density of the subscreens, see flystim.lod
+        self.lod = LevelOfDetail(screen)
+
+        self.set_profiler(null_profiler)
 
     def initialize(self, ctx):
         """
@@ -32,13 +121,13 @@ class BaseProgram:
         """
         # save context
         self.ctx = ctx
-        self.prog = self.create_prog()
 
-        self.update_vertex_objects()
+        # single-pass rendering draws one instance per subscreen, so it isn't combined with instanced stimuli
+        self.single_pass = (self.screen.single_pass_subscreens and not self.use_instancing
+                            and 1 < len(self.screen.subscreens) <= MAX_SUBSCREENS)
+        self.prog = self.create_prog()
 
-        # Default texture booleans for the shader program
-        self.prog['use_texture'].value = False
-        self.prog['rgb_texture'].value = False
+        self.create_vertex_objects()
 
     def configure(self, *args, **kwargs):
         pass
@@ -50,22 +139,48 @@ class BaseProgram:
         :param perspectives: list of perspective matrices for each subscreen, generated using perspective.GenPerspective and subscreen corners
         :param fly_position: x, y, z position of fly (meters)
         """
+        self.lod.set_viewports(viewports)
+
+        t_phase = time.perf_counter()
         self.eval_at(t, fly_position=fly_position, fly_heading=fly_heading) # update any stim objects that depend on fly position
+        self.profiler.record(self.phase_names['eval_at'], t_phase)
 
-        data = self.stim_object.data # get stim object vertex data
-        self.update_vertex_objects()
+        # a transform still pending on the stim object is applied in the vertex shader, so the untransformed vertex
+        # data can stay in the VBO. Instances are transformed before the model matrix, so they need the vertex data
+        # transformed on the CPU.
+        if self.use_instancing:
+            mesh, mesh_transform = self.stim_object, None
+        else:
+            mesh, mesh_transform = self.stim_object.split_transform()
 
-        if self.use_texture:
-            # x, y, z, r, g, b, a, texture x, texture y
-            vertices = len(data) // 9
+        # only rebuild and upload the vertex data if the stim object has changed since the last upload
+        if mesh is not self.uploaded_object or mesh.generation != self.uploaded_generation:
+            self.upload_stim_object(mesh)
+        vertices = self.vertex_count
+
+        if self.use_instancing:
+            if self.instances_dirty:
+                self.upload_instances()
+            instances = len(self.instance_data)
         else:
-            # x, y, z, r, g, b, a
-            vertices = len(data) // 7
+            instances = 1
+
+        # the shader program may be shared with other stimuli, so set all of its state for this frame
+        self.prog['use_texture'].value = self.use_texture and self.texture is not None
+        self.prog['rgb_texture'].value = self.rgb_texture and self.texture is not None
+        if self.texture is not None:
+            self.texture.use()
 
-        # write data to VBO
-        self.vbo.write(data.astype('f4'))
+        # set the model transform and texture shift for this frame
+        model_matrix = self.model_matrix if mesh_transform is None else self.model_matrix @ mesh_transform
+        self.prog['Model'].write(model_matrix.astype('f4').tobytes(order='F'))
+        self.prog['tex_shift'].value = tuple(self.texture_shift)
 
         # Render to each subscreen
+        t_phase = time.perf_counter()
+        if self.single_pass:
+            self.render_single_pass(viewports, perspectives, vertices)
+            viewports = []
         for v_ind, vp in enumerate(viewports):
             # set the perspective matrix
             self.prog['Mvp'].write(perspectives[v_ind])
@@ -74,26 +189,210 @@ class BaseProgram:
 
             # render the object
             if self.draw_mode == 'POINTS':
-                self.vao.render(mode=moderngl.POINTS, vertices=vertices)
-                self.ctx.point_size=self.point_size
+                self.ctx.point_size = self.point_size
+                self.vao.render(mode=moderngl.POINTS, vertices=vertices, instances=instances)
             elif self.draw_mode == 'TRIANGLES':
-                self.vao.render(mode=moderngl.TRIANGLES, vertices=vertices)
+                self.vao.render(mode=moderngl.TRIANGLES, vertices=vertices, instances=instances)
+        self.profiler.record(self.phase_names['draw'], t_phase)
 
-    def update_vertex_objects(self):
+    def render_single_pass(self, viewports, perspectives, vertices):
+        """
+        Draw all subscreens with one draw call. Instance i is drawn with the perspective matrix of subscreen i and
+        mapped into its viewport by the vertex shader, and fragments outside of its view frustum are discarded.
+
+        :param viewports: list of viewport arrays for each subscreen - (xmin, ymin, width, height) in display device pixels
+        :param perspectives: list of perspective matrices for each subscreen
+        :param vertices: number of vertices to draw
+        """
+        n_subscreens = len(viewports)
+        viewports = np.asarray(viewports, dtype=float)
+
+        # bounding box of all viewports, in pixels
+        x0, y0 = np.min(viewports[:, :2], axis=0)
+        x1, y1 = np.max(viewports[:, :2] + viewports[:, 2:], axis=0)
+
+        # lower left corner, width and height of each subscreen in the NDC of the bounding box
+        rects = np.zeros((MAX_SUBSCREENS, 4), dtype='f4')
+        rects[:n_subscreens, 0] = 2*(viewports[:, 0] - x0)/(x1 - x0) - 1
+        rects[:n_subscreens, 1] = 2*(viewports[:, 1] - y0)/(y1 - y0) - 1
+        rects[:n_subscreens, 2] = 2*viewports[:, 2]/(x1 - x0)
+        rects[:n_subscreens, 3] = 2*viewports[:, 3]/(y1 - y0)
+
+        # uniform arrays have to be written in full
+        self.prog['Mvps'].write(b''.join(perspectives) + bytes(64*(MAX_SUBSCREENS - n_subscreens)))
+        self.prog['subscreen_rects'].write(rects.tobytes())
+        self.ctx.viewport = (int(x0), int(y0), int(x1 - x0), int(y1 - y0))
+
+        if self.draw_mode == 'POINTS':
+            self.ctx.point_size = self.point_size
+            self.vao.render(mode=moderngl.POINTS, vertices=vertices, instances=n_subscreens)
+        elif self.draw_mode == 'TRIANGLES':
+            self.vao.render(mode=moderngl.TRIANGLES, vertices=vertices, instances=n_subscreens)
+
+    def set_profiler(self, profiler, name=None):
+        """
+        :param profiler: flystim.profiling.FrameProfiler that records the time spent in each phase of paint_at
+        :param name: prefix for the phase names, defaults to the class name
+        """
+        if name is None:
+            name = type(self).__name__
+
+        self.profiler = profiler
+        self.phase_names = {phase: '{}.{}'.format(name, phase) for phase in ['eval_at', 'data', 'upload', 'draw']}
+
+    def stage_vertices(self, n_vertices):
+        """
+        Get a reusable array to write this frame's vertex data into, instead of building a new stim object. The
+        array is reused from frame to frame and only reallocated when it needs to grow, so filling it with
+        out= arguments (e.g. flystim.util.rotate(..., out=staging['in_vert'].T)) doesn't allocate per frame.
+        The staged data becomes stim_object and is written to the VBO as is.
+
+        :param n_vertices: number of vertices to draw this frame
+        :returns: (n_vertices,) array of flystim.shapes.VERTEX_DTYPE, or TEXTURED_VERTEX_DTYPE if use_texture.
+        Its contents are left over from the previous frame.
+        """
+        dtype = TEXTURED_VERTEX_DTYPE if self.use_texture else VERTEX_DTYPE
+        if self.staging is None or len(self.staging) < n_vertices or self.staging.dtype != dtype:
+            # grow geometrically so that slowly growing data doesn't reallocate every frame
+            capacity = n_vertices if self.staging is None else max(n_vertices, 2*len(self.staging))
+            self.staging = np.zeros(capacity, dtype=dtype)
+
+        self.staging_object.set_buffer(self.staging[:n_vertices])
+        self.stim_object = self.staging_object
+        return self.staging_object.buffer
+
+    def set_model_matrix(self, matrix):
+        """
+        :param matrix: 4x4 model matrix, applied to the stim object vertices in the vertex shader
+        """
+        self.model_matrix = np.asarray(matrix, dtype=float)
+
+    def set_transform(self, scale=1, yaw=0, pitch=0, roll=0, translation=(0, 0, 0)):
+        """
+        Set the model matrix so that the stim object is drawn as if it had been transformed with
+        .scale(scale).rotate(yaw, pitch, roll).translate(translation), without touching the vertex data.
+
+        :param scale: scalar or (x, y, z) scale factors
+        :param yaw: rotation around z axis, radians
+        :param pitch: rotation around x axis, radians
+        :param roll: rotation around y axis, radians
+        :param translation: (x, y, z) translation, meters
+        """
+        self.model_matrix = model_mat(scale, yaw, pitch, roll, translation)
+
+    def set_texture_shift(self, shift):
+        """
+        :param shift: (u, v) offset added to the texture coordinates in the vertex shader
+        """
+        self.texture_shift = (float(shift[0]), float(shift[1]))
+
+    def set_instances(self, offsets, scales=1, colors=(1, 1, 1, 1)):
+        """
+        Set the per-instance attributes for instanced drawing (requires use_instancing = True). Each instance is
+        a copy of stim_object, scaled, then translated, with its vertex colors multiplied by the instance color.
+
+        :param offsets: (n_instances, 3) array of (x, y, z) translations, meters
+        :param scales: scalar, (n_instances,) or (n_instances, 3) array of scale factors
+        :param colors: [r,g,b,a] applied to all instances, or (n_instances, 4) array of per-instance colors
+        """
+        offsets = np.reshape(offsets, (-1, 3))
+        scales = np.asarray(scales, dtype=float)
+        if scales.ndim == 1:
+            scales = scales[:, np.newaxis]
+
+        instance_data = np.empty((len(offsets), 10), dtype='f4')
+        instance_data[:, 0:3] = offsets
+        instance_data[:, 3:6] = scales
+        instance_data[:, 6:10] = colors
+
+        self.instance_data = instance_data
+        self.instances_dirty = True
+
+    def upload_instances(self):
+        if self.instance_vbo.write(self.instance_data):
+            self.create_vertex_array()
+        self.instances_dirty = False
+
+    def upload_stim_object(self, mesh):
+        """
+        :param mesh: GlVertices to write to the VBO, usually stim_object
+        """
+        t_phase = time.perf_counter()
+        data = mesh.data # get vertex data, already interleaved float32
+        indexed = mesh.indices is not None
+        if indexed:
+            self.vertex_count = len(mesh.indices)
+        else:
+            self.vertex_count = len(data) // self.vertex_size
+        t_phase = self.profiler.record(self.phase_names['data'], t_phase)
+
+        # write data to VBO (and indices to the index buffer), rebuilding the VAO only if a buffer had to grow or
+        # the VAO has to switch between indexed and non-indexed drawing
+        rebuild = self.vbo.write(data)
+        if indexed:
+            rebuild = self.ibo.write(mesh.indices) or rebuild
+        if rebuild or indexed != self.indexed:
+            self.indexed = indexed
+            self.create_vertex_array()
+        self.profiler.record(self.phase_names['upload'], t_phase)
+
+        self.uploaded_object = mesh
+        self.uploaded_generation = mesh.generation
+
+    @property
+    def vertex_size(self):
         if self.use_texture:
-            # 3 points, 9 values (3 for vert, 4 for color, 2 for tex_coords), 4 bytes per value
-            self.vbo = self.ctx.buffer(reserve=self.num_tri*3*9*4)
-            self.vao = self.ctx.simple_vertex_array(self.prog, self.vbo, 'in_vert', 'in_color', 'in_tex_coord')
+            # x, y, z, r, g, b, a, texture x, texture y
+            return 9
         else:
-            # basic, no-texture vbo and vao:
-            self.vbo = self.ctx.buffer(reserve=self.num_tri*3*7*4)  # 3 points, 7 values, 4 bytes per value
-            self.vao = self.ctx.simple_vertex_array(self.prog, self.vbo, 'in_vert', 'in_color')
+            # x, y, z, r, g, b, a
+            return 7
 
-    def add_texture_gl(self, texture_image, texture_interpolation='LINEAR'):
-        # Update the texture booleans for the shader program
-        self.prog['rgb_texture'].value = self.rgb_texture
-        self.prog['use_texture'].value = self.use_texture
+    def create_vertex_objects(self):
+        """
+        Allocate the VBO and VAO once. The VBO starts out large enough for num_tri triangles and grows on demand.
+        """
+        # 3 points, vertex_size values, 4 bytes per value
+        self.vbo = DynamicBuffer(self.ctx, reserve=self.num_tri*3*self.vertex_size*4)
+        # 3 uint32 indices per triangle
+        self.ibo = DynamicBuffer(self.ctx, reserve=self.num_tri*3*4)
+        if self.use_instancing:
+            # offset (3), scale (3), color (4), 4 bytes per value
+            self.instance_vbo = DynamicBuffer(self.ctx, reserve=max(len(self.instance_data), 64)*10*4)
+        self.create_vertex_array()
+
+    def create_vertex_array(self):
+        if self.vao is not None:
+            self.vao.release()
 
+        if self.use_texture:
+            content = [(self.vbo.buffer, '3f 4f 2f', 'in_vert', 'in_color', 'in_tex_coord')]
+        else:
+            # basic, no-texture vao:
+            content = [(self.vbo.buffer, '3f 4f', 'in_vert', 'in_color')]
+
+        if self.use_instancing:
+            content.append((self.instance_vbo.buffer, '3f 3f 4f/i', 'in_offset', 'in_scale', 'in_instance_color'))
+
+        if self.indexed:
+            self.vao = self.ctx.vertex_array(self.prog, content, index_buffer=self.ibo.buffer, index_element_size=4)
+        else:
+            self.vao = self.ctx.vertex_array(self.prog, content)
+
+    def release(self):
+        """
+        Release the GL objects owned by this stimulus.
+        """
+        self.vao.release()
+        self.vbo.release()
+        self.ibo.release()
+        if self.instance_vbo is not None:
+            self.instance_vbo.release()
+        get_program_cache(self.ctx).release(self.prog)
+        if self.texture is not None:
+            self.texture.release()
+
+    def add_texture_gl(self, texture_image, texture_interpolation='LINEAR'):
         if self.rgb_texture:
             # RGB texture, shape = x, y, 3 (rgb)
             components = 3
@@ -126,9 +425,14 @@ class BaseProgram:
 
     def create_prog(self):
 
-        return self.ctx.program(vertex_shader=self.get_vertex_shader(), fragment_shader=self.get_fragment_shader())
+        return get_program_cache(self.ctx).acquire(self.ctx, self.get_vertex_shader(), self.get_fragment_shader())
 
     def get_vertex_shader(self):
+        if self.use_instancing:
+            return self.get_instanced_vertex_shader()
+        if self.single_pass:
+            return self.get_single_pass_vertex_shader()
+
         vertex_shader = '''
             #version 330
 
@@ -140,21 +444,92 @@ class BaseProgram:
             out vec2 v_tex_coord;
 
             uniform mat4 Mvp;
+            uniform mat4 Model;
+            uniform vec2 tex_shift;
 
             void main() {
                 v_color = in_color;
-                v_tex_coord = in_tex_coord;
-                gl_Position = Mvp * vec4(in_vert, 1.0);
+                v_tex_coord = in_tex_coord + tex_shift;
+                gl_Position = Mvp * Model * vec4(in_vert, 1.0);
             }
         '''
         return vertex_shader
 
+    def get_instanced_vertex_shader(self):
+        vertex_shader = '''
+            #version 330
+
+            in vec3 in_vert;
+            in vec4 in_color;
+            in vec2 in_tex_coord;
+
+            in vec3 in_offset;
+            in vec3 in_scale;
+            in vec4 in_instance_color;
+
+            out vec4 v_color;
+            out vec2 v_tex_coord;
+
+            uniform mat4 Mvp;
+            uniform mat4 Model;
+            uniform vec2 tex_shift;
+
+            void main() {
+                v_color = in_color * in_instance_color;
+                v_tex_coord = in_tex_coord + tex_shift;
+                gl_Position = Mvp * Model * vec4(in_vert * in_scale + in_offset, 1.0);
+            }
+        '''
+        return vertex_shader
+
+    def get_single_pass_vertex_shader(self):
+        vertex_shader = '''
+            #version 330
+
+            in vec3 in_vert;
+            in vec4 in_color;
+            in vec2 in_tex_coord;
+
+            out vec4 v_color;
+            out vec2 v_tex_coord;
+            out vec3 v_subscreen_pos;
+
+            uniform mat4 Mvps[%d];
+            uniform vec4 subscreen_rects[%d];
+            uniform mat4 Model;
+            uniform vec2 tex_shift;
+
+            void main() {
+                v_color = in_color;
+                v_tex_coord = in_tex_coord + tex_shift;
+                vec4 pos = Mvps[gl_InstanceID] * Model * vec4(in_vert, 1.0);
+
+                // clip coordinates (x, y, w) in the subscreen, checked against its frustum in the fragment shader
+                v_subscreen_pos = pos.xyw;
+
+                // map NDC [-1, 1] of the subscreen to its rect (lower left corner, width, height)
+                vec4 rect = subscreen_rects[gl_InstanceID];
+                pos.xy = (rect.xy + 0.5*rect.zw) * pos.w + 0.5*rect.zw * pos.xy;
+                gl_Position = pos;
+            }
+        ''' % (MAX_SUBSCREENS, MAX_SUBSCREENS)
+        return vertex_shader
+
     def get_fragment_shader(self):
+        if self.single_pass:
+            # discard fragments that fall outside of the subscreen they were drawn for
+            clip_input = 'in vec3 v_subscreen_pos;'
+            clip = 'if (any(greaterThan(abs(v_subscreen_pos.xy), vec2(v_subscreen_pos.z)))) discard;'
+        else:
+            clip_input = ''
+            clip = ''
+
         fragment_shader = '''
             #version 330
 
             in vec4 v_color;
             in vec2 v_tex_coord;
+            %s
 
             uniform bool use_texture;
             uniform bool rgb_texture;
@@ -163,6 +538,7 @@ class BaseProgram:
             out vec4 f_color;
 
             void main() {
+                %s
                 if (use_texture) {
                     vec4 texFrag = texture(texture_matrix, v_tex_coord);
                     if (rgb_texture) {
@@ -177,6 +553,6 @@ class BaseProgram:
                     f_color.a = v_color.a;
                 }
             }
-        '''
+        ''' % (clip_input, clip)
 
         return fragment_shader
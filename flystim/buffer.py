@@ -0,0 +1,45 @@
+"""
+GPU buffer management.
+
+Buffers are allocated once, when a stimulus is initialized, and then reused from frame to frame. The underlying
+GL storage is only reallocated when the data to be written no longer fits in the current capacity.
+"""
+
+
+class DynamicBuffer:
+    def __init__(self, ctx, reserve):
+        """
+        :param ctx: ModernGL context
+        :param reserve: initial capacity of the buffer, bytes
+        """
+        self.ctx = ctx
+        self.buffer = ctx.buffer(reserve=max(int(reserve), 1), dynamic=True)
+
+    @property
+    def capacity(self):
+        return self.buffer.size
+
+    def write(self, data):
+        """
+        Write data to the start of the buffer, growing the buffer if needed.
+
+        :param data: bytes-like object, e.g. a contiguous numpy array
+        :returns: True if the GL buffer was reallocated. Vertex arrays that reference it must then be rebuilt.
+        """
+        nbytes = memoryview(data).nbytes
+        if nbytes > self.buffer.size:
+            # grow geometrically so that slowly growing data doesn't reallocate every frame
+            new_size = max(nbytes, 2*self.buffer.size)
+            self.buffer.release()
+            self.buffer = self.ctx.buffer(reserve=new_size, dynamic=True)
+            reallocated = True
+        else:
+            # orphan the old storage so the driver doesn't stall on draw calls that are still reading it
+            self.buffer.orphan()
+            reallocated = False
+
+        self.buffer.write(data)
+        return reallocated
+
+    def release(self):
+        self.buffer.release()
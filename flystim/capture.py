@@ -0,0 +1,184 @@
+"""
+Asynchronous readback of rendered frames.
+
+Each captured frame is copied out of the framebuffer on the GPU, reduced to a single color channel (and optionally
+downsampled) and read into one of a ring of pixel buffer objects (PBOs). The read into a PBO returns immediately; the
+data is only mapped to host memory n_buffers - 1 frames later, by which time the GPU has finished with it, so capture
+doesn't stall the render loop the way a synchronous read of the whole framebuffer does.
+"""
+
+from collections import deque
+
+import moderngl
+import numpy as np
+
+
+class FrameCapture:
+    def __init__(self, ctx, n_buffers=3, channel=2, downsample_xy=1):
+        """
+        :param ctx: ModernGL context
+        :param n_buffers: number of PBOs in the ring. Frames are returned n_buffers - 1 calls to capture later.
+        :param channel: color channel to keep, 0 (red), 1 (green) or 2 (blue)
+        :param downsample_xy: factor to spatially downsample frames by on the GPU, see set_downsample_xy
+        """
+        self.ctx = ctx
+        self.n_buffers = max(int(n_buffers), 1)
+        self.channel = channel
+        self.downsample_xy = max(int(downsample_xy), 1)
+
+        self.prog = self.create_prog()
+        self.prog['channel'].value = channel
+
+        # full-viewport quad
+        pts = np.array([-1, -1, 1, -1, -1, 1, 1, 1])
+        self.vbo = self.ctx.buffer(pts.astype('f4').tobytes())
+        self.vao = self.ctx.simple_vertex_array(self.prog, self.vbo, 'pos')
+
+        # GL objects that depend on the frame size, see resize
+        self.size = None
+        self.texture = None
+        self.resolve_fbo = None
+        self.target_fbo = None
+        self.pbos = []
+
+        self.pending = deque()  # PBOs holding frames that haven't been read back yet, oldest first
+        self.next_buffer = 0
+
+    def resize(self, width, height):
+        """
+        :param width: width of the captured framebuffer, pixels
+        :param height: height of the captured framebuffer, pixels
+        """
+        self.release_size_objects()
+        self.size = (width, height)
+        self.prog['src_size'].value = (width, height)
+        self.prog['factor'].value = self.downsample_xy
+
+        # the framebuffer is copied into a texture (resolving multisampling), which is then drawn into a single
+        # channel, downsampled target
+        self.texture = self.ctx.texture((width, height), components=4)
+        self.resolve_fbo = self.ctx.framebuffer(color_attachments=[self.texture])
+        self.target_fbo = self.ctx.framebuffer(color_attachments=[self.ctx.renderbuffer(self.frame_size, components=1)])
+        self.pbos = [self.ctx.buffer(reserve=self.frame_size[0]*self.frame_size[1]) for _ in range(self.n_buffers)]
+
+    @property
+    def frame_size(self):
+        """
+        (width, height) of the captured frames, pixels. Partial blocks at the right and bottom edges count as a pixel.
+        """
+        return (-(-self.size[0] // self.downsample_xy), -(-self.size[1] // self.downsample_xy))
+
+    def set_downsample_xy(self, downsample_xy):
+        """
+        Average blocks of downsample_xy x downsample_xy pixels on the GPU before readback, so only the reduced frame
+        is transferred. Matches skimage.transform.downscale_local_mean(frame, (downsample_xy, downsample_xy))
+        followed by conversion to uint8.
+
+        :param downsample_xy: integer downsampling factor, 1 for full resolution
+        :returns: list of frames captured at the previous factor that hadn't been returned yet
+        """
+        frames = self.flush()
+        self.downsample_xy = max(int(downsample_xy), 1)
+        self.size = None  # resize on the next capture
+        return frames
+
+    def capture(self, src, width, height):
+        """
+        Start reading back the current contents of src.
+
+        :param src: framebuffer to capture, e.g. ctx.fbo
+        :param width: width of src, pixels
+        :param height: height of src, pixels
+        :returns: list of (height, width) uint8 frames whose readback has completed, oldest first, first row at the
+        top of the image. Usually this is the single frame captured n_buffers - 1 calls ago.
+        """
+        frames = []
+        if self.size != (width, height):
+            frames = self.flush()
+            self.resize(width, height)
+
+        self.ctx.copy_framebuffer(self.resolve_fbo, src)
+
+        # extract the channel and downsample, flipping rows so the image reads back top row first
+        self.target_fbo.use()
+        self.texture.use()
+        self.vao.render(mode=moderngl.TRIANGLE_STRIP)
+
+        pbo = self.pbos[self.next_buffer]
+        self.target_fbo.read_into(pbo, components=1, alignment=1)
+        self.pending.append(pbo)
+        self.next_buffer = (self.next_buffer + 1) % self.n_buffers
+
+        src.use()
+
+        while len(self.pending) > self.n_buffers - 1:
+            frames.append(self.read(self.pending.popleft()))
+
+        return frames
+
+    def read(self, pbo):
+        return np.frombuffer(pbo.read(), dtype='uint8').reshape(self.frame_size[1], self.frame_size[0])
+
+    def flush(self):
+        """
+        :returns: list of all frames that haven't been returned by capture yet, oldest first
+        """
+        frames = [self.read(pbo) for pbo in self.pending]
+        self.pending.clear()
+        return frames
+
+    def release_size_objects(self):
+        for obj in [self.texture, self.resolve_fbo, self.target_fbo] + self.pbos:
+            if obj is not None:
+                obj.release()
+        self.pending.clear()
+        self.pbos = []
+        self.next_buffer = 0
+
+    def release(self):
+        self.release_size_objects()
+        self.vao.release()
+        self.vbo.release()
+        self.prog.release()
+
+    def create_prog(self):
+        return self.ctx.program(
+            vertex_shader='''
+                #version 330
+
+                in vec2 pos;
+
+                void main() {
+                    gl_Position = vec4(pos, 0.0, 1.0);
+                }
+            ''',
+            fragment_shader='''
+                #version 330
+
+                uniform sampler2D frame;
+                uniform int channel;
+                uniform int factor;
+                uniform ivec2 src_size;
+
+                out vec4 out_color;
+
+                void main() {
+                    // row 0 of the target is the top row of the frame. Target pixel (x, y) is the mean of a
+                    // factor x factor block of the frame, counting pixels past the right and bottom edges as zero,
+                    // truncated to an integer as in downscale_local_mean(...).astype('uint8')
+                    ivec2 block = ivec2(gl_FragCoord.xy) * factor;
+                    int total = 0;
+                    for (int j = 0; j < factor; j++) {
+                        int row = block.y + j;
+                        for (int i = 0; i < factor; i++) {
+                            int col = block.x + i;
+                            if (col < src_size.x && row < src_size.y) {
+                                float value = texelFetch(frame, ivec2(col, src_size.y - 1 - row), 0)[channel];
+                                total += int(round(value * 255.0));
+                            }
+                        }
+                    }
+                    out_color = vec4(float(total / (factor * factor)) / 255.0, 0.0, 0.0, 1.0);
+                }
+            '''
+        )
@@ -8,13 +8,16 @@ import moderngl
 import numpy as np
 import pandas as pd
 import platform
-import qimage2ndarray
-from skimage.transform import downscale_local_mean
 
 from flystim import stimuli
-from flystim.trajectory import make_as_trajectory, return_for_time_t
-
-from flystim.perspective import GenPerspective
+from flystim.base import get_program_cache
+from flystim.trajectory import make_as_trajectory, return_for_time_t, return_for_times
+
+from flystim.perspective import GenPerspective, PerspectiveCache
+from flystim.profiling import FrameProfiler, FrameDropDetector
+from flystim.pacing import make_pacer
+from flystim.capture import FrameCapture
+from flystim.movie import MovieWriter
 from flystim.square import SquareProgram
 from flystim.screen import Screen
 from math import radians
@@ -56,6 +59,14 @@ class StimDisplay(QtOpenGL.QGLWidget):
 
         # profiling information
         self.profile_frame_times = []
+        self.profiler = FrameProfiler()
+        self.frame_drop_detector = FrameDropDetector()
+        self.frame_drop_report = None
+
+        # frame pacing, see set_frame_pacing
+        self.pacer = None
+        self.frame_pacing_mode = 'finish'
+        self.frames_in_flight = 1
 
         # save handles to screen and server
         self.screen = screen
@@ -65,6 +76,7 @@ class StimDisplay(QtOpenGL.QGLWidget):
         # Initialize stuff for rendering & saving stim frames
         self.stim_frames = []
         self.append_stim_frames = False
+        self.movie_writer = None
         self.pre_render = False
         self.current_time_index = None
 
@@ -73,6 +85,10 @@ class StimDisplay(QtOpenGL.QGLWidget):
         self.save_pos_history_dir = None
         self.pos_history = []
 
+        # perspective matrix of each subscreen as a function of fly pose
+        self.perspective_caches = [PerspectiveCache(pa=x.pa, pb=x.pb, pc=x.pc, horizontal_flip=screen.horizontal_flip) for x in screen.subscreens]
+        self.pre_render_perspectives = None
+
         # make program for rendering the corner square
         self.square_program = SquareProgram(screen=screen)
 
@@ -91,13 +107,18 @@ class StimDisplay(QtOpenGL.QGLWidget):
 
     def initializeGL(self):
         # get OpenGL context
-        self.ctx = moderngl.create_context() # TODO: can we make this run headless in render_movie_mode?
+        self.ctx = moderngl.create_context() # for rendering movies without a window, see flystim.headless.OffscreenRenderer
         self.ctx.enable(moderngl.BLEND) # enable alpha blending
         self.ctx.enable(moderngl.DEPTH_TEST) # enable depth test
 
         # initialize square program
         self.square_program.initialize(self.ctx)
 
+        self.pacer = make_pacer(self.ctx, mode=self.frame_pacing_mode, frames_in_flight=self.frames_in_flight, profiler=self.profiler)
+
+        # asynchronous readback of the blue channel, for append_stim_frames
+        self.frame_capture = FrameCapture(self.ctx, channel=2)
+
     def get_stim_time(self, t):
         stim_time = 0
 
@@ -109,15 +130,27 @@ class StimDisplay(QtOpenGL.QGLWidget):
     def clear_viewport(self, viewport):
         self.ctx.clear(red=self.idle_background, green=self.idle_background, blue=self.idle_background, alpha=1.0, viewport=viewport)
 
+    def release(self):
+        """
+        Release the stimuli and the shader programs they compiled, before the GL context goes away.
+        """
+        for stim in self.stim_list:
+            stim.release()
+        self.stim_list = []
+        get_program_cache(self.ctx).clear()
+
     def paintGL(self):
-        # t0 = time.time() # benchmarking
+        t_frame = time.perf_counter()
 
         # quit if desired
         if self.server.shutdown_flag.is_set():
+            self.release()
             self.app.quit()
+            return
 
         # handle RPC input
         self.server.process_queue()
+        t_phase = self.profiler.record('process_queue', t_frame)
 
         # get display size and set viewports
         display_width = self.width()*self.devicePixelRatio()
@@ -145,7 +178,13 @@ class StimDisplay(QtOpenGL.QGLWidget):
                 self.set_global_theta_offset(return_for_time_t(self.fly_theta_trajectory, self.get_stim_time(t)))  # deg -> radians
 
             # For each subscreen associated with this screen: get the perspective matrix
-            perspectives = [get_perspective(self.global_fly_pos, self.global_theta_offset, self.global_phi_offset, x.pa, x.pb, x.pc, self.screen.horizontal_flip) for x in self.screen.subscreens]
+            t_phase = time.perf_counter()
+            if self.pre_render and self.pre_render_perspectives is not None:
+                perspectives = self.pre_render_perspectives[min(self.current_time_index, len(self.pre_render_perspectives)-1)]
+            else:
+                # same angles as get_perspective
+                perspectives = [cache.get(self.global_fly_pos, self.global_theta_offset, radians(self.global_phi_offset)) for cache in self.perspective_caches]
+            t_phase = self.profiler.record('perspective', t_phase)
 
             for stim in self.stim_list:
                 if self.stim_started:
@@ -156,34 +195,35 @@ class StimDisplay(QtOpenGL.QGLWidget):
                                   fly_heading=[self.global_theta_offset+0, self.global_phi_offset+0])
                 else:
                     [self.clear_viewport(viewport=x) for x in self.subscreen_viewports]
+            t_phase = self.profiler.record('stimuli', t_phase)
 
             self.profile_frame_times.append(t)
+            if self.stim_started:
+                self.frame_drop_detector.frame(t_frame)
         else:
             [self.clear_viewport(viewport=x) for x in self.subscreen_viewports]
 
         # draw the corner square
+        t_phase = time.perf_counter()
         self.square_program.paint()
+        t_phase = self.profiler.record('square', t_phase)
 
         # update the window
-        self.ctx.finish()
+        self.pacer.end_frame()
         self.update()
-
-        # clear the buffer objects
-        for stim in self.stim_list:
-            if self.stim_started:
-                stim.vbo.release()
-                stim.vao.release()
+        t_phase = self.profiler.record('finish', t_phase)
 
         if self.stim_started:
-            # print('paintGL {:.2f} ms'.format((time.time()-t0)*1000)) #benchmarking
-
             if self.save_pos_history:
                 self.pos_history.append(np.append(self.global_fly_pos, [self.global_theta_offset, self.global_phi_offset])) # np.append creates a copy
 
             if self.append_stim_frames:
-                # grab frame buffer, convert to array, grab blue channel, append to list of stim_frames
-                self.stim_frames.append(qimage2ndarray.rgb_view(self.grabFrameBuffer())[:, :, 2])
+                # start reading back the blue channel. Frames arrive a couple of frames later, the rest in stop_stim
+                self.store_stim_frames(self.frame_capture.capture(self.ctx.fbo, int(display_width), int(display_height)))
                 self.current_time_index += 1
+                self.profiler.record('capture', t_phase)
+
+        self.profiler.record('frame', t_frame)
 
     ###########################################
     # control functions
@@ -208,24 +248,45 @@ class StimDisplay(QtOpenGL.QGLWidget):
         :param name: Name of the stimulus (should be a class name)
         """
         if hold is False:
+            for stim in self.stim_list:
+                stim.release()
             self.stim_list = []
 
         stim = getattr(stimuli, name)(screen=self.screen)
+        # give held copies of the same stimulus distinct names in the profiler
+        n_same = sum(type(x).__name__ == name for x in self.stim_list)
+        stim.set_profiler(self.profiler, name=name if n_same == 0 else '{}_{}'.format(name, n_same))
         stim.initialize(self.ctx)
+        # meshes built in configure are tessellated for the current display size
+        display_width = self.width()*self.devicePixelRatio()
+        display_height = self.height()*self.devicePixelRatio()
+        stim.lod.set_viewports([sub.get_viewport(display_width, display_height) for sub in self.screen.subscreens])
         stim.kwargs = kwargs
         stim.configure(**stim.kwargs) # Configure stim on load
         self.stim_list.append(stim)
 
-    def start_stim(self, t, save_pos_history=False, append_stim_frames=False, pre_render=False, pre_render_timepoints=None):
+    def start_stim(self, t, save_pos_history=False, append_stim_frames=False, pre_render=False, pre_render_timepoints=None,
+                   movie_file_path=None, movie_downsample_xy=4, capture_downsample_xy=1):
         """
         Start the stimulus animation, using the given time as t=0.
 
         :param t: Time corresponding to t=0 of the animation
-        :param append_stim_frames: bool, append frames to stim_frames list, for saving stim movie. May affect performance.
+        :param append_stim_frames: bool, append frames to stim_frames list, for saving stim movie. Frames are read back
+        asynchronously, see flystim.capture.
+        :param movie_file_path: if given, captured frames are downsampled and streamed to this .npy file on a background
+        thread instead of being kept in stim_frames. The file is complete when stop_stim returns. Implies append_stim_frames.
+        :param movie_downsample_xy: factor to spatially downsample streamed frames by
+        :param capture_downsample_xy: factor to spatially downsample captured frames by on the GPU, before they are read
+        back. Applied before movie_downsample_xy, or before the downsample_xy of save_rendered_movie.
         """
         self.profile_frame_times = []
+        self.profiler.reset()
+        self.frame_drop_detector.start_epoch(refresh_period=self.get_refresh_period())
         self.stim_frames = []
-        self.append_stim_frames = append_stim_frames
+        self.append_stim_frames = append_stim_frames or movie_file_path is not None
+        if movie_file_path is not None:
+            self.movie_writer = MovieWriter(movie_file_path, downsample_xy=movie_downsample_xy)
+        self.frame_capture.set_downsample_xy(capture_downsample_xy)
         self.pre_render = pre_render
         self.current_time_index = 0
         self.pre_render_timepoints = pre_render_timepoints
@@ -240,15 +301,58 @@ class StimDisplay(QtOpenGL.QGLWidget):
         else:
             self.stim_start_time = t
 
+        if pre_render and self.use_fly_trajectory:
+            self.pre_render_perspectives = self.get_pre_render_perspectives(pre_render_timepoints)
+        else:
+            self.pre_render_perspectives = None
+
+    def store_stim_frames(self, frames):
+        """
+        :param frames: list of captured frames, sent to the movie writer if one was set up in start_stim
+        """
+        if self.movie_writer is not None:
+            for frame in frames:
+                self.movie_writer.write(frame)
+        else:
+            self.stim_frames.extend(frames)
+
+    def get_pre_render_perspectives(self, timepoints):
+        """
+        Evaluate the fly trajectory at all pre-render timepoints and compute the perspective matrices in one batch.
+
+        :param timepoints: stimulus times (sec)
+        :returns: list with the perspective matrix bytes of each subscreen, for each timepoint
+        """
+        timepoints = np.asarray(timepoints, dtype=float)
+        fly_pos = np.stack([return_for_times(self.fly_x_trajectory, timepoints),
+                            return_for_times(self.fly_y_trajectory, timepoints),
+                            np.zeros(len(timepoints))], axis=-1)
+        theta = np.radians(return_for_times(self.fly_theta_trajectory, timepoints))
+
+        matrices = [cache.matrices(fly_pos, theta, radians(self.global_phi_offset)).astype('f4') for cache in self.perspective_caches]
+        return [[m[t_ind].tobytes(order='F') for m in matrices] for t_ind in range(len(timepoints))]
+
     def stop_stim(self, print_profile=False):
         """
         Stops the stimulus animation and removes it from the display.
+
+        :returns: frame drop report for the epoch, see get_frame_drop_report
         """
+        self.frame_drop_report = self.frame_drop_detector.report()
+
+        # collect captured frames that are still being read back
+        if self.append_stim_frames:
+            self.store_stim_frames(self.frame_capture.flush())
+        if self.movie_writer is not None:
+            mov_shape = self.movie_writer.close()
+            print('Streamed movie of shape {} to {}'.format(mov_shape, self.movie_writer.file_path), flush=True)
+            self.movie_writer = None
+
         # clear texture
         self.ctx.clear_samplers()
 
         for stim in self.stim_list:
-            stim.prog.release()
+            stim.release()
 
         # print profiling information if applicable
         if (print_profile):
@@ -262,6 +366,10 @@ class StimDisplay(QtOpenGL.QGLWidget):
                 if print_profile:
                     print('*** ' + stim_names + ' ***')
                     print(fps_data.describe(percentiles=[0.01, 0.05, 0.1, 0.9, 0.95, 0.99]))
+                    print('*** frame phases (ms) ***')
+                    print(pd.DataFrame(self.profiler.summary()).T.to_string(float_format='{:.3f}'.format))
+                    print('*** dropped frames: {} in {} events ***'.format(self.frame_drop_report['n_dropped'],
+                                                                          self.frame_drop_report['n_drop_events']))
                     print('*** end of statistics ***')
 
 
@@ -283,6 +391,69 @@ class StimDisplay(QtOpenGL.QGLWidget):
         self.set_global_phi_offset(0)
         self.perspective = get_perspective(self.global_fly_pos, self.global_theta_offset, self.global_phi_offset, self.screen.subscreens[0].pa, self.screen.subscreens[0].pb, self.screen.subscreens[0].pc, self.screen.horizontal_flip)
 
+        return self.frame_drop_report
+
+    def get_frame_drop_report(self):
+        """
+        Report of missed vsyncs for the running epoch, or for the last epoch if no stimulus is running.
+
+        :returns: dict with n_frames, refresh_period (sec), n_dropped (total missed vsyncs), n_drop_events,
+        drop_times (sec since first frame), missed_vsyncs (per drop event) and max_interval (sec)
+        """
+        if self.stim_started or self.frame_drop_report is None:
+            return self.frame_drop_detector.report()
+        return self.frame_drop_report
+
+    def set_frame_pacing(self, mode='finish', frames_in_flight=1):
+        """
+        Sets how the render loop waits for the GPU at the end of each frame.
+
+        :param mode: 'finish' blocks until the GPU is done with every frame. 'fence' only waits until at most
+        frames_in_flight frames are queued on the GPU, so CPU work for the next frame overlaps with rendering.
+        Requires PyOpenGL; falls back to 'finish' otherwise.
+        :param frames_in_flight: number of queued frames allowed in 'fence' mode. Higher values improve throughput
+        at the cost of up to frames_in_flight frames of added latency, which is recorded as 'gpu_latency' in the profile.
+        """
+        self.frame_pacing_mode = mode
+        self.frames_in_flight = frames_in_flight
+
+        if self.pacer is not None:
+            self.makeCurrent()
+            self.pacer.release()
+            self.pacer = make_pacer(self.ctx, mode=mode, frames_in_flight=frames_in_flight, profiler=self.profiler)
+
+    def get_refresh_period(self):
+        """
+        :returns: refresh period (sec) of the display showing this window, or None if it isn't known
+        """
+        window = self.windowHandle()
+        if window is None or window.screen() is None or window.screen().refreshRate() <= 0:
+            return None
+        return 1.0 / window.screen().refreshRate()
+
+    def get_profile_summary(self, percentiles=(1, 5, 50, 95, 99)):
+        """
+        Per-phase frame timing statistics (milliseconds) since the last start_stim or reset_profile.
+        """
+        return self.profiler.summary(percentiles=percentiles)
+
+    def get_profile_histogram(self, phase, bins=20):
+        """
+        Histogram of durations (milliseconds) for one phase, e.g. 'finish' or 'MovingPatch.eval_at'.
+        """
+        return self.profiler.histogram(phase, bins=bins)
+
+    def dump_profile(self, file_path):
+        """
+        Save the raw per-phase frame timings (sec) to an .npz file.
+
+        :param file_path: full file path of saved file
+        """
+        self.profiler.dump(file_path)
+
+    def reset_profile(self):
+        self.profiler.reset()
+
     def save_rendered_movie(self, file_path, downsample_xy=4):
         """
         Save rendered stim frames from stim_frames as 3D np array
@@ -291,10 +462,14 @@ class StimDisplay(QtOpenGL.QGLWidget):
         :param file_path: full file path of saved array
         """
         print('shape is {}'.format(len(self.stim_frames)))
-        pre_size = np.stack(self.stim_frames, axis=2).shape
-        mov = downscale_local_mean(np.stack(self.stim_frames, axis=2), factors=(downsample_xy, downsample_xy, 1)).astype('uint8')
-        np.save(file_path, mov)
-        print('Downsampled from {} to {} and saved to {}'.format(pre_size, mov.shape, file_path), flush=True)
+        pre_size = self.stim_frames[0].shape + (len(self.stim_frames),) if self.stim_frames else (0, 0, 0)
+
+        # downsample and write one frame at a time, rather than stacking copies of the whole movie
+        movie_writer = MovieWriter(file_path, downsample_xy=downsample_xy)
+        for frame in self.stim_frames:
+            movie_writer.write(frame)
+        mov_shape = movie_writer.close()
+        print('Downsampled from {} to {} and saved to {}'.format(pre_size, mov_shape, file_path), flush=True)
 
     def set_save_pos_history_dir(self, save_dir):
         self.save_pos_history_dir = os.path.join(save_dir, '_'.join(['screen', self.screen.name]))
@@ -464,6 +639,12 @@ def main():
     server.register_function(stim_display.start_stim)
     server.register_function(stim_display.stop_stim)
     server.register_function(stim_display.save_rendered_movie)
+    server.register_function(stim_display.get_profile_summary)
+    server.register_function(stim_display.get_profile_histogram)
+    server.register_function(stim_display.dump_profile)
+    server.register_function(stim_display.reset_profile)
+    server.register_function(stim_display.get_frame_drop_report)
+    server.register_function(stim_display.set_frame_pacing)
     server.register_function(stim_display.start_corner_square)
     server.register_function(stim_display.stop_corner_square)
     server.register_function(stim_display.white_corner_square)
@@ -0,0 +1,290 @@
+"""
+Offscreen rendering of stimulus movies.
+
+OffscreenRenderer draws stimuli into a framebuffer of a standalone moderngl context, so no window, Qt event loop or
+vsync is involved and frames are rendered as fast as the GPU (or a software renderer like Mesa llvmpipe) allows.
+Frames are produced the same way as StimDisplay.paintGL with pre_render and append_stim_frames.
+
+render_movie_parallel splits a long timeline across worker processes, each with its own OffscreenRenderer.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+import moderngl
+import numpy as np
+from math import radians
+
+from flystim import stimuli
+from flystim.base import get_program_cache
+from flystim.capture import FrameCapture
+from flystim.perspective import PerspectiveCache
+from flystim.movie import MovieWriter
+from flystim.profiling import FrameProfiler
+from flystim.square import SquareProgram
+from flystim.trajectory import make_as_trajectory, return_for_time_t
+
+
+class OffscreenRenderer:
+    def __init__(self, screen, width=640, height=480, backend=None, draw_corner_square=False):
+        """
+        :param screen: flystim.screen.Screen object, defines the subscreens and their viewports
+        :param width: width of the rendered frames, pixels
+        :param height: height of the rendered frames, pixels
+        :param backend: moderngl standalone context backend, e.g. 'egl'. Default: the default backend, or 'egl' if that fails
+        :param draw_corner_square: draw the photodiode synchronization square, as on the display
+        """
+        self.screen = screen
+        self.width = width
+        self.height = height
+
+        # standalone context and framebuffer, nothing is shown on screen. Without a backend, the default context is
+        # tried first, falling back to EGL on machines without an X server.
+        if backend is None:
+            try:
+                self.ctx = moderngl.create_context(standalone=True)
+            except Exception:
+                self.ctx = moderngl.create_context(standalone=True, backend='egl')
+        else:
+            self.ctx = moderngl.create_context(standalone=True, backend=backend)
+        self.ctx.enable(moderngl.BLEND) # enable alpha blending
+        self.ctx.enable(moderngl.DEPTH_TEST) # enable depth test
+
+        self.fbo = self.ctx.framebuffer(color_attachments=[self.ctx.renderbuffer((width, height), components=4)],
+                                        depth_attachment=self.ctx.depth_renderbuffer((width, height)))
+        self.fbo.use()
+        self.frame_buffer = np.empty((height, width, 3), dtype='uint8')
+
+        self.subscreen_viewports = [sub.get_viewport(width, height) for sub in screen.subscreens]
+        self.perspective_caches = [PerspectiveCache(pa=x.pa, pb=x.pb, pc=x.pc, horizontal_flip=screen.horizontal_flip) for x in screen.subscreens]
+
+        self.square_program = None
+        if draw_corner_square:
+            self.square_program = SquareProgram(screen=screen)
+            self.square_program.initialize(self.ctx)
+            self.square_program.set_viewport(width, height)
+
+        self.stim_list = []
+        self.profiler = FrameProfiler()
+
+        # fly pose, see StimDisplay
+        self.global_fly_pos = np.array([0, 0, 0], dtype=float)
+        self.global_theta_offset = 0
+        self.global_phi_offset = 0
+
+        self.use_fly_trajectory = False
+        self.fly_x_trajectory = None
+        self.fly_y_trajectory = None
+        self.fly_theta_trajectory = None
+
+    def set_fly_trajectory(self, x_trajectory, y_trajectory, theta_trajectory):
+        """
+        :param x_trajectory: meters, dict from Trajectory including time, value pairs
+        :param y_trajectory: meters, dict from Trajectory including time, value pairs
+        :param theta_trajectory: degrees on the azimuthal plane, dict from Trajectory including time, value pairs
+        """
+        self.use_fly_trajectory = True
+        self.fly_x_trajectory = make_as_trajectory(x_trajectory)
+        self.fly_y_trajectory = make_as_trajectory(y_trajectory)
+        self.fly_theta_trajectory = make_as_trajectory(theta_trajectory)
+
+    def set_fly_pose(self, x=0, y=0, z=0, theta=0, phi=0):
+        """
+        :param (x, y, z): fly position, meters
+        :param theta: fly heading along azimuth, degrees
+        :param phi: fly heading along elevation, degrees
+        """
+        self.global_fly_pos = np.array([x, y, z], dtype=float)
+        self.global_theta_offset = radians(theta)
+        self.global_phi_offset = radians(phi)
+
+    def load_stim(self, name, hold=False, **kwargs):
+        """
+        Load the stimulus with the given name, using the given params. See StimDisplay.load_stim.
+
+        :param name: Name of the stimulus (should be a class name)
+        """
+        if hold is False:
+            for stim in self.stim_list:
+                stim.release()
+            self.stim_list = []
+
+        stim = getattr(stimuli, name)(screen=self.screen)
+        n_same = sum(type(x).__name__ == name for x in self.stim_list)
+        stim.set_profiler(self.profiler, name=name if n_same == 0 else '{}_{}'.format(name, n_same))
+        stim.initialize(self.ctx)
+        stim.lod.set_viewports(self.subscreen_viewports)
+        stim.kwargs = kwargs
+        stim.configure(**stim.kwargs)
+        self.stim_list.append(stim)
+
+    def render_frame(self, t):
+        """
+        :param t: stimulus time (sec)
+        :returns: (height, width, 3) uint8 RGB frame, first row at the top. The array is reused by the next call.
+        """
+        t_frame = time.perf_counter()
+        self.draw_frame(t)
+
+        t_phase = time.perf_counter()
+        self.fbo.read_into(self.frame_buffer, components=3)
+        self.profiler.record('capture', t_phase)
+        self.profiler.record('frame', t_frame)
+
+        # GL rows start at the bottom of the image
+        return self.frame_buffer[::-1]
+
+    def draw_frame(self, t):
+        """
+        Draw the stimuli at time t into the framebuffer, without reading it back.
+
+        :param t: stimulus time (sec)
+        """
+
+        if self.use_fly_trajectory:
+            self.global_fly_pos = np.array([return_for_time_t(self.fly_x_trajectory, t),
+                                            return_for_time_t(self.fly_y_trajectory, t),
+                                            0], dtype=float)
+            self.global_theta_offset = radians(return_for_time_t(self.fly_theta_trajectory, t))
+
+        self.ctx.viewport = (0, 0, self.width, self.height)
+        self.fbo.clear(0, 0, 0, 1)
+
+        # same angles as StimDisplay.paintGL
+        perspectives = [cache.get(self.global_fly_pos, self.global_theta_offset, radians(self.global_phi_offset)) for cache in self.perspective_caches]
+        for stim in self.stim_list:
+            stim.paint_at(t,
+                          self.subscreen_viewports,
+                          perspectives,
+                          fly_position=self.global_fly_pos.copy(),
+                          fly_heading=[self.global_theta_offset+0, self.global_phi_offset+0])
+
+        if self.square_program is not None:
+            self.square_program.paint()
+
+    def render(self, timepoints, channel=2):
+        """
+        Render one frame per timepoint.
+
+        :param timepoints: stimulus times (sec)
+        :param channel: color channel to keep (default: blue, as in StimDisplay.stim_frames), or None to keep RGB
+        :returns: (height, width, n_frames) uint8 array, or (height, width, 3, n_frames) if channel is None
+        """
+        if channel is None:
+            frames = np.empty((self.height, self.width, 3, len(timepoints)), dtype='uint8')
+        else:
+            frames = np.empty((self.height, self.width, len(timepoints)), dtype='uint8')
+
+        for t_ind, t in enumerate(timepoints):
+            frame = self.render_frame(t)
+            if channel is None:
+                frames[..., t_ind] = frame
+            else:
+                frames[..., t_ind] = frame[:, :, channel]
+
+        return frames
+
+    def render_movie(self, file_path, timepoints, downsample_xy=4):
+        """
+        Render the blue channel at each timepoint and save it as a 3D np array, like StimDisplay.save_rendered_movie.
+
+        :param file_path: full file path of saved array
+        :param timepoints: stimulus times (sec)
+        :param downsample_xy: factor to spatially downsample the frames by
+        :returns: shape of the saved (height, width, n_frames) array
+        """
+        # the blue channel is downsampled on the GPU and read back asynchronously, then written to disk on a
+        # background thread while the next frames render
+        frame_capture = FrameCapture(self.ctx, channel=2, downsample_xy=downsample_xy)
+        movie_writer = MovieWriter(file_path)
+        for t in timepoints:
+            t_frame = time.perf_counter()
+            self.draw_frame(t)
+            t_phase = time.perf_counter()
+            for frame in frame_capture.capture(self.fbo, self.width, self.height):
+                movie_writer.write(frame)
+            self.profiler.record('capture', t_phase)
+            self.profiler.record('frame', t_frame)
+
+        for frame in frame_capture.flush():
+            movie_writer.write(frame)
+        frame_capture.release()
+
+        return movie_writer.close()
+
+    def release(self):
+        for stim in self.stim_list:
+            stim.release()
+        self.stim_list = []
+        get_program_cache(self.ctx).clear()
+        self.fbo.release()
+        self.ctx.release()
+
+
+def render_movie_parallel(file_path, screen, stims, timepoints, n_workers=None, chunk_size=None, width=640, height=480,
+                          backend=None, downsample_xy=4, fly_trajectory=None):
+    """
+    Render a movie with a pool of worker processes and save it like OffscreenRenderer.render_movie.
+
+    The timepoints are split into consecutive chunks, each rendered by a worker with its own GL context, and the
+    chunks are reassembled in order. Each worker loads the stimuli fresh for every chunk, so the stimuli should be
+    deterministic in t (e.g. seeded noise like RandomGrid or UniformWhiteNoise). Stimuli that accumulate state from
+    frame to frame, like LoomingCircle, will restart at each chunk boundary.
+
+    :param file_path: full file path of saved array
+    :param screen: flystim.screen.Screen object
+    :param stims: list of dicts, each with the 'name' of a stimulus and its params, as passed to load_stim
+    :param timepoints: stimulus times (sec)
+    :param n_workers: number of worker processes, defaults to the number of CPUs
+    :param chunk_size: number of frames per chunk, defaults to splitting the timepoints evenly across workers
+    :param (width, height, backend): see OffscreenRenderer
+    :param downsample_xy: factor to spatially downsample the frames by
+    :param fly_trajectory: optional (x_trajectory, y_trajectory, theta_trajectory), see set_fly_trajectory
+    :returns: shape of the saved (height, width, n_frames) array
+    """
+    timepoints = np.asarray(timepoints, dtype=float)
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if chunk_size is None:
+        chunk_size = max(int(np.ceil(len(timepoints) / n_workers)), 1)
+
+    chunk_dir = tempfile.mkdtemp(prefix='flystim_chunks_', dir=os.path.dirname(os.path.abspath(file_path)))
+    try:
+        jobs = [(os.path.join(chunk_dir, 'chunk_{:06d}.npy'.format(c_ind)), screen, stims, timepoints[start:start+chunk_size],
+                 width, height, backend, downsample_xy, fly_trajectory)
+                for c_ind, start in enumerate(range(0, len(timepoints), chunk_size))]
+
+        # GL contexts don't survive fork, so workers are started fresh
+        with multiprocessing.get_context('spawn').Pool(processes=n_workers) as pool:
+            chunk_paths = pool.starmap(_render_chunk, jobs)
+
+        # copy the chunks into the output in order, one at a time
+        chunks = [np.load(chunk_path, mmap_mode='r') for chunk_path in chunk_paths]
+        shape = chunks[0].shape[:2] + (sum(chunk.shape[2] for chunk in chunks),) if chunks else (0, 0, 0)
+        mov = np.lib.format.open_memmap(file_path, mode='w+', dtype='uint8', shape=shape)
+        start = 0
+        for chunk in chunks:
+            mov[:, :, start:start+chunk.shape[2]] = chunk
+            start += chunk.shape[2]
+        mov.flush()
+        del mov, chunks
+    finally:
+        shutil.rmtree(chunk_dir)
+
+    return shape
+
+
+def _render_chunk(chunk_path, screen, stims, timepoints, width, height, backend, downsample_xy, fly_trajectory):
+    renderer = OffscreenRenderer(screen, width=width, height=height, backend=backend)
+    if fly_trajectory is not None:
+        renderer.set_fly_trajectory(*fly_trajectory)
+    for stim in stims:
+        kwargs = stim.copy()
+        name = kwargs.pop('name')
+        renderer.load_stim(name, hold=True, **kwargs)
+
+    renderer.render_movie(chunk_path, timepoints, downsample_xy=downsample_xy)
+    renderer.release()
+    return chunk_path
@@ -0,0 +1,138 @@
+"""
+Level of detail for tessellated stimuli.
+
+Curved stimuli (circles, ellipses, spherical patches, cylinders) are drawn as polygons. A polygon with n sides that
+follows an arc of angular radius rho (radians, as seen by the fly) over an angle span deviates from the arc by about
+rho * (span/n)**2 / 8 radians at the middle of each side. LevelOfDetail turns that angular error into pixels using the
+pixel density of the subscreens, and picks the smallest n that keeps the error below a tolerance, so that triangle
+counts follow what is actually visible on the screen instead of a fixed constant.
+
+The pixel density is taken from the SubScreen corners pa, pb, pc and the viewport size in pixels. A screen seen at a
+grazing angle has more pixels per radian near its far edge, so the densest point of each subscreen is used, and the
+densest subscreen is used overall.
+
+Level of detail is off unless the screen sets lod_tolerance (see flystim.screen.Screen). Without it, every helper
+returns its default, the fixed tessellation stimuli have always used, so existing rigs keep drawing the same meshes.
+"""
+
+import numpy as np
+
+DEFAULT_DISPLAY_SIZE = (1920, 1080)  # assumed before the viewports are known, pixels
+
+
+def subscreen_pixels_per_radian(subscreen, viewport_width, viewport_height):
+    """
+    Highest pixel density of a subscreen, as seen by a fly at the origin.
+
+    :param subscreen: flystim.screen.SubScreen
+    :param viewport_width: width of the subscreen viewport, pixels
+    :param viewport_height: height of the subscreen viewport, pixels
+    :returns: pixels per radian of visual angle at the densest point of the subscreen
+    """
+    pa = np.asarray(subscreen.pa, dtype=float)
+    pb = np.asarray(subscreen.pb, dtype=float)
+    pc = np.asarray(subscreen.pc, dtype=float)
+    vr = pb - pa
+    vu = pc - pa
+
+    pixels_per_meter = max(viewport_width / np.linalg.norm(vr), viewport_height / np.linalg.norm(vu))
+
+    # perpendicular distance from the fly to the screen plane
+    normal = np.cross(vr, vu)
+    distance = abs(np.dot(pa, normal)) / np.linalg.norm(normal)
+
+    # a step dx along the screen at distance r from the fly covers at least dx * distance / r**2 radians, so pixels
+    # per radian are highest at the corner farthest from the fly
+    corners = np.stack([pa, pb, pc, pb + pc - pa])
+    r = np.linalg.norm(corners, axis=1).max()
+    distance = max(distance, 1e-3 * r)  # the fly is in the screen plane, avoid dividing by 0
+
+    return pixels_per_meter * r**2 / distance
+
+
+class LevelOfDetail:
+    def __init__(self, screen, tolerance=None, max_steps=256):
+        """
+        :param screen: flystim.screen.Screen object
+        :param tolerance: largest allowed deviation from the true outline, pixels. Defaults to screen.lod_tolerance.
+        If both are None, level of detail is off and the helpers return their defaults.
+        :param max_steps: upper limit on the number of steps along any arc
+        """
+        self.screen = screen
+        self.tolerance = getattr(screen, 'lod_tolerance', None) if tolerance is None else tolerance
+        self.max_steps = max_steps
+
+        self.viewports = None
+        self.pixels_per_radian = None
+        self.set_viewports([sub.get_viewport(*DEFAULT_DISPLAY_SIZE) for sub in screen.subscreens])
+
+    def set_viewports(self, viewports):
+        """
+        :param viewports: list of viewports (xmin, ymin, width, height) for each subscreen, pixels
+        """
+        viewports = [tuple(viewport) for viewport in viewports]
+        if viewports == self.viewports:
+            return
+
+        self.viewports = viewports
+        self.pixels_per_radian = max(subscreen_pixels_per_radian(sub, viewport[2], viewport[3])
+                                     for sub, viewport in zip(self.screen.subscreens, viewports))
+
+    @property
+    def enabled(self):
+        return self.tolerance is not None
+
+    def arc_steps(self, span, rho=1.0, min_steps=1, default=None):
+        """
+        :param span: angle covered by the arc, radians
+        :param rho: angular radius of the arc as seen by the fly, radians. 1 for arcs on a sphere or cylinder around
+        the fly, smaller for the outline of a small object.
+        :param min_steps: lower limit on the number of steps
+        :param default: number of steps returned when level of detail is off
+        :returns: number of steps for the polygon along the arc
+        """
+        if not self.enabled:
+            return default
+
+        steps = int(np.ceil(abs(span) * np.sqrt(abs(rho) * self.pixels_per_radian / (8 * self.tolerance))))
+        return int(np.clip(steps, min_steps, self.max_steps))
+
+    def circle_steps(self, radius, min_steps=8, default=36):
+        """
+        :param radius: angular radius of the circle, degrees
+        :returns: number of steps around the circle
+        """
+        return self.arc_steps(2 * np.pi, rho=np.radians(radius), min_steps=min_steps, default=default)
+
+    def ellipse_steps(self, width, height, min_steps=8, default=36):
+        """
+        :param width: angular width of the ellipse, degrees
+        :param height: angular height of the ellipse, degrees
+        :returns: number of steps around the ellipse
+        """
+        return self.circle_steps(max(width, height) / 2, min_steps=min_steps, default=default)
+
+    def grid_steps(self, width, height, min_steps=1, default=(6, 6)):
+        """
+        :param width: angular width of a patch on a sphere or cylinder around the fly, degrees
+        :param height: angular height of the patch, degrees
+        :returns: (n_steps_x, n_steps_y) for the patch grid
+        """
+        return (self.arc_steps(np.radians(width), min_steps=min_steps, default=default[0]),
+                self.arc_steps(np.radians(height), min_steps=min_steps, default=default[1]))
+
+    def cylinder_faces(self, angular_extent=360, min_steps=3, default=32):
+        """
+        :param angular_extent: extent of a cylinder around the fly, degrees
+        :returns: number of faces around the cylinder
+        """
+        return self.arc_steps(np.radians(angular_extent), min_steps=min_steps, default=default)
+
+    def object_steps(self, radius, distance, min_steps=6, default=16):
+        """
+        :param radius: radius of a round object, e.g. a cylinder not centered on the fly, meters
+        :param distance: distance from the fly to the object, meters
+        :returns: number of steps around the object
+        """
+        rho = np.arctan2(radius, max(distance, radius))
+        return self.arc_steps(2 * np.pi, rho=rho, min_steps=min_steps, default=default)
@@ -0,0 +1,100 @@
+"""
+Streaming storage of rendered stimulus movies.
+
+MovieWriter downsamples each frame and appends it to a temporary file on a background thread while capture runs, so
+memory use is bounded by the size of the frame queue rather than the length of the movie. When the writer is closed,
+the frames are copied block by block into a .npy file with the same (height, width, n_frames) layout that
+StimDisplay.save_rendered_movie has always produced.
+"""
+
+import os
+import queue
+import threading
+
+import numpy as np
+from skimage.transform import downscale_local_mean
+
+
+class MovieWriter:
+    def __init__(self, file_path, downsample_xy=1, max_queued_frames=64, block_size=256):
+        """
+        :param file_path: full file path of the saved .npy array
+        :param downsample_xy: factor to spatially downsample each frame by, as in save_rendered_movie
+        :param max_queued_frames: frames waiting to be written. write() blocks when the queue is full.
+        :param block_size: number of frames copied at a time when assembling the final array
+        """
+        self.file_path = file_path
+        self.downsample_xy = downsample_xy
+        self.block_size = block_size
+
+        self.raw_path = file_path + '.frames.tmp'
+        self.raw_file = open(self.raw_path, 'wb')
+        self.frame_shape = None  # (height, width) of the downsampled frames
+        self.n_frames = 0
+
+        self.queue = queue.Queue(maxsize=max_queued_frames)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, frame):
+        """
+        :param frame: (height, width) uint8 frame, first row at the top
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put(frame)
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                continue
+
+            try:
+                if self.downsample_xy != 1:
+                    frame = downscale_local_mean(frame, factors=(self.downsample_xy, self.downsample_xy))
+                frame = np.ascontiguousarray(frame, dtype='uint8')
+
+                if self.frame_shape is None:
+                    self.frame_shape = frame.shape
+                elif frame.shape != self.frame_shape:
+                    raise ValueError('Frame shape changed from {} to {}'.format(self.frame_shape, frame.shape))
+
+                self.raw_file.write(frame.tobytes())
+                self.n_frames += 1
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """
+        Wait for queued frames to be written, then save the (height, width, n_frames) array to file_path.
+
+        :returns: shape of the saved array
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.raw_file.close()
+
+        try:
+            if self.error is not None:
+                raise self.error
+
+            height, width = self.frame_shape if self.frame_shape is not None else (0, 0)
+            shape = (height, width, self.n_frames)
+            mov = np.lib.format.open_memmap(self.file_path, mode='w+', dtype='uint8', shape=shape)
+            if self.n_frames > 0:
+                # frames are stored one after the other; transpose a block at a time into the frame-last layout
+                frames = np.memmap(self.raw_path, dtype='uint8', mode='r', shape=(self.n_frames, height, width))
+                for start in range(0, self.n_frames, self.block_size):
+                    stop = min(start + self.block_size, self.n_frames)
+                    mov[:, :, start:stop] = np.transpose(frames[start:stop], (1, 2, 0))
+                del frames
+            mov.flush()
+            del mov
+        finally:
+            os.remove(self.raw_path)
+
+        return shape
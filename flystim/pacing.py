@@ -0,0 +1,112 @@
+"""
+Frame pacing for the render loop.
+
+FinishPacer blocks at the end of every frame until the GPU has executed all submitted commands (ctx.finish()).
+FencePacer instead inserts a GL fence sync object after each frame and only waits on the fence of the frame that
+was submitted frames_in_flight frames ago, so that the CPU work for the next frame (eval_at, texture generation,
+RPC handling) overlaps with GPU execution of the current one, while latency stays bounded.
+
+ModernGL doesn't expose sync objects, so FencePacer uses PyOpenGL (optional dependency, the 'fence' extra in
+setup.py) against the current context. If PyOpenGL isn't installed, make_pacer falls back to FinishPacer.
+"""
+
+import time
+import warnings
+from collections import deque
+
+from flystim.profiling import null_profiler
+
+try:
+    from OpenGL import GL
+except ImportError:
+    GL = None
+
+
+class FinishPacer:
+    mode = 'finish'
+
+    def __init__(self, ctx, profiler=null_profiler):
+        """
+        :param ctx: ModernGL context
+        :param profiler: FrameProfiler used to record 'gpu_latency', time spent waiting for the GPU (sec)
+        """
+        self.ctx = ctx
+        self.profiler = profiler
+
+    @property
+    def frames_in_flight(self):
+        return 0
+
+    def end_frame(self):
+        """
+        Called after all draw calls for a frame have been issued.
+        """
+        t_start = time.perf_counter()
+        self.ctx.finish()
+        self.profiler.record('gpu_latency', t_start)
+
+    def release(self):
+        pass
+
+
+class FencePacer:
+    mode = 'fence'
+
+    def __init__(self, ctx, frames_in_flight=1, timeout=1.0, profiler=null_profiler):
+        """
+        :param ctx: ModernGL context
+        :param frames_in_flight: number of frames that may be queued on the GPU while the CPU prepares the next one.
+        0 waits for the current frame, which is equivalent to ctx.finish().
+        :param timeout: maximum time to wait for a fence (sec)
+        :param profiler: FrameProfiler used to record 'gpu_latency', the time from submission of a frame until its
+        fence was seen to be signaled (sec)
+        """
+        if GL is None:
+            raise ImportError('Fence pacing requires PyOpenGL.')
+
+        self.ctx = ctx
+        self.frames_in_flight = max(int(frames_in_flight), 0)
+        self.timeout_ns = int(timeout*1e9)
+        self.profiler = profiler
+        self.fences = deque()  # (sync object, time.perf_counter() at submission)
+
+    def end_frame(self):
+        """
+        Called after all draw calls for a frame have been issued.
+        """
+        fence = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self.fences.append((fence, time.perf_counter()))
+
+        while len(self.fences) > self.frames_in_flight:
+            self.wait_oldest()
+
+    def wait_oldest(self):
+        fence, t_submit = self.fences.popleft()
+        # the flush bit makes sure the fence is actually submitted, so the wait can't deadlock
+        GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, self.timeout_ns)
+        GL.glDeleteSync(fence)
+        self.profiler.record('gpu_latency', t_submit)
+
+    def release(self):
+        while self.fences:
+            fence, _ = self.fences.popleft()
+            GL.glDeleteSync(fence)
+
+
+def make_pacer(ctx, mode='finish', frames_in_flight=1, profiler=null_profiler):
+    """
+    :param ctx: ModernGL context
+    :param mode: 'finish' or 'fence'. Falls back to 'finish' if fence sync objects aren't available.
+    :param frames_in_flight: see FencePacer
+    :param profiler: FrameProfiler
+    """
+    if mode == 'finish':
+        return FinishPacer(ctx, profiler=profiler)
+    elif mode == 'fence':
+        if GL is None:
+            warnings.warn('PyOpenGL is not installed, falling back to ctx.finish() frame pacing. '
+                          'Install it with pip install flystim[fence].')
+            return FinishPacer(ctx, profiler=profiler)
+        return FencePacer(ctx, frames_in_flight=frames_in_flight, profiler=profiler)
+    else:
+        raise ValueError('Unknown frame pacing mode: {}'.format(mode))
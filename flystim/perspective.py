@@ -24,12 +24,25 @@ class GenPerspective:
 
     @property
     def matrix(self):
+        fly_pos = np.array(self.fly_pos, dtype=float)
+
+        T = np.array([[1, 0, 0, -fly_pos[0]],
+                      [0, 1, 0, -fly_pos[1]],
+                      [0, 0, 1, -fly_pos[2]],
+                      [0, 0, 0,      1]], dtype=float)
+
+        return self.projection.dot(T).astype('f4').tobytes(order='F')
+
+    @property
+    def projection(self):
+        """
+        Part of the perspective matrix that depends only on the screen corners and eye position: P @ M.T (float64)
+        """
         # format vectors as numpy arrays
         pa = np.array(self.pa, dtype=float)
         pb = np.array(self.pb, dtype=float)
         pc = np.array(self.pc, dtype=float)
         pe = np.array(self.pe, dtype=float)
-        fly_pos = np.array(self.fly_pos, dtype=float)
 
         # make aliases for "near" and "far" so that the code is easier to read
         n = self.near
@@ -66,12 +79,8 @@ class GenPerspective:
                       [vr[1], vu[1], vn[1], 0],
                       [vr[2], vu[2], vn[2], 0],
                       [    0,     0,     0, 1]], dtype=float)
-        T = np.array([[1, 0, 0, -fly_pos[0]],
-                      [0, 1, 0, -fly_pos[1]],
-                      [0, 0, 1, -fly_pos[2]],
-                      [0, 0, 0,      1]], dtype=float)
 
-        return P.dot((M.T).dot(T)).astype('f4').tobytes(order='F')
+        return P.dot(M.T)
 
     def rotx(self, th):
         return GenPerspective(pa=rotx(self.pa, th), pb=rotx(self.pb, th), pc=rotx(self.pc, th),
@@ -84,3 +93,88 @@ class GenPerspective:
     def rotz(self, th):
         return GenPerspective(pa=rotz(self.pa, th), pb=rotz(self.pb, th), pc=rotz(self.pc, th),
                               pe=rotz(self.pe, th), near=self.near, far=self.far, fly_pos=self.fly_pos, horizontal_flip=self.horizontal_flip)
+
+
+class PerspectiveCache:
+    """
+    Perspective matrix of one subscreen as a function of the fly pose.
+
+    GenPerspective(...).rotz(theta).rotx(phi).roty(roll).matrix rotates the screen corners, which leaves the
+    projection P unchanged and replaces M with R @ M, where R = Ry(roll) @ Rx(phi) @ Rz(theta). The matrix is
+    therefore P @ M.T @ R.T @ T(fly_pos): P @ M.T is computed once, and only R.T @ T depends on the pose.
+    """
+
+    def __init__(self, pa, pb, pc, pe=(0, 0, 0), near=0.0001, far=1000, horizontal_flip=False):
+        """
+        :params (pa, pb, pc, pe, near, far, horizontal_flip): see GenPerspective
+        """
+        self.projection = GenPerspective(pa=pa, pb=pb, pc=pc, pe=pe, near=near, far=far,
+                                         horizontal_flip=horizontal_flip).projection
+
+        # pose and matrix bytes of the last call to get
+        self.pose = None
+        self.matrix_bytes = None
+
+    def get(self, fly_pos, theta, phi, roll=0):
+        """
+        :param fly_pos: (x, y, z) position of fly, meters
+        :param theta: rotation around z axis, radians
+        :param phi: rotation around x axis, radians
+        :param roll: rotation around y axis, radians
+        :returns: perspective matrix as float32 bytes (column-major), reused if the pose hasn't changed
+        """
+        pose = (float(fly_pos[0]), float(fly_pos[1]), float(fly_pos[2]), float(theta), float(phi), float(roll))
+        if pose != self.pose:
+            self.matrix_bytes = self.matrices(fly_pos, theta, phi, roll)[0].astype('f4').tobytes(order='F')
+            self.pose = pose
+
+        return self.matrix_bytes
+
+    def matrices(self, fly_pos, theta, phi, roll=0):
+        """
+        Evaluate the perspective matrix for many poses at once.
+
+        :param fly_pos: (x, y, z) or (n_poses, 3) fly positions, meters
+        :param theta: scalar or (n_poses,) rotations around z axis, radians
+        :param phi: scalar or (n_poses,) rotations around x axis, radians
+        :param roll: scalar or (n_poses,) rotations around y axis, radians
+        :returns: (n_poses, 4, 4) array of perspective matrices (float64)
+        """
+        fly_pos = np.reshape(np.asarray(fly_pos, dtype=float), (-1, 3))
+        theta, phi, roll = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float)) for x in (theta, phi, roll)])
+        n_poses = max(len(fly_pos), len(theta))
+
+        # R = Ry(roll) @ Rx(phi) @ Rz(theta), for each pose
+        R = np.zeros((len(theta), 3, 3))
+        R[:, 0, 0] = R[:, 1, 1] = np.cos(theta)
+        R[:, 0, 1] = -np.sin(theta)
+        R[:, 1, 0] = np.sin(theta)
+        R[:, 2, 2] = 1
+        R = _rotx_mats(phi) @ R
+        R = _roty_mats(roll) @ R
+
+        # view = R.T @ T(fly_pos)
+        view = np.zeros((n_poses, 4, 4))
+        view[:, :3, :3] = np.transpose(R, (0, 2, 1))
+        view[:, :3, 3] = -(view[:, :3, :3] @ fly_pos[:, :, np.newaxis])[:, :, 0]
+        view[:, 3, 3] = 1
+
+        return self.projection @ view
+
+
+def _rotx_mats(th):
+    mats = np.zeros((len(th), 3, 3))
+    mats[:, 0, 0] = 1
+    mats[:, 1, 1] = mats[:, 2, 2] = np.cos(th)
+    mats[:, 1, 2] = -np.sin(th)
+    mats[:, 2, 1] = np.sin(th)
+    return mats
+
+
+def _roty_mats(th):
+    mats = np.zeros((len(th), 3, 3))
+    mats[:, 1, 1] = 1
+    mats[:, 0, 0] = mats[:, 2, 2] = np.cos(th)
+    mats[:, 0, 2] = np.sin(th)
+    mats[:, 2, 0] = -np.sin(th)
+    return mats
@@ -0,0 +1,172 @@
+"""
+Timing instrumentation for the render loop.
+
+Durations of each phase of a frame (RPC handling, perspective computation, each stimulus' eval_at, vertex upload,
+draw calls, ...) are written to preallocated ring buffers, so recording a frame doesn't allocate memory. Summary
+statistics and histograms are computed on demand, e.g. when queried over RPC.
+"""
+
+import time
+import numpy as np
+
+
+class RingBuffer:
+    def __init__(self, size):
+        """
+        :param size: number of most recent values to keep
+        """
+        self.data = np.zeros(size)
+        self.index = 0
+        self.count = 0
+
+    def append(self, value):
+        self.data[self.index] = value
+        self.index = (self.index + 1) % len(self.data)
+        self.count = min(self.count + 1, len(self.data))
+
+    @property
+    def values(self):
+        """
+        Stored values, oldest first.
+        """
+        if self.count < len(self.data):
+            return self.data[:self.count].copy()
+        return np.roll(self.data, -self.index)
+
+    def clear(self):
+        self.index = 0
+        self.count = 0
+
+
+class FrameProfiler:
+    def __init__(self, buffer_size=10000, enabled=True):
+        """
+        :param buffer_size: number of frames kept for each phase
+        :param enabled: if False, record() only returns the current time
+        """
+        self.buffer_size = buffer_size
+        self.enabled = enabled
+        self.buffers = {}  # phase name: RingBuffer of durations (sec)
+
+    def record(self, phase, t_start):
+        """
+        Record the time elapsed since t_start for a phase of the frame.
+
+        :param phase: name of the phase
+        :param t_start: time.perf_counter() value at the start of the phase
+        :returns: current time.perf_counter() value, which can be used as the start of the next phase
+        """
+        now = time.perf_counter()
+        if self.enabled:
+            if phase not in self.buffers:
+                self.buffers[phase] = RingBuffer(self.buffer_size)
+            self.buffers[phase].append(now - t_start)
+        return now
+
+    def reset(self):
+        for buffer in self.buffers.values():
+            buffer.clear()
+
+    def summary(self, percentiles=(1, 5, 50, 95, 99)):
+        """
+        :param percentiles: percentiles to report for each phase
+        :returns: dict of phase name: dict of statistics, durations in milliseconds
+        """
+        summary = {}
+        for phase, buffer in self.buffers.items():
+            values = 1e3 * buffer.values
+            if len(values) == 0:
+                continue
+
+            stats = {'count': len(values),
+                     'mean': float(np.mean(values)),
+                     'std': float(np.std(values)),
+                     'min': float(np.min(values)),
+                     'max': float(np.max(values))}
+            for p, v in zip(percentiles, np.percentile(values, percentiles)):
+                stats['p{}'.format(p)] = float(v)
+            summary[phase] = stats
+
+        return summary
+
+    def histogram(self, phase, bins=20):
+        """
+        :param phase: name of the phase
+        :param bins: number of bins, or bin edges in milliseconds
+        :returns: dict with 'counts' and 'bin_edges' (milliseconds) lists
+        """
+        counts, bin_edges = np.histogram(1e3 * self.buffers[phase].values, bins=bins)
+        return {'counts': counts.tolist(), 'bin_edges': bin_edges.tolist()}
+
+    def dump(self, file_path):
+        """
+        Save the raw durations (sec) for each phase to an .npz file.
+
+        :param file_path: full file path of saved file
+        """
+        np.savez(file_path, **{phase: buffer.values for phase, buffer in self.buffers.items()})
+
+
+# shared disabled profiler, used by stimuli that aren't being profiled
+null_profiler = FrameProfiler(enabled=False)
+
+
+class FrameDropDetector:
+    """
+    Detects missed vsyncs from the timestamps of consecutive frames.
+
+    With vsync on, consecutive frames should be one refresh period apart. An interval longer than drop_threshold
+    refresh periods means that round(interval / refresh_period) - 1 vsyncs were missed, i.e. the previous frame
+    was held on screen for too long.
+    """
+
+    def __init__(self, refresh_period=None, drop_threshold=1.5):
+        """
+        :param refresh_period: display refresh period (sec). If None, it is estimated as the median frame interval.
+        :param drop_threshold: intervals longer than this many refresh periods count as dropped frames
+        """
+        self.refresh_period = refresh_period
+        self.drop_threshold = drop_threshold
+        self.timestamps = []
+
+    def start_epoch(self, refresh_period=None):
+        """
+        :param refresh_period: measured refresh period (sec) for this epoch, if available
+        """
+        if refresh_period is not None:
+            self.refresh_period = refresh_period
+        self.timestamps = []
+
+    def frame(self, timestamp):
+        """
+        :param timestamp: time of the frame, e.g. time.perf_counter() at the start of paintGL (sec)
+        """
+        self.timestamps.append(timestamp)
+
+    def report(self):
+        """
+        :returns: dict describing the frames of the current epoch. drop_times are relative to the first frame (sec)
+        and missed_vsyncs gives the number of vsyncs missed at each of those times.
+        """
+        timestamps = np.array(self.timestamps)
+        intervals = np.diff(timestamps)
+
+        refresh_period = self.refresh_period
+        if refresh_period is None and len(intervals) > 0:
+            refresh_period = float(np.median(intervals))
+
+        t0 = timestamps[0] if len(timestamps) > 0 else 0
+        if len(intervals) == 0 or not refresh_period:
+            drops = np.zeros(len(intervals), dtype=bool)
+            missed = np.zeros(len(intervals), dtype=int)
+        else:
+            drops = intervals > self.drop_threshold * refresh_period
+            missed = np.round(intervals / refresh_period).astype(int) - 1
+
+        return {'n_frames': len(timestamps),
+                'refresh_period': refresh_period,
+                'n_dropped': int(np.sum(missed[drops])),
+                'n_drop_events': int(np.sum(drops)),
+                'drop_times': (timestamps[1:][drops] - t0).tolist(),
+                'missed_vsyncs': missed[drops].tolist(),
+                'max_interval': float(np.max(intervals)) if len(intervals) > 0 else None}
@@ -64,8 +64,8 @@ class Screen:
     """
 
     def __init__(self, subscreens=None, server_number=None, id=None, fullscreen=None, vsync=None,
-                 square_size=None, square_loc=None, square_max_color=None, name=None, horizontal_flip=False, 
-                 pa=(-0.15, 0.30, -0.15), pb=(+0.15, 0.30, -0.15), pc=(-0.15, 0.30, +0.15)):
+                 square_size=None, square_loc=None, square_max_color=None, name=None, horizontal_flip=False, single_pass_subscreens=False,
+                 lod_tolerance=None, pa=(-0.15, 0.30, -0.15), pb=(+0.15, 0.30, -0.15), pc=(-0.15, 0.30, +0.15)):
         """
         :param subscreens: list of SubScreen objects (see above), if none are provided, one full-viewport subscreen will be produced using inputs pa, pb, pc
         :param server_number: ID # of the X server
@@ -78,6 +78,11 @@ class Screen:
         :param square_max_color: scales square color such that maximum value is set as indicated (0 - square_max_color)
         :param name: descriptive name to associate with this screen
         :param horizontal_flip: Boolean. Flip horizontal axis of image, for rear-projection devices
+        :param single_pass_subscreens: Boolean. If True, each stimulus draws all subscreens with a single draw call
+        instead of one per subscreen. Stimuli that use instanced rendering still draw each subscreen separately.
+        :param lod_tolerance: pixels. If given, curved stimuli choose their tessellation so that their outlines deviate
+        from the true curve by at most this much on the screen, see flystim.lod. If None (default), stimuli use their
+        fixed default tessellation.
 
         """
         if subscreens is None:
@@ -111,13 +116,15 @@ class Screen:
         self.square_max_color = square_max_color
         self.name = name
         self.horizontal_flip = horizontal_flip
+        self.single_pass_subscreens = single_pass_subscreens
+        self.lod_tolerance = lod_tolerance
         self.pa = pa
         self.pb = pb
         self.pc = pc
 
     def serialize(self):
         # get all variables needed to reconstruct the screen object
-        vars = ['id', 'server_number', 'fullscreen', 'vsync', 'square_size', 'square_loc', 'square_max_color', 'name', 'horizontal_flip', 'pa', 'pb', 'pc']
+        vars = ['id', 'server_number', 'fullscreen', 'vsync', 'square_size', 'square_loc', 'square_max_color', 'name', 'horizontal_flip', 'single_pass_subscreens', 'lod_tolerance', 'pa', 'pb', 'pc']
         data = {var: getattr(self, var) for var in vars}
 
         # special handling for tri_list since it could contain numpy values
@@ -1,32 +1,193 @@
 import numpy as np
-from numpy import matlib
+from collections import OrderedDict
 from math import radians
-from .util import rotx, roty, rotz, translate, scale, rotate, rot1_scale_rot2, spherical_to_cartesian, cylindrical_to_cartesian, cylindrical_w_phi_to_cartesian
+from .util import rotx_mat, roty_mat, rotz_mat, rot_mat, affine_mat, translate, spherical_to_cartesian, cylindrical_to_cartesian, cylindrical_w_phi_to_cartesian
+
+# interleaved vertex layouts, matching the VBO format and the in_vert, in_color and in_tex_coord shader inputs
+VERTEX_DTYPE = np.dtype([('in_vert', 'f4', 3), ('in_color', 'f4', 4)])
+TEXTURED_VERTEX_DTYPE = np.dtype([('in_vert', 'f4', 3), ('in_color', 'f4', 4), ('in_tex_coord', 'f4', 2)])
 
 class GlVertices:
-    def __init__(self, vertices=None, colors=None, tex_coords=None):
-        self.vertices = vertices
-        self.colors = colors
-        self.tex_coords = tex_coords
+    def __init__(self, vertices=None, colors=None, tex_coords=None, buffer=None, indices=None):
+        """
+        :param vertices: (3, n_vertices) array of x, y, z positions
+        :param colors: (4, n_vertices) array of r, g, b, a colors
+        :param tex_coords: optional (2, n_vertices) array of texture coordinates
+        :param buffer: alternatively, a (n_vertices,) array of VERTEX_DTYPE or TEXTURED_VERTEX_DTYPE, used without copying
+        :param indices: optional array of vertex indices, three per triangle. Without indices, every three
+        consecutive vertices form a triangle.
+        """
+        if buffer is None and vertices is not None:
+            buffer = np.empty(np.shape(vertices)[1], dtype=VERTEX_DTYPE if tex_coords is None else TEXTURED_VERTEX_DTYPE)
+            buffer['in_vert'] = np.transpose(vertices)
+            buffer['in_color'] = np.transpose(colors)
+            if tex_coords is not None:
+                buffer['in_tex_coord'] = np.transpose(tex_coords)
+
+        # vertex data, stored interleaved in float32 exactly as it is uploaded to the GPU
+        self._buffer = buffer
+        self.indices = None if indices is None else np.ascontiguousarray(np.ravel(indices), dtype='u4')
+
+        # Transforms, colors and texture shifts are not applied right away. Instead they are collected here and
+        # applied to the vertex data of source in a single pass, when buffer is first needed.
+        self.source = None
+        self.transform = None  # 4x4 affine matrix
+        self.pending_color = None
+        self.pending_tex_shift = None
+        self._untransformed = None
+
+        # incremented whenever the vertex data is modified in place, so that renderers can tell whether
+        # a GlVertices object they have already uploaded needs to be uploaded again
+        self.generation = 0
 
-    def add(self, obj):
-        # add vertices
-        if self.vertices is None:
-            self.vertices = obj.vertices
-        else:
-            self.vertices = np.concatenate((self.vertices, obj.vertices), axis=1)
+    @property
+    def buffer(self):
+        """
+        (n_vertices,) interleaved vertex data, with any pending transform, color and texture shift applied
+        """
+        if self.source is not None:
+            self._buffer = self.apply_pending(self.source.buffer)
+            self.source = None
+            self.transform = None
+            self.pending_color = None
+            self.pending_tex_shift = None
+            self._untransformed = None
+        return self._buffer
+
+    def apply_pending(self, source_buffer):
+        if source_buffer is None:
+            return None
+
+        new_buffer = source_buffer.copy()
+        if self.transform is not None:
+            new_buffer['in_vert'] = source_buffer['in_vert'] @ self.transform[:3, :3].T + self.transform[:3, 3]
+        if self.pending_color is not None:
+            new_buffer['in_color'] = self.pending_color
+        if self.pending_tex_shift is not None:
+            new_buffer['in_tex_coord'] += self.pending_tex_shift
+        return new_buffer
+
+    def split_transform(self):
+        """
+        Separate the pending transform from the vertex data, so that it can be applied in the vertex shader instead.
 
-        # add colors
-        if self.colors is None:
-            self.colors = obj.colors
-        else:
-            self.colors = np.concatenate((self.colors, obj.colors), axis=1)
+        :returns: (obj, transform). obj is this object without its pending transform. It is the same object on every
+        call, and the untransformed source itself if there is no pending color or texture shift. transform is the
+        4x4 matrix to apply to obj, or None.
+        """
+        if self.source is None or self.transform is None:
+            return self, None
+
+        if self.pending_color is None and self.pending_tex_shift is None:
+            return self.source, self.transform
 
-        # add tex_coords
-        if self.tex_coords is None:
-            self.tex_coords = obj.tex_coords
+        if self._untransformed is None:
+            self._untransformed = self.derive(transform=None)
+        return self._untransformed, self.transform
+
+    def derive(self, **pending):
+        """
+        :returns: new object that shares the vertex data of this one, with the pending operations of this one
+        updated by pending
+        """
+        obj = GlVertices()
+        obj.indices = self.indices
+        if self.source is not None:
+            obj.source = self.source
+            obj.transform = self.transform
+            obj.pending_color = self.pending_color
+            obj.pending_tex_shift = self.pending_tex_shift
         else:
-            self.tex_coords = np.concatenate((self.tex_coords, obj.tex_coords), axis=1)
+            obj.source = self
+
+        for name, value in pending.items():
+            setattr(obj, name, value)
+        return obj
+
+    @property
+    def vertices(self):
+        """
+        (3, n_vertices) view of the positions in buffer
+        """
+        return None if self.buffer is None else self.buffer['in_vert'].T
+
+    @property
+    def colors(self):
+        """
+        (4, n_vertices) view of the colors in buffer
+        """
+        return None if self.buffer is None else self.buffer['in_color'].T
+
+    @property
+    def tex_coords(self):
+        """
+        (2, n_vertices) view of the texture coordinates in buffer, or None for untextured objects
+        """
+        if self.buffer is None or 'in_tex_coord' not in self.buffer.dtype.names:
+            return None
+        return self.buffer['in_tex_coord'].T
+
+    def touch(self):
+        """
+        Mark the vertex data as modified. Call this after changing vertices, colors or tex_coords in place.
+        """
+        self.generation += 1
+
+    def set_buffer(self, buffer, indices=None):
+        """
+        Replace the vertex data of this object, e.g. with a view of a reused staging array.
+
+        :param buffer: (n_vertices,) array of VERTEX_DTYPE or TEXTURED_VERTEX_DTYPE, used without copying
+        :param indices: optional uint32 array of vertex indices, used without copying
+        """
+        self._buffer = buffer
+        self.indices = indices
+        self.source = None
+        self.transform = None
+        self.pending_color = None
+        self.pending_tex_shift = None
+        self._untransformed = None
+        self.touch()
+
+    def add(self, obj):
+        """
+        Append the vertices of obj. Each call copies all of the existing data, so use GlVerticesBuilder to combine
+        many objects.
+        """
+        self.touch()
+
+        if self.buffer is None:
+            self._buffer = obj.buffer
+            self.indices = obj.indices
+        elif obj.buffer is not None:
+            if self.indices is not None or obj.indices is not None:
+                self.indices = np.concatenate((self.get_indices(), obj.get_indices() + len(self.buffer))).astype('u4')
+            self._buffer = np.concatenate((self.buffer, obj.buffer))
+
+    def get_indices(self):
+        """
+        :returns: vertex indices of the triangles, consecutive for objects without indices
+        """
+        if self.indices is None:
+            return np.arange(len(self.buffer), dtype='u4')
+        return self.indices
+
+    def expanded(self):
+        """
+        :returns: object with the vertices of each triangle stored one after the other, without indices
+        """
+        if self.indices is None:
+            return self
+        return GlVertices(buffer=self.buffer[self.indices])
+
+    def apply_transform(self, mat):
+        """
+        :param mat: 4x4 affine matrix, applied after any transform already pending
+        :returns: new transformed object. The vertex data isn't touched until it is needed.
+        """
+        if self.transform is None or self.source is None:
+            return self.derive(transform=mat)
+        return self.derive(transform=mat @ self.transform)
 
     def rotate(self, z, x, y):
         """
@@ -34,44 +195,173 @@ class GlVertices:
         :param x: rotation around x axis (pitch), radians
         :param y: rotation around y axis (roll), radians
         """
-        return GlVertices(vertices=rotate(self.vertices, z, x, y), colors=self.colors, tex_coords=self.tex_coords)
+        return self.apply_transform(affine_mat(rot_mat(z, x, y)))
 
     def rotx(self, th):
-        return GlVertices(vertices=rotx(self.vertices, th), colors=self.colors, tex_coords=self.tex_coords)
+        return self.apply_transform(affine_mat(rotx_mat(th)))
 
     def roty(self, th):
-        return GlVertices(vertices=roty(self.vertices, th), colors=self.colors, tex_coords=self.tex_coords)
+        return self.apply_transform(affine_mat(roty_mat(th)))
 
     def rotz(self, th):
-        return GlVertices(vertices=rotz(self.vertices, th), colors=self.colors, tex_coords=self.tex_coords)
+        return self.apply_transform(affine_mat(rotz_mat(th)))
 
     def scale(self, amt):
-        return GlVertices(vertices=scale(self.vertices, amt), colors=self.colors, tex_coords=self.tex_coords)
+        return self.apply_transform(affine_mat(np.diag(np.broadcast_to(np.ravel(amt), 3))))
 
     def rot1_scale_rot2(self, yaw1, pitch1, roll1, scale_x, scale_y, scale_z, yaw2, pitch2, roll2):
         '''
         rot2 @ scale @ rot1 @ vertices
         '''
-        return GlVertices(vertices=rot1_scale_rot2(self.vertices, yaw1, pitch1, roll1, scale_x, scale_y, scale_z, yaw2, pitch2, roll2), colors=self.colors, tex_coords=self.tex_coords)
+        return self.apply_transform(affine_mat(rot_mat(yaw2, pitch2, roll2) @ np.diag([scale_x, scale_y, scale_z]) @ rot_mat(yaw1, pitch1, roll1)))
 
     def translate(self, amt):
-        return GlVertices(vertices=translate(self.vertices, amt), colors=self.colors, tex_coords=self.tex_coords)
+        return self.apply_transform(affine_mat(translation=amt))
 
     def setColor(self, color):
-        new_colors = np.tile(np.array(color), (self.vertices.shape[1], 1)).T
-        return GlVertices(vertices=self.vertices, colors=new_colors, tex_coords=self.tex_coords)
+        return self.derive(pending_color=np.array(color, dtype=float))
 
     def shiftTexture(self, shift):
-        new_tex_coords = self.tex_coords + np.tile(shift, (self.tex_coords.shape[1], 1)).T
-        return GlVertices(vertices=self.vertices, colors=self.colors, tex_coords=new_tex_coords)
+        if self.source is not None and self.pending_tex_shift is not None:
+            shift = self.pending_tex_shift + np.asarray(shift, dtype=float)
+        return self.derive(pending_tex_shift=np.array(shift, dtype=float))
 
     @property
     def data(self):
-        if self.tex_coords is not None:
-            data = np.concatenate((self.vertices, self.colors, self.tex_coords), axis=0)
+        """
+        Flat float32 view of buffer, ready to be written to a VBO without copying. For indexed objects this holds each
+        vertex once, see indices.
+        """
+        return self.buffer.view('f4')
+
+
+class GlVerticesBuilder:
+    """
+    Combines many GlVertices objects into one. Data is appended into preallocated buffers that grow geometrically,
+    so building an object from N pieces takes O(N) copies rather than the O(N^2) of repeated GlVertices.add.
+    """
+    def __init__(self, capacity=0):
+        """
+        :param capacity: number of vertices to preallocate space for, if known
+        """
+        self.capacity = max(int(capacity), 0)
+        self.n_vertices = 0
+        self.buffer = None  # allocated by the first appended object, which sets the vertex layout
+
+        # vertex indices of all appended objects, only kept in the result if one of them had indices
+        self.n_indices = 0
+        self.indices = None
+        self.use_indices = False
+
+    def reserve(self, n_vertices, dtype):
+        """
+        Make room for at least n_vertices in total.
+        """
+        if self.buffer is None:
+            self.buffer = np.empty(max(n_vertices, self.capacity), dtype=dtype)
+        elif n_vertices > len(self.buffer):
+            new_buffer = np.empty(max(n_vertices, 2*len(self.buffer)), dtype=dtype)
+            new_buffer[:self.n_vertices] = self.buffer[:self.n_vertices]
+            self.buffer = new_buffer
+
+    def reserve_indices(self, n_indices):
+        if self.indices is None:
+            self.indices = np.empty(max(n_indices, self.capacity), dtype='u4')
+        elif n_indices > len(self.indices):
+            new_indices = np.empty(max(n_indices, 2*len(self.indices)), dtype='u4')
+            new_indices[:self.n_indices] = self.indices[:self.n_indices]
+            self.indices = new_indices
+
+    def append(self, obj):
+        """
+        :param obj: GlVertices to append. Either all or none of the appended objects must have tex_coords.
+        """
+        if obj.buffer is None:
+            return self
+
+        if self.buffer is not None and obj.buffer.dtype != self.buffer.dtype:
+            raise ValueError('Cannot combine objects with and without tex_coords')
+
+        start = self.n_vertices
+        stop = start + len(obj.buffer)
+        self.reserve(stop, obj.buffer.dtype)
+        self.buffer[start:stop] = obj.buffer
+        self.n_vertices = stop
+
+        obj_indices = obj.get_indices()
+        index_start = self.n_indices
+        index_stop = index_start + len(obj_indices)
+        self.reserve_indices(index_stop)
+        np.add(obj_indices, start, out=self.indices[index_start:index_stop])
+        self.n_indices = index_stop
+        self.use_indices = self.use_indices or obj.indices is not None
+
+        return self
+
+    def freeze(self):
+        """
+        :returns: GlVertices holding everything appended so far. The builder starts over empty afterwards.
+        """
+        if self.n_vertices == 0:
+            obj = GlVertices()
         else:
-            data = np.concatenate((self.vertices, self.colors), axis=0)
-        return data.flatten(order='F')
+            obj = GlVertices(buffer=self.buffer[:self.n_vertices],
+                             indices=self.indices[:self.n_indices] if self.use_indices else None)
+
+        # the buffers now belong to obj
+        self.__init__(capacity=self.capacity)
+        return obj
+
+
+class MeshCache:
+    """
+    Memoizes shape meshes by their constructor parameters, so stimuli that rebuild a shape every frame only tessellate
+    it again when its geometry changes. The least recently used meshes are dropped once max_size is reached.
+
+    Meshes returned by get are shared and must not be modified in place. Their vertex buffers are read only.
+    """
+    def __init__(self, max_size=64):
+        """
+        :param max_size: maximum number of meshes to keep
+        """
+        self.max_size = max_size
+        self.meshes = OrderedDict()  # geometry key: [uncolored mesh, last color, last colored mesh]
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, shape_class, color=(1, 1, 1, 1), **params):
+        """
+        :param shape_class: GlVertices subclass, e.g. GlSphericalRect
+        :param color: [r,g,b,a] or mono. Applied to the cached mesh.
+        :param params: keyword arguments for shape_class, other than color. Values must be hashable.
+        :returns: mesh equal to shape_class(color=color, **params). Asking for the same shape and color as the
+        previous call for that shape returns the same object, so it isn't uploaded to the GPU again.
+        """
+        key = (shape_class, tuple(sorted(params.items())))
+        entry = self.meshes.get(key)
+        if entry is None:
+            self.misses += 1
+            mesh = shape_class(**params)
+            mesh.buffer.flags.writeable = False
+            entry = [mesh, None, None]
+            self.meshes[key] = entry
+            if len(self.meshes) > self.max_size:
+                self.meshes.popitem(last=False)
+        else:
+            self.hits += 1
+            self.meshes.move_to_end(key)
+
+        color = getColorTuple(color)
+        if entry[1] is None or not np.array_equal(entry[1], color):
+            entry[1] = color
+            entry[2] = entry[0].setColor(color)
+
+        return entry[2]
+
+    def clear(self):
+        self.meshes.clear()
+        self.hits = 0
+        self.misses = 0
 
 
 class GlTri(GlVertices):
@@ -88,46 +378,32 @@ class GlTri(GlVertices):
 
 class GlQuad(GlVertices):
     def __init__(self, v1, v2, v3, v4, color, tc1=(0, 0), tc2=(1, 0), tc3=(1, 1), tc4=(0, 1), texture_shift=(0, 0), use_texture=False):
-        super().__init__()
+        # triangles (v1, v2, v3) and (v1, v3, v4)
+        vertices = np.array([v1, v2, v3, v4], dtype=float).T
+        colors = repeat_color(color, 4)
+
         if use_texture:
-            self.add(GlTri(v1, v2, v3, color,
-                           [sum(x) for x in zip(tc1, texture_shift)],
-                           [sum(x) for x in zip(tc2, texture_shift)],
-                           [sum(x) for x in zip(tc3, texture_shift)]))
-            self.add(GlTri(v1, v3, v4, color,
-                           [sum(x) for x in zip(tc1, texture_shift)],
-                           [sum(x) for x in zip(tc3, texture_shift)],
-                           [sum(x) for x in zip(tc4, texture_shift)]))
+            tex_coords = np.array([np.add(tc, texture_shift) for tc in (tc1, tc2, tc3, tc4)]).T
         else:
-            self.add(GlTri(v1, v2, v3, color))
-            self.add(GlTri(v1, v3, v4, color))
+            tex_coords = None
+        super().__init__(vertices=vertices, colors=colors, tex_coords=tex_coords, indices=QUAD_TRIANGLES)
 
 class GlCircle(GlVertices):
     '''
     Circle parallel to the xz plane
     '''
     def __init__(self, color=(1, 1, 1, 1), center=(0, 0, 0), radius=1.0, n_steps=36):
-        # call the super constructor
-        super().__init__()
-
         color = getColorTuple(color)
 
         angles = np.linspace(0, 2*np.pi, n_steps+1)
-        for wedge in range(n_steps):
-            v1 = (radius*np.sin(angles[wedge]),
-                  0,
-                  radius*np.cos(angles[wedge]))
-            v2 = (radius*np.sin(angles[wedge+1]),
-                  0,
-                  radius*np.cos(angles[wedge+1]))
+        rim = np.array([radius*np.sin(angles), np.zeros(n_steps+1), radius*np.cos(angles)])
 
-            self.add(GlTri(v1, v2, (0,0,0), color).translate(center))
+        # one wedge (rim[i], rim[i+1], center) per step
+        vertices = translate(np.concatenate((rim, np.zeros((3, 1))), axis=1), center)
+        super().__init__(vertices=vertices, colors=repeat_color(color, vertices.shape[1]), indices=fan_indices(n_steps))
 
 class GlCube(GlVertices):
     def __init__(self, colors=None, center=[0, 0, 0], side_length=1.0):
-        # call the super constructor
-        super().__init__()
-
         # set defaults
         if colors is None:
             colors = {}
@@ -148,18 +424,19 @@ class GlCube(GlVertices):
         s = side_length/2
 
         # add all of the faces
-        self.add(GlQuad((+s, -s, -s), (+s, +s, -s), (+s, +s, +s), (+s, -s, +s), colors['+x']).translate(center))
-        self.add(GlQuad((-s, -s, -s), (-s, +s, -s), (-s, +s, +s), (-s, -s, +s), colors['-x']).translate(center))
-        self.add(GlQuad((+s, +s, -s), (-s, +s, -s), (-s, +s, +s), (+s, +s, +s), colors['+y']).translate(center))
-        self.add(GlQuad((+s, -s, -s), (-s, -s, -s), (-s, -s, +s), (+s, -s, +s), colors['-y']).translate(center))
-        self.add(GlQuad((+s, -s, +s), (+s, +s, +s), (-s, +s, +s), (-s, -s, +s), colors['+z']).translate(center))
-        self.add(GlQuad((+s, -s, -s), (+s, +s, -s), (-s, +s, -s), (-s, -s, -s), colors['-z']).translate(center))
+        builder = GlVerticesBuilder(capacity=36)
+        builder.append(GlQuad((+s, -s, -s), (+s, +s, -s), (+s, +s, +s), (+s, -s, +s), colors['+x']).translate(center))
+        builder.append(GlQuad((-s, -s, -s), (-s, +s, -s), (-s, +s, +s), (-s, -s, +s), colors['-x']).translate(center))
+        builder.append(GlQuad((+s, +s, -s), (-s, +s, -s), (-s, +s, +s), (+s, +s, +s), colors['+y']).translate(center))
+        builder.append(GlQuad((+s, -s, -s), (-s, -s, -s), (-s, -s, +s), (+s, -s, +s), colors['-y']).translate(center))
+        builder.append(GlQuad((+s, -s, +s), (+s, +s, +s), (-s, +s, +s), (-s, -s, +s), colors['+z']).translate(center))
+        builder.append(GlQuad((+s, -s, -s), (+s, +s, -s), (-s, +s, -s), (-s, -s, -s), colors['-z']).translate(center))
+
+        faces = builder.freeze()
+        super().__init__(buffer=faces.buffer, indices=faces.indices)
 
 class GlBox(GlVertices):
     def __init__(self, colors=None, center=(0, 0, 0), side_lengths={'x':1.0, 'y':1.0, 'z':1.0}):
-        # call the super constructor
-        super().__init__()
-
         # set defaults
         if colors is None:
             colors = {}
@@ -182,12 +459,16 @@ class GlBox(GlVertices):
         z = side_lengths['z']/2
 
         # add all of the faces
-        self.add(GlQuad((+x, -y, -z), (+x, +y, -z), (+x, +y, +z), (+x, -y, +z), colors['+x']).translate(center))
-        self.add(GlQuad((-x, -y, -z), (-x, +y, -z), (-x, +y, +z), (-x, -y, +z), colors['-x']).translate(center))
-        self.add(GlQuad((+x, +y, -z), (-x, +y, -z), (-x, +y, +z), (+x, +y, +z), colors['+y']).translate(center))
-        self.add(GlQuad((+x, -y, -z), (-x, -y, -z), (-x, -y, +z), (+x, -y, +z), colors['-y']).translate(center))
-        self.add(GlQuad((+x, -y, +z), (+x, +y, +z), (-x, +y, +z), (-x, -y, +z), colors['+z']).translate(center))
-        self.add(GlQuad((+x, -y, -z), (+x, +y, -z), (-x, +y, -z), (-x, -y, -z), colors['-z']).translate(center))
+        builder = GlVerticesBuilder(capacity=36)
+        builder.append(GlQuad((+x, -y, -z), (+x, +y, -z), (+x, +y, +z), (+x, -y, +z), colors['+x']).translate(center))
+        builder.append(GlQuad((-x, -y, -z), (-x, +y, -z), (-x, +y, +z), (-x, -y, +z), colors['-x']).translate(center))
+        builder.append(GlQuad((+x, +y, -z), (-x, +y, -z), (-x, +y, +z), (+x, +y, +z), colors['+y']).translate(center))
+        builder.append(GlQuad((+x, -y, -z), (-x, -y, -z), (-x, -y, +z), (+x, -y, +z), colors['-y']).translate(center))
+        builder.append(GlQuad((+x, -y, +z), (+x, +y, +z), (-x, +y, +z), (-x, -y, +z), colors['+z']).translate(center))
+        builder.append(GlQuad((+x, -y, -z), (+x, +y, -z), (-x, +y, -z), (-x, -y, -z), colors['-z']).translate(center))
+
+        faces = builder.freeze()
+        super().__init__(buffer=faces.buffer, indices=faces.indices)
 
 class GlSphericalRect(GlVertices):
     def __init__(self,
@@ -197,23 +478,13 @@ class GlSphericalRect(GlVertices):
                  color=[1, 1, 1, 1],  # [r,g,b,a] or single value for monochrome, alpha = 1
                  n_steps_x=6,
                  n_steps_y=6):
-        super().__init__()
         color = getColorTuple(color)
 
-        d_theta = (1/n_steps_x) * radians(width)
-        d_phi = (1/n_steps_y) * radians(height)
-        for rr in range(n_steps_y):
-            for cc in range(n_steps_x):
-                # render patch at the equator (phi=pi/2) so it's not near the poles
-                # Also render it at theta = 90 degrees, for flystim coordinates where heading (0,0,0) is +y axis
-                theta = np.pi/2 + radians(width) * (-1/2 + (cc/n_steps_x))
-                phi = np.pi/2 + radians(height) * (-1/2 + (rr/n_steps_y))
-                v1 = spherical_to_cartesian(sphere_radius, theta, phi)
-                v2 = spherical_to_cartesian(sphere_radius, theta, phi + d_phi)
-                v3 = spherical_to_cartesian(sphere_radius, theta + d_theta, phi)
-                v4 = spherical_to_cartesian(sphere_radius, theta + d_theta, phi + d_phi)
-                self.add(GlTri(v1, v2, v4, color))
-                self.add(GlTri(v1, v3, v4, color))
+        # render patch at the equator (phi=pi/2) so it's not near the poles
+        # Also render it at theta = 90 degrees, for flystim coordinates where heading (0,0,0) is +y axis
+        theta, phi, grid_tex_coords, indices = rect_grid(width, height, n_steps_x, n_steps_y)
+        vertices = np.array(spherical_to_cartesian(sphere_radius, theta, phi))
+        super().__init__(vertices=vertices, colors=repeat_color(color, vertices.shape[1]), indices=indices)
 
 class GlSphericalTexturedRect(GlVertices):
     def __init__(self,
@@ -225,36 +496,18 @@ class GlSphericalTexturedRect(GlVertices):
                  n_steps_y=6,
                  texture=False,
                  texture_shift=(0, 0)):
-        super().__init__()
         color = getColorTuple(color)
 
-        d_theta = (1/n_steps_x) * radians(width)
-        d_phi = (1/n_steps_y) * radians(height)
-        for rr in range(n_steps_y):
-            for cc in range(n_steps_x):
-                # render patch at the equator (phi=pi/2) so it's not near the poles
-                # Also render it at theta = 90 degrees, for flystim coordinates where heading (0,0,0) is +y axis
-                theta = np.pi/2 + radians(width) * (-1/2 + (cc/n_steps_x))
-                phi = np.pi/2 + radians(height) * (-1/2 + (rr/n_steps_y))
-                v1 = spherical_to_cartesian(sphere_radius, theta, phi)
-                v2 = spherical_to_cartesian(sphere_radius, theta, phi + d_phi)
-                v3 = spherical_to_cartesian(sphere_radius, theta + d_theta, phi)
-                v4 = spherical_to_cartesian(sphere_radius, theta + d_theta, phi + d_phi)
-                if texture:
-                    tc1 = (cc/n_steps_x, rr/n_steps_y)
-                    tc2 = (cc/n_steps_x, (rr+1)/n_steps_y)
-                    tc3 = ((cc+1)/n_steps_x, rr/n_steps_y)
-                    tc4 = ((cc+1)/n_steps_x, (rr+1)/n_steps_y)
-                    self.add(GlTri(v1, v2, v4, color, [sum(x) for x in zip(tc1, texture_shift)],
-                                                      [sum(x) for x in zip(tc2, texture_shift)],
-                                                      [sum(x) for x in zip(tc4, texture_shift)]))
-
-                    self.add(GlTri(v1, v3, v4, color, [sum(x) for x in zip(tc1, texture_shift)],
-                                                      [sum(x) for x in zip(tc3, texture_shift)],
-                                                      [sum(x) for x in zip(tc4, texture_shift)]))
-                else:
-                    self.add(GlTri(v1, v2, v4, color))
-                    self.add(GlTri(v1, v3, v4, color))
+        # render patch at the equator (phi=pi/2) so it's not near the poles
+        # Also render it at theta = 90 degrees, for flystim coordinates where heading (0,0,0) is +y axis
+        theta, phi, grid_tex_coords, indices = rect_grid(width, height, n_steps_x, n_steps_y)
+        vertices = np.array(spherical_to_cartesian(sphere_radius, theta, phi))
+
+        if texture:
+            tex_coords = grid_tex_coords + np.array(texture_shift)[:, np.newaxis]
+        else:
+            tex_coords = None
+        super().__init__(vertices=vertices, colors=repeat_color(color, vertices.shape[1]), tex_coords=tex_coords, indices=indices)
 
 class GlSphericalEllipse(GlVertices):
     def __init__(self,
@@ -264,23 +517,20 @@ class GlSphericalEllipse(GlVertices):
                  color=[1, 1, 1, 1],  # [r,g,b,a] or single value for monochrome, alpha = 1
                  sphere_location=(0, 0, 0),  # (x,y,z) meters. (0,0,0) is center of sphere
                  n_steps=36):
-        super().__init__()
         color = getColorTuple(color)
 
         v_center = spherical_to_cartesian(sphere_radius, np.pi/2, np.pi/2)
 
+        # render circle at the equator (phi=pi/2) so it's not near the poles
+        # Also render it at theta = 90 degrees, for flystim coordinates where heading (0,0,0) is +y axis
         angles = np.linspace(0, 2*np.pi, n_steps+1)
-        for wedge in range(n_steps):
-            # render circle at the equator (phi=pi/2) so it's not near the poles
-            # Also render it at theta = 90 degrees, for flystim coordinates where heading (0,0,0) is +y axis
-            v1 = spherical_to_cartesian(sphere_radius,
-                                        np.pi/2 + radians(width/2)*np.cos(angles[wedge]),
-                                        np.pi/2 + radians(height/2)*np.sin(angles[wedge]))
-            v2 = spherical_to_cartesian(sphere_radius,
-                                        np.pi/2 + radians(width/2)*np.cos(angles[wedge+1]),
-                                        np.pi/2 + radians(height/2)*np.sin(angles[wedge+1]))
-
-            self.add(GlTri(v1, v2, v_center, color).translate(sphere_location))
+        rim = np.array(spherical_to_cartesian(sphere_radius,
+                                              np.pi/2 + radians(width/2)*np.cos(angles),
+                                              np.pi/2 + radians(height/2)*np.sin(angles)))
+
+        # one wedge (rim[i], rim[i+1], center) per step
+        vertices = translate(np.concatenate((rim, np.array(v_center)[:, np.newaxis]), axis=1), sphere_location)
+        super().__init__(vertices=vertices, colors=repeat_color(color, vertices.shape[1]), indices=fan_indices(n_steps))
 
 class GlCylindricalWithPhiEllipse(GlVertices):
     def __init__(self,
@@ -290,23 +540,20 @@ class GlCylindricalWithPhiEllipse(GlVertices):
                  color=[1, 1, 1, 1],  # [r,g,b,a] or single value for monochrome, alpha = 1
                  cylinder_location=(0, 0, 0),  # (x,y,z) meters. (0,0,0) is center of cylinder
                  n_steps=36):
-        super().__init__()
         color = getColorTuple(color)
 
         v_center = cylindrical_w_phi_to_cartesian(cylinder_radius, np.pi/2, np.pi/2)
 
+        # render circle at the equator (phi=pi/2) so it's not near the poles
+        # Also render it at theta = 90 degrees, for flystim coordinates where heading (0,0,0) is +y axis
         angles = np.linspace(0, 2*np.pi, n_steps+1)
-        for wedge in range(n_steps):
-            # render circle at the equator (phi=pi/2) so it's not near the poles
-            # Also render it at theta = 90 degrees, for flystim coordinates where heading (0,0,0) is +y axis
-            v1 = cylindrical_w_phi_to_cartesian(cylinder_radius,
-                                            np.pi/2 + radians(width/2)*np.cos(angles[wedge]),
-                                            np.pi/2 + radians(height/2)*np.sin(angles[wedge]))
-            v2 = cylindrical_w_phi_to_cartesian(cylinder_radius,
-                                            np.pi/2 + radians(width/2)*np.cos(angles[wedge+1]),
-                                            np.pi/2 + radians(height/2)*np.sin(angles[wedge+1]))
-
-            self.add(GlTri(v1, v2, v_center, color).translate(cylinder_location))
+        rim = np.array(cylindrical_w_phi_to_cartesian(cylinder_radius,
+                                                      np.pi/2 + radians(width/2)*np.cos(angles),
+                                                      np.pi/2 + radians(height/2)*np.sin(angles)))
+
+        # one wedge (rim[i], rim[i+1], center) per step
+        vertices = translate(np.concatenate((rim, np.array(v_center)[:, np.newaxis]), axis=1), cylinder_location)
+        super().__init__(vertices=vertices, colors=repeat_color(color, vertices.shape[1]), indices=fan_indices(n_steps))
 
 class GlSphericalCirc(GlVertices):
     def __init__(self,
@@ -315,23 +562,20 @@ class GlSphericalCirc(GlVertices):
                  color=[1, 1, 1, 1],  # [r,g,b,a] or single value for monochrome, alpha = 1
                  sphere_location=(0, 0, 0),  # (x,y,z) meters. (0,0,0) is center of sphere
                  n_steps=36):
-        super().__init__()
         color = getColorTuple(color)
 
         v_center = spherical_to_cartesian(sphere_radius, np.pi/2, np.pi/2)
 
+        # render circle at the equator (phi=pi/2) so it's not near the poles
+        # Also render it at theta = 90 degrees, for flystim coordinates where heading (0,0,0) is +y axis
         angles = np.linspace(0, 2*np.pi, n_steps+1)
-        for wedge in range(n_steps):
-            # render circle at the equator (phi=pi/2) so it's not near the poles
-            # Also render it at theta = 90 degrees, for flystim coordinates where heading (0,0,0) is +y axis
-            v1 = spherical_to_cartesian(sphere_radius,
-                                        np.pi/2 + radians(circle_radius)*np.cos(angles[wedge]),
-                                        np.pi/2 + radians(circle_radius)*np.sin(angles[wedge]))
-            v2 = spherical_to_cartesian(sphere_radius,
-                                        np.pi/2 + radians(circle_radius)*np.cos(angles[wedge+1]),
-                                        np.pi/2 + radians(circle_radius)*np.sin(angles[wedge+1]))
-
-            self.add(GlTri(v1, v2, v_center, color).translate(sphere_location))
+        rim = np.array(spherical_to_cartesian(sphere_radius,
+                                              np.pi/2 + radians(circle_radius)*np.cos(angles),
+                                              np.pi/2 + radians(circle_radius)*np.sin(angles)))
+
+        # one wedge (rim[i], rim[i+1], center) per step
+        vertices = translate(np.concatenate((rim, np.array(v_center)[:, np.newaxis]), axis=1), sphere_location)
+        super().__init__(vertices=vertices, colors=repeat_color(color, vertices.shape[1]), indices=fan_indices(n_steps))
 
 class GlCylindricalPoints(GlVertices):
     def __init__(self,
@@ -343,12 +587,8 @@ class GlCylindricalPoints(GlVertices):
 
         color = getColorTuple(color)
 
-        cartesian_coords = []
-        for pt in range(len(theta)):
-            cartesian_coords.append(cylindrical_w_phi_to_cartesian(cylinder_radius, radians(theta[pt]), radians(phi[pt])))
-
-        vertices = np.vstack(cartesian_coords).T  # 3 x n_points
-        colors = matlib.repmat(color, len(theta), 1).T  # 4 x n_points
+        vertices = np.array(cylindrical_w_phi_to_cartesian(cylinder_radius, np.radians(theta), np.radians(phi)))  # 3 x n_points
+        colors = repeat_color(color, len(theta))  # 4 x n_points
 
         super().__init__(vertices=vertices, colors=colors)
 
@@ -361,12 +601,8 @@ class GlSphericalPoints(GlVertices):
 
         color = getColorTuple(color)
 
-        cartesian_coords = []
-        for pt in range(len(theta)):
-            cartesian_coords.append(spherical_to_cartesian(sphere_radius, np.pi/2 + radians(theta[pt]), np.pi/2 + radians(phi[pt])))
-
-        vertices = np.vstack(cartesian_coords).T  # 3 x n_points
-        colors = matlib.repmat(color, len(theta), 1).T  # 4 x n_points
+        vertices = np.array(spherical_to_cartesian(sphere_radius, np.pi/2 + np.radians(theta), np.pi/2 + np.radians(phi)))  # 3 x n_points
+        colors = repeat_color(color, len(theta))  # 4 x n_points
 
         super().__init__(vertices=vertices, colors=colors)
 
@@ -377,7 +613,7 @@ class GlPointCollection(GlVertices):
         color = getColorTuple(color)
 
         vertices = np.vstack(locations)  # 3 x n_points
-        colors = matlib.repmat(color, vertices.shape[1], 1).T  # 4 x n_points
+        colors = repeat_color(color, vertices.shape[1])  # 4 x n_points
 
         super().__init__(vertices=vertices, colors=colors)
 
@@ -393,7 +629,6 @@ class GlCylinder(GlVertices):
                  texture=False,
                  texture_shift=(0, 0)):  # (u,v) coordinates to translate texture on shape. + is right, up.
 
-        super().__init__()
         color = getColorTuple(color)
 
         if alpha_by_face is None:
@@ -401,24 +636,38 @@ class GlCylinder(GlVertices):
 
         d_theta = np.radians(cylinder_angular_extent) / n_faces
         theta_start = -np.radians(cylinder_angular_extent)/2
-        for face in range(n_faces):
-            v1 = cylindrical_to_cartesian(cylinder_radius, theta_start+face*d_theta, cylinder_height/2)
-            v2 = cylindrical_to_cartesian(cylinder_radius, theta_start+face*d_theta, -cylinder_height/2)
-            v3 = cylindrical_to_cartesian(cylinder_radius, theta_start+(face+1)*d_theta, -cylinder_height/2)
-            v4 = cylindrical_to_cartesian(cylinder_radius, theta_start+(face+1)*d_theta, cylinder_height/2)
-
-            new_color = [color[0], color[1], color[2], alpha_by_face[face]]
-
-            if texture:
-                self.add(GlQuad(v1, v2, v3, v4, new_color,
-                                tc1=(face/n_faces, 1),
-                                tc2=(face/n_faces, 0),
-                                tc3=((face+1)/n_faces, 0),
-                                tc4=((face+1)/n_faces, 1),
-                                texture_shift=texture_shift,
-                                use_texture=True).translate(cylinder_location))
-            else:
-                self.add(GlQuad(v1, v2, v3, v4, color).translate(cylinder_location))
+        face = np.arange(n_faces)
+        ones = np.ones(n_faces)
+
+        # each face is a quad (v1, v2, v3, v4) from the top left corner, counterclockwise as seen from the center
+        if texture:
+            # faces don't share vertices, since alpha_by_face (which only applies to textured cylinders) gives each
+            # face its own color
+            v1 = np.array(cylindrical_to_cartesian(cylinder_radius, theta_start+face*d_theta, ones*cylinder_height/2))
+            v2 = np.array(cylindrical_to_cartesian(cylinder_radius, theta_start+face*d_theta, -ones*cylinder_height/2))
+            v3 = np.array(cylindrical_to_cartesian(cylinder_radius, theta_start+(face+1)*d_theta, -ones*cylinder_height/2))
+            v4 = np.array(cylindrical_to_cartesian(cylinder_radius, theta_start+(face+1)*d_theta, ones*cylinder_height/2))
+            vertices = np.stack([v1, v2, v3, v4], axis=-1).reshape(3, -1)
+            indices = triangle_indices([4*face, 4*face+1, 4*face+2, 4*face+3], QUAD_TRIANGLES)
+
+            colors = np.repeat(np.array([ones*color[0], ones*color[1], ones*color[2], alpha_by_face]), 4, axis=1)
+            tex_coords = np.stack([np.array([face/n_faces, ones]),
+                                   np.array([face/n_faces, 0*ones]),
+                                   np.array([(face+1)/n_faces, 0*ones]),
+                                   np.array([(face+1)/n_faces, ones])], axis=-1).reshape(2, -1)
+            tex_coords = tex_coords + np.array(texture_shift)[:, np.newaxis]
+        else:
+            # top and bottom of each edge between faces, shared by the faces on either side
+            edge = np.arange(n_faces+1)
+            top = np.array(cylindrical_to_cartesian(cylinder_radius, theta_start+edge*d_theta, np.ones(n_faces+1)*cylinder_height/2))
+            bottom = np.array(cylindrical_to_cartesian(cylinder_radius, theta_start+edge*d_theta, -np.ones(n_faces+1)*cylinder_height/2))
+            vertices = np.stack([top, bottom], axis=-1).reshape(3, -1)
+            indices = triangle_indices([2*face, 2*face+1, 2*face+3, 2*face+2], QUAD_TRIANGLES)
+
+            colors = repeat_color(color, vertices.shape[1])
+            tex_coords = None
+        vertices = translate(vertices, cylinder_location)
+        super().__init__(vertices=vertices, colors=colors, tex_coords=tex_coords, indices=indices)
 
 class GlCylindricalWithPhiRect(GlVertices):
     def __init__(self,
@@ -428,23 +677,13 @@ class GlCylindricalWithPhiRect(GlVertices):
                  color=[1, 1, 1, 1],  # [r,g,b,a] or single value for monochrome, alpha = 1
                  n_steps_x=6,
                  n_steps_y=6):
-        super().__init__()
         color = getColorTuple(color)
 
-        d_theta = (1/n_steps_x) * radians(width)
-        d_phi = (1/n_steps_y) * radians(height)
-        for rr in range(n_steps_y):
-            for cc in range(n_steps_x):
-                # render patch at the equator (phi=pi/2) so it's not near the poles
-                # Also render it at theta = 90 degrees, for flystim coordinates where heading (0,0,0) is +y axis
-                theta = np.pi/2 + radians(width) * (-1/2 + (cc/n_steps_x))
-                phi = np.pi/2 + radians(height) * (-1/2 + (rr/n_steps_y))
-                v1 = cylindrical_w_phi_to_cartesian(cylinder_radius, theta, phi)
-                v2 = cylindrical_w_phi_to_cartesian(cylinder_radius, theta, phi + d_phi)
-                v3 = cylindrical_w_phi_to_cartesian(cylinder_radius, theta + d_theta, phi)
-                v4 = cylindrical_w_phi_to_cartesian(cylinder_radius, theta + d_theta, phi + d_phi)
-                self.add(GlTri(v1, v2, v4, color))
-                self.add(GlTri(v1, v3, v4, color))
+        # render patch at the equator (phi=pi/2) so it's not near the poles
+        # Also render it at theta = 90 degrees, for flystim coordinates where heading (0,0,0) is +y axis
+        theta, phi, grid_tex_coords, indices = rect_grid(width, height, n_steps_x, n_steps_y)
+        vertices = np.array(cylindrical_w_phi_to_cartesian(cylinder_radius, theta, phi))
+        super().__init__(vertices=vertices, colors=repeat_color(color, vertices.shape[1]), indices=indices)
 
 def getColorTuple(color_input):
     '''
@@ -463,3 +702,66 @@ def getColorTuple(color_input):
         color = tuple(color_input)
 
     return color
+
+
+# corner order of the two triangles each quad (v1, v2, v3, v4) is split into, as in GlQuad
+QUAD_TRIANGLES = (0, 1, 2, 0, 2, 3)
+# corner order of the two triangles each grid cell is split into. Corners are v1: (theta, phi),
+# v2: (theta, phi + d_phi), v3: (theta + d_theta, phi), v4: (theta + d_theta, phi + d_phi)
+GRID_TRIANGLES = (0, 1, 3, 0, 2, 3)
+
+def triangles(corners, order):
+    '''
+    Assemble triangles for many polygons at once.
+
+    :param corners: list of (n_dims, n_polygons) arrays, one for each corner of the polygons
+    :param order: corner indices of the triangles of each polygon, e.g. QUAD_TRIANGLES
+    :returns: (n_dims, len(order)*n_polygons) array, grouped by polygon
+    '''
+    return np.stack([corners[ind] for ind in order], axis=-1).reshape(corners[0].shape[0], -1)
+
+def triangle_indices(corners, order):
+    '''
+    :param corners: list of (n_polygons,) arrays of vertex indices, one for each corner of the polygons
+    :param order: corner indices of the triangles of each polygon, e.g. QUAD_TRIANGLES
+    :returns: (len(order)*n_polygons,) vertex indices of the triangles, grouped by polygon
+    '''
+    return triangles([np.asarray(corner)[np.newaxis, :] for corner in corners], order).ravel()
+
+def fan_indices(n_steps):
+    '''
+    :returns: vertex indices of the triangles (rim[i], rim[i+1], center) of a fan with vertices
+    rim[0], ..., rim[n_steps], center
+    '''
+    step = np.arange(n_steps)
+    return triangle_indices([step, step+1, np.full(n_steps, n_steps+1)], (0, 1, 2))
+
+def rect_grid(width, height, n_steps_x, n_steps_y):
+    '''
+    Grid of n_steps_x x n_steps_y cells covering a width x height (degrees) patch centered at theta = phi = pi/2
+
+    :returns: theta, phi (radians) and (2, n_points) texture coordinates of the grid points, row by row,
+    and the vertex indices of the triangles of each cell
+    '''
+    cc, rr = [x.ravel() for x in np.meshgrid(np.arange(n_steps_x+1), np.arange(n_steps_y+1))]
+    theta = np.pi/2 + radians(width) * (-1/2 + (cc/n_steps_x))
+    phi = np.pi/2 + radians(height) * (-1/2 + (rr/n_steps_y))
+    tex_coords = np.array([cc/n_steps_x, rr/n_steps_y])
+
+    # cell corners are v1: (cc, rr), v2: (cc, rr+1), v3: (cc+1, rr), v4: (cc+1, rr+1)
+    cell_cc, cell_rr = [x.ravel() for x in np.meshgrid(np.arange(n_steps_x), np.arange(n_steps_y))]
+    v1 = cell_rr*(n_steps_x+1) + cell_cc
+    indices = triangle_indices([v1, v1 + n_steps_x+1, v1 + 1, v1 + n_steps_x+2], GRID_TRIANGLES)
+
+    return theta, phi, tex_coords, indices
+
+def repeat_color(color, n_vertices):
+    '''
+    :param color: (r, g, b, a)
+    :returns: (4, n_vertices) array
+    '''
+    return np.tile(np.array(color)[:, np.newaxis], (1, n_vertices))
+
+
+# shared by all stimuli
+mesh_cache = MeshCache()
@@ -16,7 +16,7 @@ from flystim.shapes import GlSphericalRect, GlSphericalEllipse, GlCylindricalWit
                             GlCylindricalWithPhiEllipse, GlCylinder, GlCube, GlQuad, \
                             GlSphericalCirc, GlVertices, GlSphericalPoints, GlSphericalTexturedRect, \
                             GlPointCollection, GlCylindricalPoints, GlCircle, GlBox
-from flystim.shapes import getColorTuple
+from flystim.shapes import getColorTuple, mesh_cache
 from flystim import util, image
 import time  # for debugging and benchmarking
 import copy
@@ -75,7 +75,7 @@ class MovingEllipse(BaseProgram):
     def __init__(self, screen):
         super().__init__(screen=screen)
 
-    def configure(self, width=20, height=10, sphere_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0):
+    def configure(self, width=20, height=10, sphere_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0, n_steps=None):
         """
         Stimulus consisting of a circular patch on the surface of a sphere. Patch is circular in spherical coordinates.
 
@@ -86,9 +86,12 @@ class MovingEllipse(BaseProgram):
         :param theta: degrees, azimuth of the center of the patch (yaw rotation around z axis)
         :param phi: degrees, elevation of the center of the patch (pitch rotation around y axis)
         :param angle: degrees orientation of patch (roll rotation around x axis)
-        *Any of these params can be passed as a trajectory dict to vary these as a function of time elapsed
+        :param n_steps: number of steps around the ellipse, default: 36, or chosen from the size of the ellipse on the
+        screen if the screen sets lod_tolerance
+        *Any of these params (except n_steps) can be passed as a trajectory dict to vary these as a function of time elapsed
         """
         self.sphere_radius = sphere_radius
+        self.n_steps = n_steps
 
         self.width = make_as_trajectory(width)
         self.height = make_as_trajectory(height)
@@ -104,18 +107,21 @@ class MovingEllipse(BaseProgram):
         phi = return_for_time_t(self.phi, t)
         angle = return_for_time_t(self.angle, t)
         color = return_for_time_t(self.color, t)
-        # TODO: is there a way to make this object once in configure then update with radius in eval_at?
-        self.stim_object = GlSphericalEllipse(width=width,
-                                              height=height,
-                                              sphere_radius=self.sphere_radius,
-                                              color=color,
-                                              n_steps=36).rotate(np.radians(theta), np.radians(phi), np.radians(angle))
+        n_steps = self.lod.ellipse_steps(width, height) if self.n_steps is None else self.n_steps
+        # the mesh is only tessellated again when its size changes
+        self.stim_object = mesh_cache.get(GlSphericalEllipse,
+                                          width=width,
+                                          height=height,
+                                          sphere_radius=self.sphere_radius,
+                                          color=color,
+                                          n_steps=n_steps)
+        self.set_transform(yaw=np.radians(theta), pitch=np.radians(phi), roll=np.radians(angle))
 
 class MovingEllipseOnCylinder(BaseProgram):
     def __init__(self, screen):
         super().__init__(screen=screen)
 
-    def configure(self, width=20, height=10, cylinder_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0):
+    def configure(self, width=20, height=10, cylinder_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0, n_steps=None):
         """
         Stimulus consisting of a circular patch on the surface of a sphere. Patch is circular in spherical coordinates.
 
@@ -126,9 +132,12 @@ class MovingEllipseOnCylinder(BaseProgram):
         :param theta: degrees, azimuth of the center of the patch (yaw rotation around z axis)
         :param phi: degrees, elevation of the center of the patch (pitch rotation around y axis)
         :param angle: degrees orientation of patch (roll rotation around x axis)
-        *Any of these params can be passed as a trajectory dict to vary these as a function of time elapsed
+        :param n_steps: number of steps around the ellipse, default: 36, or chosen from the size of the ellipse on the
+        screen if the screen sets lod_tolerance
+        *Any of these params (except n_steps) can be passed as a trajectory dict to vary these as a function of time elapsed
         """
         self.cylinder_radius = cylinder_radius
+        self.n_steps = n_steps
 
         self.width = make_as_trajectory(width)
         self.height = make_as_trajectory(height)
@@ -144,18 +153,21 @@ class MovingEllipseOnCylinder(BaseProgram):
         phi = return_for_time_t(self.phi, t)
         angle = return_for_time_t(self.angle, t)
         color = return_for_time_t(self.color, t)
-        # TODO: is there a way to make this object once in configure then update with radius in eval_at?
-        self.stim_object = GlCylindricalWithPhiEllipse(width=width,
-                                              height=height,
-                                              cylinder_radius=self.cylinder_radius,
-                                              color=color,
-                                              n_steps=36).rotate(np.radians(theta), np.radians(phi), np.radians(angle))
+        n_steps = self.lod.ellipse_steps(width, height) if self.n_steps is None else self.n_steps
+        # the mesh is only tessellated again when its size changes
+        self.stim_object = mesh_cache.get(GlCylindricalWithPhiEllipse,
+                                          width=width,
+                                          height=height,
+                                          cylinder_radius=self.cylinder_radius,
+                                          color=color,
+                                          n_steps=n_steps)
+        self.set_transform(yaw=np.radians(theta), pitch=np.radians(phi), roll=np.radians(angle))
 
 class MovingSpot(BaseProgram):
     def __init__(self, screen):
         super().__init__(screen=screen)
 
-    def configure(self, radius=10, sphere_radius=1, color=[1, 1, 1, 1], theta=0, phi=0):
+    def configure(self, radius=10, sphere_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, n_steps=None):
         """
         Stimulus consisting of a circular patch on the surface of a sphere. Patch is circular in spherical coordinates.
 
@@ -164,9 +176,12 @@ class MovingSpot(BaseProgram):
         :param color: [r,g,b,a] or mono. Color of the patch
         :param theta: degrees, azimuth of the center of the patch (yaw rotation around z axis)
         :param phi: degrees, elevation of the center of the patch (pitch rotation around y axis)
-        *Any of these params can be passed as a trajectory dict to vary these as a function of time elapsed
+        :param n_steps: number of steps around the circle, default: 36, or chosen from the size of the circle on the
+        screen if the screen sets lod_tolerance
+        *Any of these params (except n_steps) can be passed as a trajectory dict to vary these as a function of time elapsed
         """
         self.sphere_radius = sphere_radius
+        self.n_steps = n_steps
 
         self.radius = make_as_trajectory(radius)
         self.color = make_as_trajectory(color)
@@ -178,18 +193,21 @@ class MovingSpot(BaseProgram):
         theta = return_for_time_t(self.theta, t)
         phi = return_for_time_t(self.phi, t)
         color = return_for_time_t(self.color, t)
-        # TODO: is there a way to make this object once in configure then update with radius in eval_at?
-        self.stim_object = GlSphericalCirc(circle_radius=radius,
-                                           sphere_radius=self.sphere_radius,
-                                           color=color,
-                                           n_steps=36).rotate(np.radians(theta), np.radians(phi), 0)
+        n_steps = self.lod.circle_steps(radius) if self.n_steps is None else self.n_steps
+        # the mesh is only tessellated again when its radius changes
+        self.stim_object = mesh_cache.get(GlSphericalCirc,
+                                          circle_radius=radius,
+                                          sphere_radius=self.sphere_radius,
+                                          color=color,
+                                          n_steps=n_steps)
+        self.set_transform(yaw=np.radians(theta), pitch=np.radians(phi))
 
 
 class MovingPatch(BaseProgram):
     def __init__(self, screen):
         super().__init__(screen=screen)
 
-    def configure(self, width=10, height=10, sphere_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0):
+    def configure(self, width=10, height=10, sphere_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0, n_steps_x=None, n_steps_y=None):
         """
         Stimulus consisting of a rectangular patch on the surface of a sphere. Patch is rectangular in spherical coordinates.
 
@@ -200,11 +218,15 @@ class MovingPatch(BaseProgram):
         :param theta: degrees, azimuth of the center of the patch (yaw rotation around z axis)
         :param phi: degrees, elevation of the center of the patch (pitch rotation around y axis)
         :param angle: degrees orientation of patch (roll rotation around x axis)
-        *Any of these params can be passed as a trajectory dict to vary these as a function of time elapsed
+        :param n_steps_x, n_steps_y: number of grid steps along width and height, default: 6 each, or chosen from
+        the size of the patch on the screen if the screen sets lod_tolerance
+        *Any of these params (except n_steps_x, n_steps_y) can be passed as a trajectory dict to vary these as a function of time elapsed
         """
         self.width = make_as_trajectory(width)
         self.height = make_as_trajectory(height)
         self.sphere_radius = sphere_radius
+        self.n_steps_x = n_steps_x
+        self.n_steps_y = n_steps_y
         self.color = make_as_trajectory(color)
         self.theta = make_as_trajectory(theta)
         self.phi = make_as_trajectory(phi)
@@ -217,11 +239,16 @@ class MovingPatch(BaseProgram):
         phi = return_for_time_t(self.phi, t)
         angle = return_for_time_t(self.angle, t)
         color = return_for_time_t(self.color, t)
-        # TODO: is there a way to make this object once in configure then update with width/height in eval_at?
-        self.stim_object = GlSphericalRect(width=width,
-                                           height=height,
-                                           sphere_radius=self.sphere_radius,
-                                           color=color).rotate(np.radians(theta), np.radians(phi), np.radians(angle))
+        n_steps_x, n_steps_y = self.lod.grid_steps(width, height)
+        # the mesh is only tessellated again when its size changes
+        self.stim_object = mesh_cache.get(GlSphericalRect,
+                                          width=width,
+                                          height=height,
+                                          sphere_radius=self.sphere_radius,
+                                          color=color,
+                                          n_steps_x=n_steps_x if self.n_steps_x is None else self.n_steps_x,
+                                          n_steps_y=n_steps_y if self.n_steps_y is None else self.n_steps_y)
+        self.set_transform(yaw=np.radians(theta), pitch=np.radians(phi), roll=np.radians(angle))
 
 
 class LoomingCircle(BaseProgram):
@@ -244,19 +271,26 @@ class LoomingCircle(BaseProgram):
         self.radius = radius
         self.n_steps = n_steps
         self.t_prev = 0
+        self.y_offset = 0
 
-        self.stim_object = GlCircle(color=return_for_time_t(self.color, 0),
+        self.current_color = getColorTuple(return_for_time_t(self.color, 0))
+        self.stim_object = GlCircle(color=self.current_color,
                                     center=(0, self.starting_distance, 0),
                                     radius=self.radius,
                                     n_steps=self.n_steps)
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
-        color = return_for_time_t(self.color, t)
+        color = getColorTuple(return_for_time_t(self.color, t))
         speed = return_for_time_t(self.speed, t)
 
-        self.stim_object = self.stim_object.translate((0, speed * (t - self.t_prev), 0)
-                                ).setColor(getColorTuple(color))
+        self.y_offset += speed * (t - self.t_prev)
         self.t_prev = t
+        self.set_transform(translation=(0, self.y_offset, 0))
+
+        # only rebuild the vertex data when the color changes
+        if color != self.current_color:
+            self.stim_object = self.stim_object.setColor(color)
+            self.current_color = color
 
 class MovingBox(BaseProgram):
     def __init__(self, screen):
@@ -295,6 +329,9 @@ class MovingBox(BaseProgram):
                   '+z': color, '-z': color}
         self.stim_object_template = GlBox(colors, (0, 0, 0), {'x':1, 'y':1, 'z':1})
 
+        self.current_color = getColorTuple(return_for_time_t(self.color, 0))
+        self.stim_object = self.stim_object_template.setColor(self.current_color)
+
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
         x_length = return_for_time_t(self.x_length, t)
         y_length = return_for_time_t(self.y_length, t)
@@ -307,11 +344,15 @@ class MovingBox(BaseProgram):
         pitch      = return_for_time_t(self.pitch, t)
         roll    = return_for_time_t(self.roll, t)
 
-        self.stim_object = copy.copy(self.stim_object_template
-                                    ).scale(np.array([x_length, y_length, z_length]).reshape(3,1)
-                                    ).rotate(np.radians(yaw), np.radians(pitch), np.radians(roll)
-                                    ).translate((x, y, z)
-                                    ).setColor(getColorTuple(color))
+        self.set_transform(scale=(x_length, y_length, z_length),
+                           yaw=np.radians(yaw), pitch=np.radians(pitch), roll=np.radians(roll),
+                           translation=(x, y, z))
+
+        # only rebuild the vertex data when the color changes
+        color = getColorTuple(color)
+        if color != self.current_color:
+            self.stim_object = self.stim_object_template.setColor(color)
+            self.current_color = color
 
 class MovingEllipsoid(BaseProgram):
     def __init__(self, screen):
@@ -345,6 +386,7 @@ class MovingEllipsoid(BaseProgram):
         self.roll = make_as_trajectory(roll)
 
         self.stim_object_template = GlIcosphere(return_for_time_t(self.color, 0), n_subdivisions).scale(0.5)
+        self.stim_object = self.stim_object_template
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
         x_length = return_for_time_t(self.x_length, t)
@@ -358,10 +400,9 @@ class MovingEllipsoid(BaseProgram):
         pitch      = return_for_time_t(self.pitch, t)
         roll    = return_for_time_t(self.roll, t)
 
-        self.stim_object = copy.copy(self.stim_object_template
-                                    ).scale(np.array((x_length, y_length, z_length)).reshape(3,1)
-                                    ).rotate(np.radians(yaw), np.radians(pitch), np.radians(roll)
-                                    ).translate((x, y, z))
+        self.set_transform(scale=(x_length, y_length, z_length),
+                           yaw=np.radians(yaw), pitch=np.radians(pitch), roll=np.radians(roll),
+                           translation=(x, y, z))
         # if self.color is not None: #TODO: fix coloring
         #     self.stim_object.setColor(getColorTuple(color))
 
@@ -393,6 +434,7 @@ class MovingFly(BaseProgram):
         self.roll = make_as_trajectory(roll)
 
         self.stim_object_template = GlFly(size=1, color=return_for_time_t(self.color, 0))
+        self.stim_object = self.stim_object_template
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
         size     = return_for_time_t(self.size, t)
@@ -404,10 +446,9 @@ class MovingFly(BaseProgram):
         pitch    = return_for_time_t(self.pitch, t)
         roll     = return_for_time_t(self.roll, t)
 
-        self.stim_object = copy.copy(self.stim_object_template
-                                    ).scale(size
-                                    ).rotate(np.radians(yaw), np.radians(pitch), np.radians(roll)
-                                    ).translate((x, y, z))
+        self.set_transform(scale=size,
+                           yaw=np.radians(yaw), pitch=np.radians(pitch), roll=np.radians(roll),
+                           translation=(x, y, z))
         # if self.color is not None: #TODO: fix coloring
         #     self.stim_object.setColor(getColorTuple(color))
 
@@ -452,19 +493,21 @@ class UniformWhiteNoise(BaseProgram):
         seed = int(round(self.start_seed + t*self.update_rate))
         np.random.seed(seed)
 
-        color = self.noise_distribution.get_random_values(1)
+        color = self.noise_distribution.get_random_values(1)[0]
         color = [color, color, color, 1]
-        # TODO: is there a way to make this object once in configure then update with width/height in eval_at?
-        self.stim_object = GlSphericalRect(width=self.width,
-                                           height=self.height,
-                                           sphere_radius=self.sphere_radius,
-                                           color=color).rotate(np.radians(self.theta), np.radians(self.phi), np.radians(self.angle))
+        # only the color changes from frame to frame, so the mesh is tessellated once
+        self.stim_object = mesh_cache.get(GlSphericalRect,
+                                          width=self.width,
+                                          height=self.height,
+                                          sphere_radius=self.sphere_radius,
+                                          color=color)
+        self.set_transform(yaw=np.radians(self.theta), pitch=np.radians(self.phi), roll=np.radians(self.angle))
 
 class MovingPatchOnCylinder(BaseProgram):
     def __init__(self, screen):
         super().__init__(screen=screen)
 
-    def configure(self, width=10, height=10, cylinder_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0):
+    def configure(self, width=10, height=10, cylinder_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0, n_steps_x=None, n_steps_y=None):
         """
         Stimulus consisting of a rectangular patch on the surface of a cylinder. Patch is rectangular in cylindrical coordinates.
 
@@ -475,11 +518,15 @@ class MovingPatchOnCylinder(BaseProgram):
         :param theta: degrees, azimuth of the center of the patch (yaw rotation around z axis)
         :param phi: degrees, elevation of the center of the patch (pitch rotation around y axis)
         :param angle: degrees orientation of patch (roll rotation around x axis)
-        *Any of these params can be passed as a trajectory dict to vary these as a function of time elapsed
+        :param n_steps_x, n_steps_y: number of grid steps along width and height, default: 6 each, or chosen from
+        the size of the patch on the screen if the screen sets lod_tolerance
+        *Any of these params (except n_steps_x, n_steps_y) can be passed as a trajectory dict to vary these as a function of time elapsed
         """
         self.width = make_as_trajectory(width)
         self.height = make_as_trajectory(height)
         self.cylinder_radius = cylinder_radius
+        self.n_steps_x = n_steps_x
+        self.n_steps_y = n_steps_y
         self.color = make_as_trajectory(color)
         self.theta = make_as_trajectory(theta)
         self.phi = make_as_trajectory(phi)
@@ -492,11 +539,16 @@ class MovingPatchOnCylinder(BaseProgram):
         phi = return_for_time_t(self.phi, t)
         angle = return_for_time_t(self.angle, t)
         color = return_for_time_t(self.color, t)
-        # TODO: is there a way to make this object once in configure then update with width/height in eval_at?
-        self.stim_object = GlCylindricalWithPhiRect(width=width,
-                                           height=height,
-                                           cylinder_radius=self.cylinder_radius,
-                                           color=color).rotate(np.radians(theta), np.radians(phi), np.radians(angle))
+        n_steps_x, n_steps_y = self.lod.grid_steps(width, height)
+        # the mesh is only tessellated again when its size changes
+        self.stim_object = mesh_cache.get(GlCylindricalWithPhiRect,
+                                          width=width,
+                                          height=height,
+                                          cylinder_radius=self.cylinder_radius,
+                                          color=color,
+                                          n_steps_x=n_steps_x if self.n_steps_x is None else self.n_steps_x,
+                                          n_steps_y=n_steps_y if self.n_steps_y is None else self.n_steps_y)
+        self.set_transform(yaw=np.radians(theta), pitch=np.radians(phi), roll=np.radians(angle))
 
 
 class TexturedSphericalPatch(BaseProgram):
@@ -504,7 +556,7 @@ class TexturedSphericalPatch(BaseProgram):
         super().__init__(screen=screen)
         self.use_texture = True
 
-    def configure(self, width=10, height=10, sphere_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0, n_steps_x=12, n_steps_y=12):
+    def configure(self, width=10, height=10, sphere_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0, n_steps_x=None, n_steps_y=None):
         """
         Stimulus consisting of a rectangular patch on the surface of a sphere. Patch is rectangular in spherical coordinates.
 
@@ -515,6 +567,8 @@ class TexturedSphericalPatch(BaseProgram):
         :param theta: degrees, azimuth of the center of the patch (yaw rotation around z axis)
         :param phi: degrees, elevation of the center of the patch (pitch rotation around y axis)
         :param angle: degrees orientation of patch (roll rotation around x axis)
+        :param n_steps_x, n_steps_y: number of grid steps along width and height, default: 12 each, or chosen from
+        the size of the patch on the screen if the screen sets lod_tolerance
         *Any of these params can be passed as a trajectory dict to vary these as a function of time elapsed
         """
         self.width = width
@@ -525,6 +579,10 @@ class TexturedSphericalPatch(BaseProgram):
         self.phi = phi
         self.angle = angle
 
+        default_steps_x, default_steps_y = self.lod.grid_steps(self.width, self.height, default=(12, 12))
+        n_steps_x = default_steps_x if n_steps_x is None else n_steps_x
+        n_steps_y = default_steps_y if n_steps_y is None else n_steps_y
+
         self.stim_object = GlSphericalTexturedRect(width=self.width,
                                                    height=self.height,
                                                    sphere_radius=self.sphere_radius,
@@ -544,7 +602,7 @@ class RandomGridOnSphericalPatch(TexturedSphericalPatch):
         super().__init__(screen=screen)
 
     def configure(self, patch_width=5, patch_height=5, distribution_data=None, update_rate=60.0, start_seed=0,
-                  width=30, height=30, sphere_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0, rgb_texture=False, n_steps_x=12, n_steps_y=12):
+                  width=30, height=30, sphere_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0, rgb_texture=False, n_steps_x=None, n_steps_y=None):
         """
         Random square grid pattern painted on a spherical patch.
 
@@ -616,7 +674,7 @@ class TexturedSphericalPatchNoRotate(BaseProgram):
         super().__init__(screen=screen)
         self.use_texture = True
 
-    def configure(self, width=10, height=10, sphere_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0, n_steps_x=12, n_steps_y=12):
+    def configure(self, width=10, height=10, sphere_radius=1, color=[1, 1, 1, 1], theta=0, phi=0, angle=0, n_steps_x=None, n_steps_y=None):
         """
         Stimulus consisting of a rectangular patch on the surface of a sphere. Patch is rectangular in spherical coordinates.
 
@@ -627,6 +685,8 @@ class TexturedSphericalPatchNoRotate(BaseProgram):
         :param theta: degrees, azimuth of the center of the patch (yaw rotation around z axis)
         :param phi: degrees, elevation of the center of the patch (pitch rotation around y axis)
         :param angle: degrees orientation of patch (roll rotation around x axis)
+        :param n_steps_x, n_steps_y: number of grid steps along width and height, default: 12 each, or chosen from
+        the size of the patch on the screen if the screen sets lod_tolerance
         *Any of these params can be passed as a trajectory dict to vary these as a function of time elapsed
         """
         self.width = width
@@ -637,6 +697,10 @@ class TexturedSphericalPatchNoRotate(BaseProgram):
         self.phi = phi
         self.angle = angle
 
+        default_steps_x, default_steps_y = self.lod.grid_steps(self.width, self.height, default=(12, 12))
+        n_steps_x = default_steps_x if n_steps_x is None else n_steps_x
+        n_steps_y = default_steps_y if n_steps_y is None else n_steps_y
+
         self.stim_object = GlSphericalTexturedRect(width=self.width,
                                                    height=self.height,
                                                    sphere_radius=self.sphere_radius,
@@ -656,7 +720,7 @@ class SphericalMovingGrating(TexturedSphericalPatchNoRotate):
         super().__init__(screen=screen)
 
     def configure(self, patch_width=20, patch_height=80, update_rate=60.0, width=80, height=80, sphere_radius=1, color=[1, 0, 1, 1],
-                    theta=0, phi=0, angle=0, rate=20, n_steps_x=12, n_steps_y=12):
+                    theta=0, phi=0, angle=0, rate=20, n_steps_x=None, n_steps_y=None):
         """
         Vertical square grid pattern painted on a spherical patch that rotates over time.
 
@@ -693,7 +757,8 @@ class SphericalMovingGrating(TexturedSphericalPatchNoRotate):
         # define the rotation extent for each step
         shift_u = t * rate/360
         # it seems that this rotation is stacking on top of the rotation in textured_spherical_patch
-        self.stim_object = copy.copy(self.stim_object_template).shiftTexture((shift_u, 0)).rotate(np.radians(theta), np.radians(phi), np.radians(angle))
+        self.set_texture_shift((shift_u, 0))
+        self.set_transform(yaw=np.radians(theta), pitch=np.radians(phi), roll=np.radians(angle))
 
 
 
@@ -703,7 +768,7 @@ class SphericalMovingSineGrating(TexturedSphericalPatchNoRotate):
         super().__init__(screen=screen)
 
     def configure(self, period=20, update_rate=60.0, width=160, height=160, sphere_radius=1, color=[1, 0, 1, 1],
-                    theta=0, phi=0, angle=0, rate=20, n_steps_x=12, n_steps_y=12):
+                    theta=0, phi=0, angle=0, rate=20, n_steps_x=None, n_steps_y=None):
         """
         Vertical square grid pattern painted on a spherical patch that rotates over time.
 
@@ -738,7 +803,8 @@ class SphericalMovingSineGrating(TexturedSphericalPatchNoRotate):
         # define the rotation extent for each step
         shift_u = t * rate/160
         # it seems that this rotation is stacking on top of the rotation in textured_spherical_patch
-        self.stim_object = copy.copy(self.stim_object_template).shiftTexture((shift_u, 0)).rotate(np.radians(theta), np.radians(phi), np.radians(angle))
+        self.set_texture_shift((shift_u, 0))
+        self.set_transform(yaw=np.radians(theta), pitch=np.radians(phi), roll=np.radians(angle))
 
 
 
@@ -822,6 +888,7 @@ class CylindricalGrating(TexturedCylinder):
                                       cylinder_radius=self.cylinder_radius,
                                       cylinder_angular_extent=self.cylinder_angular_extent,
                                       color=[1, 1, 1, 1],
+                                      n_faces=self.lod.cylinder_faces(self.cylinder_angular_extent),
                                       texture=True).rotate(np.radians(theta), np.radians(phi), np.radians(angle))
 
         self.mean = make_as_trajectory(mean)
@@ -882,7 +949,7 @@ class RotatingGrating(CylindricalGrating):
         self.hold_duration = hold_duration
         self.alpha_by_face = alpha_by_face
         if self.alpha_by_face is None:
-            self.n_faces = 32
+            self.n_faces = self.lod.cylinder_faces(self.cylinder_angular_extent)
         else:
             self.n_faces = len(self.alpha_by_face)
         self.updateTexture(mean=mean, contrast=contrast, offset=offset)
@@ -895,6 +962,7 @@ class RotatingGrating(CylindricalGrating):
                                                alpha_by_face=self.alpha_by_face,
                                                n_faces=self.n_faces,
                                                texture=True)
+        self.stim_object = self.stim_object_template
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
         theta = return_for_time_t(self.theta, t)
@@ -903,7 +971,8 @@ class RotatingGrating(CylindricalGrating):
         rate = return_for_time_t(self.rate, t)
 
         shift_u = max(t - self.hold_duration, 0) * rate/self.cylinder_angular_extent
-        self.stim_object = copy.copy(self.stim_object_template).shiftTexture((shift_u, 0)).rotate(np.radians(theta), np.radians(phi), np.radians(angle))
+        self.set_texture_shift((shift_u, 0))
+        self.set_transform(yaw=np.radians(theta), pitch=np.radians(phi), roll=np.radians(angle))
 
 
 class ExpandingEdges(TexturedCylinder):
@@ -963,14 +1032,16 @@ class ExpandingEdges(TexturedCylinder):
                                                cylinder_angular_extent=self.cylinder_angular_extent,
                                                color=self.color,
                                                cylinder_location=self.cylinder_location,
+                                               n_faces=self.lod.cylinder_faces(self.cylinder_angular_extent),
                                                texture=True)
+        self.stim_object = self.stim_object_template
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
         theta = return_for_time_t(self.theta, t)
         phi = return_for_time_t(self.phi, t)
         angle = return_for_time_t(self.angle, t)
 
-        self.stim_object = copy.copy(self.stim_object_template).rotate(np.radians(theta), np.radians(phi), np.radians(angle))
+        self.set_transform(yaw=np.radians(theta), pitch=np.radians(phi), roll=np.radians(angle))
 
         # Construct one subimg
 
@@ -1050,14 +1121,16 @@ class RandomBars(TexturedCylinder):
                                                cylinder_angular_extent=self.cylinder_angular_extent,
                                                color=self.color,
                                                cylinder_location=self.cylinder_location,
+                                               n_faces=self.lod.cylinder_faces(self.cylinder_angular_extent),
                                                texture=True)
+        self.stim_object = self.stim_object_template
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
         theta = return_for_time_t(self.theta, t)
         phi = return_for_time_t(self.phi, t)
         angle = return_for_time_t(self.angle, t)
 
-        self.stim_object = copy.copy(self.stim_object_template).rotate(np.radians(theta), np.radians(phi), np.radians(angle))
+        self.set_transform(yaw=np.radians(theta), pitch=np.radians(phi), roll=np.radians(angle))
 
         # set the seed
         seed = int(round(self.start_seed + t*self.update_rate))
@@ -1135,6 +1208,7 @@ class RandomGrid(TexturedCylinder):
                                       cylinder_radius=self.cylinder_radius,
                                       cylinder_angular_extent=self.cylinder_angular_extent,
                                       color=self.color,
+                                      n_faces=self.lod.cylinder_faces(self.cylinder_angular_extent),
                                       texture=True).rotate(np.radians(self.theta), np.radians(self.phi), np.radians(self.angle))
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
@@ -1205,6 +1279,7 @@ class Checkerboard(TexturedCylinder):
                                       cylinder_radius=self.cylinder_radius,
                                       cylinder_angular_extent=self.cylinder_angular_extent,
                                       color=self.color,
+                                      n_faces=self.lod.cylinder_faces(self.cylinder_angular_extent),
                                       texture=True).rotate(np.radians(self.theta), np.radians(self.phi), np.radians(self.angle))
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
@@ -1215,7 +1290,7 @@ class Tower(BaseProgram):
     def __init__(self, screen):
         super().__init__(screen=screen)
 
-    def configure(self, color=[1, 0, 0, 1], cylinder_radius=0.5, cylinder_height=0.5, cylinder_location=[+5, 0, 0], n_faces=16):
+    def configure(self, color=[1, 0, 0, 1], cylinder_radius=0.5, cylinder_height=0.5, cylinder_location=[+5, 0, 0], n_faces=None):
         """
         Cylindrical tower object in arbitrary x, y, z coords.
 
@@ -1223,12 +1298,15 @@ class Tower(BaseProgram):
         :param cylinder_radius: meters
         :param cylinder_height: meters
         :param cylinder_location: [x, y, z] location of the center of the cylinder, meters
-        :param n_faces: number of quad faces to make the cylinder out of
+        :param n_faces: number of quad faces to make the cylinder out of, default: 16, or chosen from the size of the
+        tower on the screen, as seen from the origin, if the screen sets lod_tolerance
         """
         self.color = color
         self.cylinder_radius = cylinder_radius
         self.cylinder_height = cylinder_height
         self.cylinder_location = cylinder_location
+        if n_faces is None:
+            n_faces = self.lod.object_steps(self.cylinder_radius, np.linalg.norm(self.cylinder_location))
         self.n_faces = n_faces
 
         self.stim_object = GlCylinder(cylinder_height=self.cylinder_height,
@@ -1319,40 +1397,48 @@ class HorizonCylinder(TexturedCylinder):
                                         cylinder_radius=self.cylinder_radius,
                                         cylinder_location=(0, 0, 0),
                                         color=self.color,
+                                        n_faces=self.lod.cylinder_faces(),
                                         texture=True).rotz(np.radians(180))
+        self.stim_object = self.stim_template
+
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
         theta = return_for_time_t(self.theta, t)
         cyl_position = fly_position.copy()  # cylinder moves with the fly, so fly is always in the center
-        self.stim_object = copy.copy(self.stim_template).translate(cyl_position).rotz(np.radians(theta)).roty(np.radians(self.cylinder_yaw)).rotx(np.radians(self.cylinder_pitch))
+        # translate, then rotate around z, y and x
+        self.set_model_matrix(util.affine_mat(util.rotx_mat(np.radians(self.cylinder_pitch)))
+                              @ util.affine_mat(util.roty_mat(np.radians(self.cylinder_yaw)))
+                              @ util.affine_mat(util.rotz_mat(np.radians(theta)))
+                              @ util.affine_mat(translation=cyl_position))
 
 
 class Forest(BaseProgram):
     def __init__(self, screen):
-        super().__init__(screen=screen, num_tri=1000)
+        super().__init__(screen=screen)
+        self.use_instancing = True
 
-    def configure(self, color=[1, 1, 1, 1], cylinder_radius=0.5, cylinder_height=0.5, n_faces=16, cylinder_locations=[[+5, 0, 0]]):
+    def configure(self, color=[1, 1, 1, 1], cylinder_radius=0.5, cylinder_height=0.5, n_faces=None, cylinder_locations=[[+5, 0, 0]]):
         """
         Collection of tower objects created with a single shader program.
 
+        A single cylinder mesh is drawn once per tower location with instanced rendering. Unless n_faces is given, the
+        mesh is tessellated for the tower nearest to the origin if the screen sets lod_tolerance.
         """
         self.color = color
         self.cylinder_radius = cylinder_radius
         self.cylinder_height = cylinder_height
         self.cylinder_locations = cylinder_locations
+        if n_faces is None:
+            distance = np.linalg.norm(np.reshape(self.cylinder_locations, (-1, 3)), axis=1).min()
+            n_faces = self.lod.object_steps(self.cylinder_radius, distance)
         self.n_faces = n_faces
 
-        self.stim_object = GlVertices()
-
-        # This step is slow. Make template once then use .translate() on copies to make cylinders
-        cylinder = GlCylinder(cylinder_height=self.cylinder_height,
-                              cylinder_radius=self.cylinder_radius,
-                              cylinder_location=[0, 0, 0],
-                              color=self.color,
-                              n_faces=self.n_faces)
+        self.stim_object = GlCylinder(cylinder_height=self.cylinder_height,
+                                      cylinder_radius=self.cylinder_radius,
+                                      cylinder_location=[0, 0, 0],
+                                      color=self.color,
+                                      n_faces=self.n_faces)
 
-        for tree_loc in self.cylinder_locations:
-            new_cyl = copy.copy(cylinder).translate(tree_loc)
-            self.stim_object.add(new_cyl)
+        self.set_instances(offsets=self.cylinder_locations)
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
         pass
@@ -1419,14 +1505,18 @@ class IndependentDotField(BaseProgram):
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
 
-        self.stim_object = GlVertices()
-        for pt in range(self.n_points):
-            new_theta = return_for_time_t(self.theta_trajectories[pt], t)
-            # Bounce phi back from pi to 0. Shift by pi/2 because of offset in where point is rendered in flystim.shapes
-            new_phi = return_for_time_t(self.phi_trajectories[pt], t) % np.pi - np.pi/2
-            self.stim_object.add(copy.copy(self.stim_object_template).rotate(new_theta,  # yaw
-                                                                             new_phi,  # pitch
-                                                                             0))
+        new_theta = np.array([return_for_time_t(x, t) for x in self.theta_trajectories])
+        # Bounce phi back from pi to 0. Shift by pi/2 because of offset in where point is rendered in flystim.shapes
+        new_phi = np.array([return_for_time_t(x, t) for x in self.phi_trajectories]) % np.pi - np.pi/2
+
+        # rotate copies of the template point straight into the staging array
+        staging = self.stage_vertices(self.n_points)
+        staging['in_color'] = self.stim_object_template.colors[:, 0]
+        util.rotate_each(np.broadcast_to(self.stim_object_template.vertices, (3, self.n_points)),
+                         new_theta,  # yaw
+                         new_phi,  # pitch
+                         0,
+                         out=staging['in_vert'].T)
 
 
 
@@ -1476,19 +1566,26 @@ class MovingDotField(BaseProgram):
 
             vec = self.speed*np.array([np.cos(np.deg2rad(dir)), np.sin(np.deg2rad(dir))])
             self.velocity_vectors.append(vec)
+        self.velocity_vectors = np.reshape(self.velocity_vectors, (self.n_points, 2))
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
         sphere_pitch_rad = np.radians(self.sphere_pitch)
 
-        self.stim_object = GlVertices()
-        for pt in range(self.n_points):
-            d_xy = self.velocity_vectors[pt] * t  # Change in (theta, phi) position, in degrees
-            new_theta = self.starting_theta[pt] + np.radians(d_xy[0])
-            # Bounce phi back from pi to 0. Shift by pi/2 because of offset in where point is rendered in flystim.shapes
-            new_phi = (self.starting_phi[pt] + np.radians(d_xy[1])) % np.pi - np.pi/2
-            self.stim_object.add(copy.copy(self.stim_object_template).rotate(new_theta,  # yaw
-                                                                             new_phi,  # pitch
-                                                                             0).rotate(0, sphere_pitch_rad, 0))
+        d_xy = self.velocity_vectors * t  # Change in (theta, phi) position, in degrees
+        new_theta = self.starting_theta + np.radians(d_xy[:, 0])
+        # Bounce phi back from pi to 0. Shift by pi/2 because of offset in where point is rendered in flystim.shapes
+        new_phi = (self.starting_phi + np.radians(d_xy[:, 1])) % np.pi - np.pi/2
+
+        # rotate copies of the template point straight into the staging array, then pitch the whole sphere
+        staging = self.stage_vertices(self.n_points)
+        staging['in_color'] = self.stim_object_template.colors[:, 0]
+        vertices = staging['in_vert'].T
+        util.rotate_each(np.broadcast_to(self.stim_object_template.vertices, (3, self.n_points)),
+                         new_theta,  # yaw
+                         new_phi,  # pitch
+                         0,
+                         out=vertices)
+        util.rotx(vertices, sphere_pitch_rad, out=vertices)
 
 
 class MovingDotField_Cylindrical(BaseProgram):
@@ -1523,7 +1620,6 @@ class MovingDotField_Cylindrical(BaseProgram):
         self.starting_theta = rng.uniform(0, 360, self.n_points)  # degrees
         self.starting_phi = rng.uniform(self.phi_limits[0], self.phi_limits[1], self.n_points)  # degrees
 
-        self.stim_object_list = []
         self.dir_list = []
         is_signal = rng.choice([False, True], self.n_points, p=[1-self.coherence, self.coherence])
         for pt in range(self.n_points):
@@ -1531,18 +1627,23 @@ class MovingDotField_Cylindrical(BaseProgram):
                 self.dir_list.append(np.radians(self.signal_direction))
             else:
                 self.dir_list.append(np.radians(rng.uniform(0, 360)))
+        self.dir_list = np.array(self.dir_list)
 
-            self.stim_object_list.append(GlCylindricalPoints(cylinder_radius=self.cylinder_radius,
-                                                             color=self.color,
-                                                             theta=[self.starting_theta[pt]],
-                                                             phi=[self.starting_phi[pt]]))
+        self.stim_object_template = GlCylindricalPoints(cylinder_radius=self.cylinder_radius,
+                                                        color=self.color,
+                                                        theta=self.starting_theta,
+                                                        phi=self.starting_phi)
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
         cyl_pitch = np.radians(self.cylinder_pitch)
         dtheta = np.radians(self.speed * t)
-        self.stim_object = GlVertices()
-        for pt in range(self.n_points):
-            self.stim_object.add(self.stim_object_list[pt].rotz(dtheta).roty(self.dir_list[pt]).rotx(cyl_pitch))
+
+        # rotate each point around z, then around y in its own direction, then pitch the whole cylinder
+        staging = self.stage_vertices(self.n_points)
+        staging['in_color'] = self.stim_object_template.colors.T
+        vertices = staging['in_vert'].T
+        util.rotate_each(util.rotz(self.stim_object_template.vertices, dtheta), 0, 0, self.dir_list, out=vertices)
+        util.rotx(vertices, cyl_pitch, out=vertices)
 
 class UniformMovingDotField_Cylindrical(BaseProgram):
     def __init__(self, screen):
@@ -1581,12 +1682,13 @@ class UniformMovingDotField_Cylindrical(BaseProgram):
                                                         color=self.color,
                                                         theta=self.starting_theta,
                                                         phi=self.starting_phi)
-
+        self.stim_object = self.stim_object_template
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
         cyl_pitch = np.radians(self.cylinder_pitch)
         dtheta = np.radians(self.speed * t)
-        self.stim_object = copy.copy(self.stim_object_template).rotz(dtheta).roty(self.direction_rad).rotx(cyl_pitch)
+        # rotate around z, y and x
+        self.set_model_matrix(util.affine_mat(util.rotx_mat(cyl_pitch) @ util.roty_mat(self.direction_rad) @ util.rotz_mat(dtheta)))
 
 class ProgressiveStarfield(BaseProgram):
     def __init__(self, screen):
@@ -1602,17 +1704,17 @@ class ProgressiveStarfield(BaseProgram):
         """
         self.point_size = point_size
         self.color = color
-        self.point_locations = point_locations  # list of (x, y, z) meters for each dot
+        self.point_locations = point_locations  # [x_locations, y_locations, z_locations], meters, one entry per dot
         self.y_offset = make_as_trajectory(y_offset)  # Can pass Y offset as trajectory to specify approach
 
         self.stim_template = GlPointCollection(locations=self.point_locations,
                                                color=self.color)
 
-        self.stim_object = copy.copy(self.stim_template)
+        self.stim_object = self.stim_template
 
     def eval_at(self, t, fly_position=[0, 0, 0], fly_heading=[0, 0]):
         y_position = return_for_time_t(self.y_offset, t)
-        self.stim_object = copy.copy(self.stim_template).translate([0, y_position, 0])
+        self.set_transform(translation=(0, y_position, 0))
 
 
 
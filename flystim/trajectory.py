@@ -1,7 +1,8 @@
 """
 Class + functions for making parameter trajectories for flystim stims.
 
-Generally access this class using make_as_trajectory and return_for_time_t
+Generally access this class using make_as_trajectory and return_for_time_t, or return_for_times to evaluate a
+parameter at many times at once.
 """
 from scipy.interpolate import interp1d
 import numpy as np
@@ -23,6 +24,21 @@ def return_for_time_t(parameter, t):
         return parameter
 
 
+def return_for_times(parameter, times):
+    """
+    Return param values at each of the given times.
+
+    :param parameter: Trajectory object or constant param value
+    :param times: array of times (sec)
+    :returns: array with the shape of times, followed by the shape of a single value. Constant params are broadcast
+    (as a read-only view) to that shape.
+    """
+    if type(parameter) is Trajectory:
+        return parameter.evaluate(times)
+    else:
+        return np.broadcast_to(parameter, np.shape(times) + np.shape(parameter))
+
+
 class Trajectory:
     """Trajectory class."""
 
@@ -30,7 +46,7 @@ class Trajectory:
         """
         Trajectory class. Can be used to specify parameter values as functions of time.
 
-        Based on trajectory name, defines a getValue(t)
+        Based on trajectory name, defines a getValue(t) for single times, see also evaluate for arrays of times
 
         :kwargs: dict of param/value pairs for this trajectory type, see individual ifs below...
             One key should always be 'name':
@@ -99,6 +115,31 @@ class Trajectory:
             """
             self.getValue = lambda t: [0,0,0,0] if t < kwargs['stim_start'] or t >= kwargs['stim_end'] else kwargs['offset'] + kwargs['amplitude'] * np.sin(2*np.pi*kwargs['temporal_frequency']*t)
 
+            def get_windowed_values(t):
+                # the same values getValue returns for each time. With a scalar offset and amplitude, those are
+                # scalars inside the window and [0,0,0,0] outside, which can't be stacked into one array when the
+                # times span both: the result then holds one object per time, like a list of getValue results.
+                offset = np.asarray(kwargs['offset'], dtype=float)
+                amplitude = np.asarray(kwargs['amplitude'], dtype=float)
+                value_shape = np.broadcast(offset, amplitude).shape
+                phase = np.sin(2*np.pi*kwargs['temporal_frequency']*t).reshape(t.shape + (1,) * len(value_shape))
+                values = offset + amplitude * phase
+                outside = (t < kwargs['stim_start']) | (t >= kwargs['stim_end'])
+
+                if not np.any(outside):
+                    return values
+                if np.all(outside):
+                    return np.zeros(t.shape + (4,))
+                if value_shape == (4,):
+                    values[outside] = 0
+                    return values
+
+                result = np.empty(t.shape, dtype=object)
+                for index in np.ndindex(t.shape):
+                    result[index] = [0, 0, 0, 0] if outside[index] else values[index]
+                return result
+            self.getValues = get_windowed_values
+
         elif kwargs['name'] == 'Loom':
             """
             Expanding loom trajectory.
@@ -121,8 +162,7 @@ class Trajectory:
                 angular_size = angular_size - size_adjust
 
                 # Cap the curve at end_size and have it just hang there
-                if (angular_size > kwargs['end_size']):
-                    angular_size = kwargs['end_size']
+                angular_size = np.minimum(angular_size, kwargs['end_size'])
 
                 # divide by  2 to get spot radius
                 return angular_size / 2
@@ -145,14 +185,12 @@ class Trajectory:
                 # note this is spot radius
                 angular_size = np.rad2deg( np.arctan( kwargs['rv_ratio'] / (kwargs['collision_time'] - t) ) )
                 # Cap the curve at end_size and have it just hang there
-                if (angular_size > kwargs['end_radius']):
-                    angular_size = kwargs['end_radius']
+                angular_size = np.minimum(angular_size, kwargs['end_radius'])
 
                 # Freeze it at the max in case there is more stim time to go
-                if t > kwargs['collision_time']:
-                    angular_size = kwargs['end_radius']
+                angular_size = np.where(t > kwargs['collision_time'], kwargs['end_radius'], angular_size)
 
-                return angular_size
+                return angular_size[()]
             self.getValue = get_loom_size
             
         elif kwargs['name'] == 'Loom2':
@@ -168,10 +206,26 @@ class Trajectory:
                 d0 = kwargs['rv_ratio'] / np.tan(np.deg2rad(kwargs['start_size'] / 2))
                 angular_size = 2 * np.rad2deg(np.arctan(kwargs['rv_ratio'] * (1 / (d0 - t))))
                 # Cap the curve at end_size and have it just hang there
-                if angular_size > kwargs['end_size'] or d0 <= t:
-                    angular_size = kwargs['end_size']
-                return angular_size / 2
+                angular_size = np.where((angular_size > kwargs['end_size']) | (d0 <= t), kwargs['end_size'], angular_size)
+                return angular_size[()] / 2
             self.getValue = get_loom_size
 
         else:
             print('Unrecognized trajectory name. See flystim.trajectory')
+
+    def evaluate(self, times):
+        """
+        Evaluate the trajectory at many times at once, with the same values getValue returns for each time.
+
+        :param times: array of times (sec)
+        :returns: array with the shape of times, followed by the shape of a single value. This is the same as
+        np.array([getValue(t) for t in times]), see SinusoidInTimeWindow for the one case where those values don't
+        all have the same shape.
+        """
+        times = np.asarray(times, dtype=float)
+        if hasattr(self, 'getValues'):
+            return self.getValues(times)
+
+        # all other trajectory types are computed with array operations that also accept arrays of times
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.asarray(self.getValue(times))
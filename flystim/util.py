@@ -29,21 +29,38 @@ def listify(x, type_):
 def normalize(vec):
     return vec / np.linalg.norm(vec)
 
-def rot1_scale_rot2(pts, yaw1, pitch1, roll1, scale_x, scale_y, scale_z, yaw2, pitch2, roll2):
+# The transform helpers below take (3, n_points) arrays. They accept an optional out array to write the result
+# into, e.g. a view of a preallocated vertex buffer, which avoids allocating a new array on every frame.
+
+def rot1_scale_rot2(pts, yaw1, pitch1, roll1, scale_x, scale_y, scale_z, yaw2, pitch2, roll2, out=None):
     A = rot_mat(yaw2, pitch2, roll2) @ np.diag([scale_x, scale_y, scale_z]) @ rot_mat(yaw1, pitch1, roll1)
-    return A @ pts
+    return np.matmul(A, pts, out=out)
 
 # rotation matrix reference:
 # https://en.wikipedia.org/wiki/Rotation_matrix
 
-def rotate(pts, yaw, pitch, roll):
+def rotate(pts, yaw, pitch, roll, out=None):
     """
     :param yaw: rotation around z axis, radians
     :param pitch: rotation around x axis, radians
     :param roll: rotation around y axis, radians
     """
     R = rot_mat(yaw, pitch, roll)
-    return R @ pts
+    return np.matmul(R, pts, out=out)
+
+def rotate_each(pts, yaw, pitch, roll, out=None):
+    """
+    Rotate each point by its own angles, like rotate(pts[:, i], yaw[i], pitch[i], roll[i]) for every i.
+
+    :param pts: (3, n_points) array
+    :param yaw: rotation around z axis, radians. Scalar or (n_points,) array.
+    :param pitch: rotation around x axis, radians. Scalar or (n_points,) array.
+    :param roll: rotation around y axis, radians. Scalar or (n_points,) array.
+    :param out: optional (3, n_points) array for the result, which must not overlap pts
+    """
+    yaw, pitch, roll = np.broadcast_arrays(yaw, pitch, roll, np.empty(np.shape(pts)[1]))[:3]
+    R = rotz_mats(yaw) @ rotx_mats(pitch) @ roty_mats(roll)
+    return np.einsum('nij,jn->in', R, pts, out=out, casting='same_kind')
 
 def rot_mat(yaw, pitch, roll):
     """
@@ -53,32 +70,90 @@ def rot_mat(yaw, pitch, roll):
     """
     return rotz_mat(yaw) @ rotx_mat(pitch) @ roty_mat(roll)
 
-def rotx(pts, th):
-    return rotx_mat(th).dot(pts)
+def rotx(pts, th, out=None):
+    return np.matmul(rotx_mat(th), pts, out=out)
 
 def rotx_mat(th):
     return np.array([[1,       0,         0],
                      [0, +cos(th), -sin(th)],
                      [0, +sin(th), +cos(th)]], dtype=float)
 
-def roty(pts, th):
-    return roty_mat(th).dot(pts)
+def roty(pts, th, out=None):
+    return np.matmul(roty_mat(th), pts, out=out)
 
 def roty_mat(th):
     return np.array([[+cos(th), 0, +sin(th)],
                      [0,        1,        0],
                      [-sin(th), 0, +cos(th)]], dtype=float)
 
-def rotz(pts, th):
-    return rotz_mat(th).dot(pts)
+def rotz(pts, th, out=None):
+    return np.matmul(rotz_mat(th), pts, out=out)
 
 def rotz_mat(th):
     return np.array([[+cos(th), -sin(th), 0],
                      [+sin(th), +cos(th), 0],
                      [       0,        0, 1]], dtype=float)
 
-def scale(pts, amt):
-    return np.multiply(amt, pts)
+# stacks of rotation matrices, (n, 3, 3) for an (n,) array of angles
+
+def rotx_mats(th):
+    c, s = np.cos(th), np.sin(th)
+    R = np.zeros(np.shape(th) + (3, 3))
+    R[..., 0, 0] = 1
+    R[..., 1, 1] = c
+    R[..., 1, 2] = -s
+    R[..., 2, 1] = s
+    R[..., 2, 2] = c
+    return R
+
+def roty_mats(th):
+    c, s = np.cos(th), np.sin(th)
+    R = np.zeros(np.shape(th) + (3, 3))
+    R[..., 0, 0] = c
+    R[..., 0, 2] = s
+    R[..., 1, 1] = 1
+    R[..., 2, 0] = -s
+    R[..., 2, 2] = c
+    return R
+
+def rotz_mats(th):
+    c, s = np.cos(th), np.sin(th)
+    R = np.zeros(np.shape(th) + (3, 3))
+    R[..., 0, 0] = c
+    R[..., 0, 1] = -s
+    R[..., 1, 0] = s
+    R[..., 1, 1] = c
+    R[..., 2, 2] = 1
+    return R
+
+def scale(pts, amt, out=None):
+    return np.multiply(amt, pts, out=out)
+
+# 4x4 homogeneous matrices, e.g. for the model matrix uniform in flystim.base.BaseProgram
+
+def affine_mat(mat=None, translation=(0, 0, 0)):
+    """
+    :param mat: 3x3 linear part (rotation, scale), identity if None
+    :param translation: (x, y, z) translation, applied after mat
+    """
+    A = np.eye(4)
+    if mat is not None:
+        A[:3, :3] = mat
+    A[:3, 3] = np.ravel(translation)
+    return A
+
+def model_mat(scale=1, yaw=0, pitch=0, roll=0, translation=(0, 0, 0)):
+    """
+    4x4 matrix equivalent to .scale(scale).rotate(yaw, pitch, roll).translate(translation) on a GlVertices object
+
+    :param scale: scalar or (x, y, z) scale factors
+    :param yaw: rotation around z axis, radians
+    :param pitch: rotation around x axis, radians
+    :param roll: rotation around y axis, radians
+    :param translation: (x, y, z) translation
+    """
+    S = np.diag(np.broadcast_to(np.ravel(scale), 3))
+    return affine_mat(rot_mat(yaw, pitch, roll) @ S, translation)
 
 def spherical_to_cartesian(r, theta, phi):
     x = r * np.sin(phi) * np.cos(theta)
@@ -119,16 +194,16 @@ def cartesian_to_cylindrical_w_phi(x, y, z):
     phi = np.arctan2(z, r)
     return r, theta, phi
 
-def translate(pts, amt):
+def translate(pts, amt, out=None):
     # convert point(s) and translate amount to numpy arrays
-    pts = np.array(pts, dtype=float)
+    pts = np.asarray(pts, dtype=float) if out is None else pts
     amt = np.array(amt, dtype=float)
 
     # add offset in a manner that depends on whether the input is 1D or 2D
-    if len(pts.shape) == 1:
-        return pts + amt
-    elif len(pts.shape) == 2:
-        return pts + amt[:, np.newaxis]
+    if len(np.shape(pts)) == 1:
+        return np.add(pts, amt, out=out)
+    elif len(np.shape(pts)) == 2:
+        return np.add(pts, amt[:, np.newaxis], out=out)
 
 def get_rgba(val, def_alpha=1):
     # interpret string as RGB
@@ -19,9 +19,11 @@ setup(
         'pandas',
         'json-rpc',
         'matplotlib',
-        'qimage2ndarray',
         'scikit-image',
     ],
+    extras_require={
+        'fence': ['PyOpenGL'],  # fence-based frame pacing, see flystim.pacing
+    },
     entry_points={
         'console_scripts': [
             'lcr_ctl=examples.lcr_ctl:main'
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Render every stimulus in flystim.stimuli on a headless display and report frames/second and per-phase costs.
+
+    python tests/benchmark_stimuli.py [--frames 300] [--size 512] [--csv results.csv]
+
+With --save-golden, the reference images used by test_stimuli.py are regenerated instead. Only do this after checking
+that a change in the rendered images is intended.
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import HeadlessDisplay, render_stimulus, get_stimulus_names, KNOWN_BROKEN  # noqa: E402
+from flystim.profiling import FrameProfiler  # noqa: E402
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'stimuli_golden.npz')
+
+
+def benchmark(names, n_frames=300, size=512, duration=2.0):
+    """
+    :param names: stimulus class names
+    :param n_frames: number of frames rendered per stimulus
+    :param size: width and height of the display, pixels
+    :param duration: stimulus time covered by the frames (sec)
+    :returns: DataFrame with fps and mean per-phase durations (ms) for each stimulus
+    """
+    display = HeadlessDisplay(width=size, height=size)
+    times = np.linspace(0, duration, n_frames)
+
+    rows = {}
+    for name in names:
+        if name in KNOWN_BROKEN:
+            continue
+        profiler = FrameProfiler(buffer_size=n_frames)
+        render_stimulus(display, name, times=times, profiler=profiler)
+
+        summary = profiler.summary()
+        row = {'fps': 1e3 / summary['frame']['mean']}
+        for phase, stats in summary.items():
+            # phases are recorded as '<stimulus>.<phase>'
+            row[phase.split('.')[-1] + '_ms'] = stats['mean']
+        rows[name] = row
+
+    return pd.DataFrame(rows).T
+
+
+def save_golden(names):
+    display = HeadlessDisplay(width=128, height=128)
+    images = {name: render_stimulus(display, name) for name in names if name not in KNOWN_BROKEN}
+    np.savez_compressed(GOLDEN_PATH, **images)
+    print('Saved golden images for {} stimuli to {}'.format(len(images), GOLDEN_PATH))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark flystim stimuli on a headless display.')
+    parser.add_argument('names', nargs='*', help='stimulus classes to run, default: all')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--csv', default=None, help='also save results to this file')
+    parser.add_argument('--save-golden', action='store_true', help='regenerate the golden images for test_stimuli.py')
+    args = parser.parse_args()
+
+    names = args.names or get_stimulus_names()
+    if args.save_golden:
+        save_golden(names)
+        return
+
+    results = benchmark(names, n_frames=args.frames, size=args.size)
+    print(results.to_string(float_format='{:.3f}'.format))
+    if args.csv is not None:
+        results.to_csv(args.csv)
+
+
+if __name__ == '__main__':
+    main()
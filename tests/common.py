@@ -1,13 +1,26 @@
+import inspect
+import time
 import moderngl
 import numpy as np
 from PIL import Image
 from PyQt5 import QtOpenGL, QtWidgets
 
+from flystim import stimuli
+from flystim.base import BaseProgram
+from flystim.perspective import GenPerspective
+from flystim.screen import Screen, SubScreen
+
 
 class HeadlessDisplay:
-    def __init__(self, width=512, height=512):
-        # Create an OpenGL context
-        self.ctx = moderngl.create_context(standalone=True, size=(width, height))
+    def __init__(self, width=512, height=512, backend=None):
+        # Create an OpenGL context, falling back to EGL on machines without an X server
+        if backend is None:
+            try:
+                self.ctx = moderngl.create_context(standalone=True, size=(width, height))
+            except Exception:
+                self.ctx = moderngl.create_context(standalone=True, size=(width, height), backend='egl')
+        else:
+            self.ctx = moderngl.create_context(standalone=True, size=(width, height), backend=backend)
         self.ctx.enable(moderngl.DEPTH_TEST)
         self.ctx.enable(moderngl.BLEND)
 
@@ -112,3 +125,92 @@ def get_img_err(img1, img2):
     diff = np.array(img1) - np.array(img2)
     error = np.linalg.norm(diff.flatten())
     return error
+
+
+# Representative parameters for rendering each stimulus in flystim.stimuli. Stimuli not listed use their defaults.
+STIMULUS_PARAMS = {
+    'Forest': dict(cylinder_locations=[[1, 2, 0], [-1, 3, 0], [0.5, 1, 0.1]]),
+    'Tower': dict(cylinder_location=[0.2, 1, 0]),
+    'ProgressiveStarfield': dict(point_locations=[[0.1, 0.2], [1, 1], [0, 0.1]],
+                                 y_offset={'name': 'Sinusoid', 'offset': 0, 'amplitude': 0.5, 'temporal_frequency': 1}),
+    'MovingPatch': dict(theta={'name': 'Sinusoid', 'offset': 0, 'amplitude': 30, 'temporal_frequency': 1}),
+    'MovingBox': dict(y=2, yaw=30, x={'name': 'Sinusoid', 'offset': 0, 'amplitude': 0.5, 'temporal_frequency': 1}),
+    'LoomingCircle': dict(starting_distance=2, speed=-0.5),
+}
+
+# Stimulus times (sec) at which images are compared
+SAMPLE_TIMES = [0.0, 0.25, 0.5]
+
+# Stimuli that fail to render in this tree, with the reason
+KNOWN_BROKEN = {
+    'MovingEllipsoid': 'GlIcosphere is not defined',
+    'MovingFly': 'GlFly is not defined',
+    'TexturedCylinder': 'no stim_object is created',
+}
+
+
+def get_stimulus_names():
+    """
+    Names of all stimulus classes defined in flystim.stimuli
+    """
+    return sorted(name for name, cls in inspect.getmembers(stimuli, inspect.isclass)
+                  if issubclass(cls, BaseProgram) and cls is not BaseProgram and cls.__module__ == stimuli.__name__)
+
+
+def get_test_screen(single_pass_subscreens=False):
+    """
+    Screen with two subscreens side by side, the left one seen from an offset and rotated fly
+
+    :param single_pass_subscreens: draw both subscreens with one draw call, see Screen
+    """
+    return Screen(single_pass_subscreens=single_pass_subscreens,
+                  subscreens=[SubScreen(viewport_ll=(-1, -1), viewport_width=1, viewport_height=2),
+                              SubScreen(pa=(0.3, 0.15, -0.15), pb=(0.3, -0.15, -0.15), pc=(0.3, 0.15, 0.15),
+                                        viewport_ll=(0, -1), viewport_width=1, viewport_height=2)])
+
+
+def get_test_perspectives(screen):
+    fly_pos = [(0.1, 0, 0), (0, 0, 0)]
+    theta = [0.3, 0]
+    return [GenPerspective(pa=sub.pa, pb=sub.pb, pc=sub.pc, fly_pos=pos).rotz(th).matrix
+            for sub, pos, th in zip(screen.subscreens, fly_pos, theta)]
+
+
+def render_stimulus(display, name, times=SAMPLE_TIMES, profiler=None, single_pass_subscreens=False):
+    """
+    Render a stimulus from flystim.stimuli on a HeadlessDisplay
+
+    :param display: HeadlessDisplay
+    :param name: name of the stimulus class
+    :param times: stimulus times (sec)
+    :param profiler: optional flystim.profiling.FrameProfiler, also records a 'frame' phase for each time
+    :param single_pass_subscreens: draw both subscreens of the test screen with one draw call
+    :returns: (n_times, height, width, 3) uint8 array, first row at the top
+    """
+    screen = get_test_screen(single_pass_subscreens=single_pass_subscreens)
+    width, height = display.fbo.size
+    viewports = [sub.get_viewport(width, height) for sub in screen.subscreens]
+    perspectives = get_test_perspectives(screen)
+
+    stim = getattr(stimuli, name)(screen=screen)
+    if profiler is not None:
+        stim.set_profiler(profiler)
+    stim.initialize(display.ctx)
+    stim.lod.set_viewports(viewports)
+    # some stimuli draw from the global numpy random state in configure
+    np.random.seed(0)
+    stim.configure(**STIMULUS_PARAMS.get(name, {}))
+
+    images = np.empty((len(times), height, width, 3), dtype='uint8')
+    for t_ind, t in enumerate(times):
+        t_frame = time.perf_counter()
+        display.ctx.viewport = (0, 0, width, height)
+        display.fbo.clear(0.0, 0.0, 0.0, 1.0)
+        stim.paint_at(t, viewports, perspectives, fly_position=np.array([0.0, 0.0, 0.0]), fly_heading=[0, 0])
+        display.ctx.finish()
+        if profiler is not None:
+            profiler.record('frame', t_frame)
+        images[t_ind] = np.frombuffer(display.fbo.read(components=3), dtype='uint8').reshape(height, width, 3)[::-1]
+
+    stim.release()
+    return images
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from skimage.transform import downscale_local_mean
+
+from common import HeadlessDisplay
+from flystim.capture import FrameCapture
+
+# odd size that isn't a multiple of the downsampling factors
+WIDTH, HEIGHT = 130, 97
+
+
+@pytest.fixture(scope='module')
+def display():
+    try:
+        return HeadlessDisplay(width=WIDTH, height=HEIGHT)
+    except Exception as e:
+        pytest.skip('No OpenGL context available: {}'.format(e))
+
+
+def make_frames(ctx, n_frames, seed=0):
+    """
+    :returns: list of (framebuffer, (HEIGHT, WIDTH) blue channel with the first row at the top)
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(n_frames):
+        # GL rows start at the bottom of the image
+        data = rng.integers(0, 256, size=(HEIGHT, WIDTH, 4), dtype='uint8')
+        texture = ctx.texture((WIDTH, HEIGHT), components=4, data=data.tobytes())
+        frames.append((ctx.framebuffer(color_attachments=[texture]), data[::-1, :, 2]))
+    return frames
+
+
+@pytest.mark.parametrize('downsample_xy', [1, 3, 4])
+def test_capture_matches_downscale_local_mean(display, downsample_xy):
+    frames = make_frames(display.ctx, n_frames=5)
+    capture = FrameCapture(display.ctx, n_buffers=3, channel=2, downsample_xy=downsample_xy)
+
+    captured = []
+    for f_ind, (fbo, _) in enumerate(frames):
+        captured += capture.capture(fbo, WIDTH, HEIGHT)
+        # frames come back n_buffers - 1 captures later
+        assert len(captured) == max(f_ind - 1, 0)
+    captured += capture.flush()
+    capture.release()
+
+    assert len(captured) == len(frames)
+    for image, (_, full) in zip(captured, frames):
+        expected = downscale_local_mean(full, (downsample_xy, downsample_xy)).astype('uint8')
+        assert image.shape == expected.shape
+        assert np.array_equal(image, expected)
+
+
+def test_set_downsample_xy_returns_pending_frames(display):
+    frames = make_frames(display.ctx, n_frames=2, seed=1)
+    capture = FrameCapture(display.ctx, n_buffers=3, channel=2)
+
+    assert capture.capture(frames[0][0], WIDTH, HEIGHT) == []
+    pending = capture.set_downsample_xy(4)
+    assert len(pending) == 1 and np.array_equal(pending[0], frames[0][1])
+
+    captured = capture.capture(frames[1][0], WIDTH, HEIGHT) + capture.flush()
+    capture.release()
+    assert np.array_equal(captured[0], downscale_local_mean(frames[1][1], (4, 4)).astype('uint8'))
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+
+from common import HeadlessDisplay
+from flystim.headless import OffscreenRenderer, render_movie_parallel
+from flystim.screen import Screen
+
+
+@pytest.fixture
+def renderer():
+    try:
+        HeadlessDisplay(width=8, height=8).ctx.release()
+    except Exception as e:
+        pytest.skip('No OpenGL context available: {}'.format(e))
+
+    # no backend argument: the default context is tried first, then EGL
+    renderer = OffscreenRenderer(Screen(), width=64, height=48)
+    yield renderer
+    renderer.release()
+
+
+def test_default_backend(renderer):
+    renderer.load_stim('ConstantBackground', color=[0, 0, 1, 1])
+    frame = renderer.render_frame(0)
+    assert frame.shape == (48, 64, 3)
+    assert np.all(frame[:, :, 2] == 255)
+
+
+def test_render_movie_parallel_matches_single_process(renderer, tmp_path):
+    screen = renderer.screen
+    stims = [{'name': 'ConstantBackground', 'color': [0.2, 0.2, 0.2, 1]},
+             {'name': 'MovingPatch', 'width': 20, 'height': 20,
+              'theta': {'name': 'Sinusoid', 'offset': 0, 'amplitude': 30, 'temporal_frequency': 1}}]
+    timepoints = np.linspace(0, 1, 11)
+
+    for stim in stims:
+        kwargs = stim.copy()
+        renderer.load_stim(kwargs.pop('name'), hold=True, **kwargs)
+    single_path = str(tmp_path / 'single.npy')
+    renderer.render_movie(single_path, timepoints, downsample_xy=2)
+
+    parallel_path = str(tmp_path / 'parallel.npy')
+    shape = render_movie_parallel(parallel_path, screen, stims, timepoints, n_workers=3, width=64, height=48,
+                                  downsample_xy=2)
+
+    # 11 frames in chunks of 4, 4 and 3, reassembled in order
+    expected = np.load(single_path)
+    assert shape == expected.shape == (24, 32, 11)
+    assert np.array_equal(np.load(parallel_path), expected)
+
+    # the chunk directory is removed
+    assert sorted(os.listdir(tmp_path)) == ['parallel.npy', 'single.npy']
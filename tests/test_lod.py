@@ -0,0 +1,60 @@
+import numpy as np
+
+from flystim import stimuli
+from flystim.lod import LevelOfDetail, subscreen_pixels_per_radian
+from flystim.screen import Screen, SubScreen
+
+
+def test_pixels_per_radian_facing_screen():
+    # flat screen 1 m in front of the fly, 1000 px/m: about 1000 px/radian at the center, more at the corners
+    sub = SubScreen(pa=(-0.1, 1, -0.1), pb=(0.1, 1, -0.1), pc=(-0.1, 1, 0.1))
+    density = subscreen_pixels_per_radian(sub, 200, 200)
+    assert np.isclose(density, 1000 * 1.02)
+
+
+def test_error_stays_below_tolerance():
+    lod = LevelOfDetail(Screen(), tolerance=0.5)
+    lod.set_viewports([(0, 0, 800, 800)])
+
+    radius = np.radians(10)
+    n_steps = lod.circle_steps(10)
+    error = radius * (2*np.pi / n_steps)**2 / 8
+    assert error * lod.pixels_per_radian <= 0.5
+    # one step fewer would exceed the tolerance
+    assert radius * (2*np.pi / (n_steps - 1))**2 / 8 * lod.pixels_per_radian > 0.5
+
+
+def test_steps_follow_viewport_size():
+    lod = LevelOfDetail(Screen(lod_tolerance=0.5))
+    lod.set_viewports([(0, 0, 128, 128)])
+    small = lod.cylinder_faces()
+    lod.set_viewports([(0, 0, 2048, 2048)])
+    large = lod.cylinder_faces()
+    assert small < large <= lod.max_steps
+
+    # bigger objects and smaller distances need more steps
+    assert lod.circle_steps(5) < lod.circle_steps(20)
+    assert lod.object_steps(0.5, 10) < lod.object_steps(0.5, 2)
+    assert lod.grid_steps(1, 1) == (1, 1)
+
+
+def test_fixed_defaults_without_tolerance():
+    lod = LevelOfDetail(Screen())
+    assert not lod.enabled
+    assert lod.circle_steps(10) == 36
+    assert lod.grid_steps(30, 30) == (6, 6)
+    assert lod.grid_steps(30, 30, default=(12, 12)) == (12, 12)
+    assert lod.cylinder_faces() == 32
+    assert lod.object_steps(0.5, 5) == 16
+
+
+def test_stimulus_uses_screen_tolerance():
+    # configure doesn't need a GL context for Tower
+    tower = stimuli.Tower(screen=Screen())
+    tower.configure(cylinder_location=[0, 1, 0])
+    assert tower.n_faces == 16
+
+    tower = stimuli.Tower(screen=Screen(lod_tolerance=0.5))
+    tower.lod.set_viewports([(0, 0, 128, 128)])
+    tower.configure(cylinder_location=[0, 1, 0])
+    assert tower.n_faces == tower.lod.object_steps(0.5, 1) != 16
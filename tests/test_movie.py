@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+import pytest
+from skimage.transform import downscale_local_mean
+
+from flystim.movie import MovieWriter
+
+
+@pytest.mark.parametrize('downsample_xy', [1, 4])
+def test_movie_matches_downsampled_stack(tmp_path, downsample_xy):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, size=(10, 37, 50), dtype='uint8')
+    file_path = str(tmp_path / 'movie.npy')
+
+    # small queue and blocks, so write() blocks and the array is assembled in several blocks
+    writer = MovieWriter(file_path, downsample_xy=downsample_xy, max_queued_frames=2, block_size=3)
+    for frame in frames:
+        writer.write(frame)
+    shape = writer.close()
+
+    # layout of StimDisplay.save_rendered_movie: (height, width, n_frames)
+    stack = np.transpose(frames, (1, 2, 0))
+    expected = downscale_local_mean(stack, (downsample_xy, downsample_xy, 1)).astype('uint8')
+    assert shape == expected.shape
+    assert np.array_equal(np.load(file_path), expected)
+
+    assert os.listdir(tmp_path) == ['movie.npy']
+
+
+def test_empty_movie(tmp_path):
+    file_path = str(tmp_path / 'movie.npy')
+    assert MovieWriter(file_path).close() == (0, 0, 0)
+    assert np.load(file_path).shape == (0, 0, 0)
+    assert os.listdir(tmp_path) == ['movie.npy']
+
+
+def test_frame_shape_change_raises(tmp_path):
+    file_path = str(tmp_path / 'movie.npy')
+    writer = MovieWriter(file_path)
+    writer.write(np.zeros((4, 4), dtype='uint8'))
+    writer.write(np.zeros((5, 4), dtype='uint8'))
+    with pytest.raises(ValueError):
+        writer.close()
+    assert not os.path.exists(writer.raw_path)
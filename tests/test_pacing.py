@@ -0,0 +1,91 @@
+import pytest
+
+from common import HeadlessDisplay
+from flystim import pacing
+from flystim.pacing import FencePacer, FinishPacer, make_pacer
+from flystim.profiling import FrameProfiler
+
+
+@pytest.fixture(scope='module')
+def display():
+    try:
+        return HeadlessDisplay(width=16, height=16)
+    except Exception as e:
+        pytest.skip('No OpenGL context available: {}'.format(e))
+
+
+class RecordingGL:
+    """
+    Stand-in for the PyOpenGL functions FencePacer uses, recording which fences are alive
+    """
+
+    GL_SYNC_GPU_COMMANDS_COMPLETE = 0x9117
+    GL_SYNC_FLUSH_COMMANDS_BIT = 0x1
+
+    def __init__(self):
+        self.next_fence = 0
+        self.alive = set()
+        self.waited = []
+
+    def glFenceSync(self, condition, flags):
+        self.next_fence += 1
+        self.alive.add(self.next_fence)
+        return self.next_fence
+
+    def glClientWaitSync(self, fence, flags, timeout):
+        self.waited.append(fence)
+
+    def glDeleteSync(self, fence):
+        self.alive.remove(fence)
+
+
+def test_finish_pacer_records_latency(display):
+    profiler = FrameProfiler()
+    pacer = FinishPacer(display.ctx, profiler=profiler)
+    for _ in range(5):
+        display.fbo.clear(1.0, 0.0, 0.0, 1.0)
+        pacer.end_frame()
+    pacer.release()
+    assert pacer.frames_in_flight == 0
+    assert profiler.summary()['gpu_latency']['count'] == 5
+
+
+@pytest.mark.parametrize('frames_in_flight', [0, 1, 3])
+def test_fence_pacer_bounds_queued_fences(display, monkeypatch, frames_in_flight):
+    gl = RecordingGL()
+    monkeypatch.setattr(pacing, 'GL', gl)
+
+    profiler = FrameProfiler()
+    pacer = FencePacer(display.ctx, frames_in_flight=frames_in_flight, profiler=profiler)
+    for frame in range(10):
+        display.fbo.clear(1.0, 0.0, 0.0, 1.0)
+        pacer.end_frame()
+        assert len(pacer.fences) == min(frame + 1, frames_in_flight)
+        assert len(gl.alive) == len(pacer.fences)
+
+    # fences are waited on oldest first
+    assert gl.waited == list(range(1, 11 - frames_in_flight))
+    assert profiler.summary()['gpu_latency']['count'] == 10 - frames_in_flight
+
+    pacer.release()
+    assert not gl.alive
+
+
+def test_fence_pacer_with_pyopengl(display):
+    pytest.importorskip('OpenGL')
+    pacer = FencePacer(display.ctx, frames_in_flight=2)
+    for _ in range(5):
+        display.fbo.clear(1.0, 0.0, 0.0, 1.0)
+        pacer.end_frame()
+        assert len(pacer.fences) <= 2
+    pacer.release()
+
+
+def test_make_pacer_falls_back_without_pyopengl(display, monkeypatch):
+    monkeypatch.setattr(pacing, 'GL', None)
+    with pytest.warns(UserWarning, match='PyOpenGL'):
+        pacer = make_pacer(display.ctx, mode='fence')
+    assert isinstance(pacer, FinishPacer)
+
+    with pytest.raises(ValueError):
+        make_pacer(display.ctx, mode='vsync')
@@ -0,0 +1,42 @@
+import numpy as np
+
+from flystim.perspective import GenPerspective, PerspectiveCache
+
+PA = (-0.15, 0.30, -0.10)
+PB = (+0.20, 0.35, -0.15)
+PC = (-0.15, 0.30, +0.15)
+
+
+def gen_perspective(fly_pos, theta, phi, roll, horizontal_flip):
+    perspective = GenPerspective(pa=PA, pb=PB, pc=PC, fly_pos=fly_pos, horizontal_flip=horizontal_flip)
+    return np.frombuffer(perspective.rotz(theta).rotx(phi).roty(roll).matrix, dtype='f4')
+
+
+def test_cache_matches_gen_perspective():
+    for horizontal_flip in [False, True]:
+        cache = PerspectiveCache(pa=PA, pb=PB, pc=PC, horizontal_flip=horizontal_flip)
+        for fly_pos, theta, phi, roll in [((0, 0, 0), 0, 0, 0),
+                                          ((0.1, -0.2, 0.05), 0.7, 0.3, 0),
+                                          ((1, 2, 3), -2.0, -0.6, 0.4)]:
+            expected = gen_perspective(fly_pos, theta, phi, roll, horizontal_flip)
+            actual = np.frombuffer(cache.get(fly_pos, theta, phi, roll), dtype='f4')
+            np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-5*np.abs(expected).max())
+
+
+def test_cache_reuses_bytes_for_same_pose():
+    cache = PerspectiveCache(pa=PA, pb=PB, pc=PC)
+    first = cache.get(np.array([0.1, 0.2, 0]), 0.5, 0.1)
+    assert cache.get(np.array([0.1, 0.2, 0]), 0.5, 0.1) is first
+    assert cache.get(np.array([0.1, 0.2, 0]), 0.6, 0.1) is not first
+
+
+def test_batch_matches_single_poses():
+    cache = PerspectiveCache(pa=PA, pb=PB, pc=PC)
+    fly_pos = np.random.default_rng(0).uniform(-1, 1, size=(20, 3))
+    theta = np.linspace(-np.pi, np.pi, 20)
+
+    matrices = cache.matrices(fly_pos, theta, 0.2)
+    assert matrices.shape == (20, 4, 4)
+    for pos, th, matrix in zip(fly_pos, theta, matrices):
+        np.testing.assert_allclose(matrix.astype('f4').flatten(order='F'),
+                                   np.frombuffer(cache.get(pos, th, 0.2), dtype='f4'))
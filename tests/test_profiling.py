@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+from flystim.profiling import RingBuffer, FrameProfiler, FrameDropDetector
+from flystim.screen import Screen
+
+REFRESH_PERIOD = 1 / 120
+
+
+def test_ring_buffer_wraparound():
+    buffer = RingBuffer(4)
+    assert len(buffer.values) == 0
+
+    for value in range(3):
+        buffer.append(value)
+    assert np.array_equal(buffer.values, [0, 1, 2])
+
+    # oldest values are overwritten, values stay in order
+    for value in range(3, 10):
+        buffer.append(value)
+    assert buffer.count == 4
+    assert np.array_equal(buffer.values, [6, 7, 8, 9])
+
+    buffer.clear()
+    assert len(buffer.values) == 0
+    buffer.append(10)
+    assert np.array_equal(buffer.values, [10])
+
+
+def test_profiler_summary_and_histogram(tmp_path):
+    profiler = FrameProfiler(buffer_size=5)
+    # t_start in the past by a known duration
+    for duration in [0.001, 0.002, 0.003, 0.004, 0.005, 0.006]:
+        t_phase = profiler.record('draw', -duration)
+    assert profiler.record('eval_at', t_phase) >= t_phase
+
+    durations = 1e3 * profiler.buffers['draw'].values
+    summary = profiler.summary(percentiles=(50,))
+    assert set(summary) == {'draw', 'eval_at'}
+    assert summary['draw']['count'] == 5  # only the last buffer_size durations are kept
+    assert summary['draw']['mean'] == pytest.approx(np.mean(durations))
+    assert summary['draw']['min'] == pytest.approx(np.min(durations))
+    assert summary['draw']['max'] == pytest.approx(np.max(durations))
+    assert summary['draw']['p50'] == pytest.approx(np.median(durations))
+
+    histogram = profiler.histogram('draw', bins=4)
+    assert sum(histogram['counts']) == 5
+    assert len(histogram['bin_edges']) == 5
+    assert histogram['bin_edges'][0] == pytest.approx(np.min(durations))
+
+    file_path = str(tmp_path / 'profile.npz')
+    profiler.dump(file_path)
+    assert np.allclose(np.load(file_path)['draw'], profiler.buffers['draw'].values)
+
+    profiler.reset()
+    assert profiler.summary() == {}
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = FrameProfiler(enabled=False)
+    profiler.record('draw', 0)
+    assert profiler.summary() == {}
+
+
+def make_timestamps(missed_vsyncs, jitter=0.0002, seed=0):
+    """
+    :param missed_vsyncs: dict of frame index: number of vsyncs missed before that frame
+    :returns: frame times (sec) one refresh period apart, except where vsyncs were missed
+    """
+    rng = np.random.default_rng(seed)
+    periods = np.ones(100)
+    for frame, missed in missed_vsyncs.items():
+        periods[frame] += missed
+    return 10 + np.cumsum(periods * REFRESH_PERIOD) + rng.uniform(-jitter, jitter, size=len(periods))
+
+
+@pytest.mark.parametrize('refresh_period', [REFRESH_PERIOD, None])
+def test_frame_drop_detector(refresh_period):
+    timestamps = make_timestamps({20: 1, 50: 3})
+    detector = FrameDropDetector()
+    detector.start_epoch(refresh_period=refresh_period)
+    for t in timestamps:
+        detector.frame(t)
+
+    report = detector.report()
+    assert report['n_frames'] == 100
+    # without a measured refresh period, the median interval is used
+    assert report['refresh_period'] == pytest.approx(REFRESH_PERIOD, rel=0.05)
+    assert report['n_drop_events'] == 2
+    assert report['n_dropped'] == 4
+    assert report['missed_vsyncs'] == [1, 3]
+    assert np.allclose(report['drop_times'], timestamps[[20, 50]] - timestamps[0])
+    assert report['max_interval'] == pytest.approx(4 * REFRESH_PERIOD, abs=0.001)
+
+    # a new epoch starts from scratch
+    detector.start_epoch()
+    assert detector.report()['n_frames'] == 0
+    assert detector.report()['n_dropped'] == 0
+
+
+def test_stop_stim_returns_frame_drop_report():
+    pytest.importorskip('flyrpc')
+    from common import HeadlessDisplay
+    from flystim.framework import StimDisplay
+
+    try:
+        display = HeadlessDisplay(width=16, height=16)
+    except Exception as e:
+        pytest.skip('No OpenGL context available: {}'.format(e))
+
+    # only the state stop_stim uses, without a window or RPC server
+    stim_display = StimDisplay.__new__(StimDisplay)
+    stim_display.ctx = display.ctx
+    stim_display.screen = Screen()
+    stim_display.stim_list = []
+    stim_display.append_stim_frames = False
+    stim_display.movie_writer = None
+    stim_display.profile_frame_times = []
+    stim_display.frame_drop_detector = FrameDropDetector(refresh_period=REFRESH_PERIOD)
+    stim_display.frame_drop_report = None
+    stim_display.stim_started = True
+
+    timestamps = make_timestamps({30: 2})
+    for t in timestamps:
+        stim_display.frame_drop_detector.frame(t)
+
+    report = stim_display.stop_stim()
+    assert report['n_frames'] == 100
+    assert report['n_dropped'] == 2
+    assert report['drop_times'] == pytest.approx([timestamps[30] - timestamps[0]])
+
+    # the report stays available after the epoch
+    assert stim_display.get_frame_drop_report() is report
@@ -0,0 +1,49 @@
+import pytest
+
+from common import HeadlessDisplay, get_test_screen
+from flystim import stimuli
+from flystim.base import get_program_cache
+from flystim.headless import OffscreenRenderer
+
+
+@pytest.fixture
+def display():
+    try:
+        return HeadlessDisplay(width=32, height=32)
+    except Exception as e:
+        pytest.skip('No OpenGL context available: {}'.format(e))
+
+
+def test_stimuli_share_programs(display):
+    cache = get_program_cache(display.ctx)
+    stims = [stimuli.MovingPatch(screen=get_test_screen()) for _ in range(2)]
+    for stim in stims:
+        stim.initialize(display.ctx)
+
+    prog = stims[0].prog
+    assert stims[1].prog is prog
+    assert cache.ref_counts[prog] == 2
+
+    # programs in use are kept by clear
+    stims[0].release()
+    cache.clear()
+    assert cache.ref_counts[prog] == 1
+
+    # unused programs stay compiled until clear
+    stims[1].release()
+    assert cache.ref_counts[prog] == 0
+    assert prog in cache.programs.values()
+    cache.clear()
+    assert prog not in cache.programs.values()
+    assert prog not in cache.ref_counts
+
+
+def test_renderer_release_clears_programs(display):
+    renderer = OffscreenRenderer(get_test_screen(), width=32, height=32)
+    renderer.load_stim('MovingPatch')
+    renderer.load_stim('MovingPatch', hold=True)
+    cache = get_program_cache(renderer.ctx)
+    assert len(cache.programs) == 1
+
+    renderer.release()
+    assert cache.programs == {}
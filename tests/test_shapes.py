@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from flystim.shapes import GlVertices, GlVerticesBuilder, GlQuad, GlTri, GlSphericalPoints, GlSphericalRect, \
+                           GlSphericalTexturedRect, GlSphericalCirc, MeshCache
+from flystim.util import rotate, rotz, rotz_mat, scale, translate
+
+
+def test_builder_matches_add():
+    pieces = [GlQuad((0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (1, 0, 0, 1), use_texture=True).translate((x, 0, 0))
+              for x in range(10)]
+
+    added = GlVertices()
+    builder = GlVerticesBuilder(capacity=4)  # small capacity, so the builder has to grow
+    for piece in pieces:
+        added.add(piece)
+        builder.append(piece)
+    built = builder.freeze()
+
+    assert np.array_equal(built.vertices, added.vertices)
+    assert np.array_equal(built.colors, added.colors)
+    assert np.array_equal(built.tex_coords, added.tex_coords)
+    assert np.array_equal(built.data, added.data)
+
+
+def test_builder_freeze():
+    builder = GlVerticesBuilder()
+    assert builder.freeze().vertices is None
+
+    builder.append(GlSphericalPoints(theta=[0, 10], phi=[0, 20]))
+    points = builder.freeze()
+    assert points.vertices.shape == (3, 2)
+    assert points.tex_coords is None
+
+    # the builder starts over, without touching the frozen object
+    builder.append(GlSphericalPoints(theta=[30], phi=[40]))
+    assert builder.freeze().vertices.shape == (3, 1)
+    assert points.vertices.shape == (3, 2)
+
+
+def test_builder_rejects_mixed_tex_coords():
+    builder = GlVerticesBuilder()
+    builder.append(GlTri((0, 0, 0), (1, 0, 0), (1, 1, 0), (1, 1, 1, 1)))
+    with pytest.raises(ValueError):
+        builder.append(GlQuad((0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (1, 1, 1, 1), use_texture=True))
+
+
+def test_mesh_cache():
+    cache = MeshCache(max_size=2)
+
+    rect = cache.get(GlSphericalRect, width=20, height=10, color=(1, 0, 0, 1))
+    expected = GlSphericalRect(width=20, height=10, color=(1, 0, 0, 1))
+    assert np.array_equal(rect.data, expected.data)
+    assert cache.misses == 1
+
+    # same shape and color: the same object, so it doesn't need to be uploaded again
+    assert cache.get(GlSphericalRect, width=20, height=10, color=(1, 0, 0, 1)) is rect
+
+    # new color, same mesh
+    gray = cache.get(GlSphericalRect, width=20, height=10, color=0.5)
+    assert np.array_equal(gray.data, GlSphericalRect(width=20, height=10, color=0.5).data)
+    assert np.array_equal(gray.vertices, rect.vertices)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # the least recently used mesh is dropped
+    cache.get(GlSphericalCirc, circle_radius=5)
+    cache.get(GlSphericalRect, width=20, height=10, color=0.5)
+    cache.get(GlSphericalCirc, circle_radius=10)
+    assert len(cache.meshes) == 2
+    cache.get(GlSphericalCirc, circle_radius=5)
+    assert (cache.hits, cache.misses) == (3, 4)
+
+
+def test_deferred_transforms():
+    rect = GlSphericalRect(width=20, height=10, color=(1, 0, 0, 1))
+    original = rect.vertices.copy()
+
+    moved = rect.scale(2).rotate(0.3, -0.2, 0.1).translate((1, 2, 3)).rotz(0.5)
+    assert moved.source is rect  # nothing has been computed yet
+
+    expected = rotz(translate(rotate(scale(original.astype(float), 2), 0.3, -0.2, 0.1), (1, 2, 3)), 0.5)
+    assert np.allclose(moved.vertices, expected, atol=1e-6)
+    assert np.array_equal(moved.colors, rect.colors)
+    assert np.array_equal(rect.vertices, original)
+
+
+def test_split_transform():
+    rect = GlSphericalTexturedRect(width=20, height=10, texture=True)
+
+    # transform only: the untransformed source can be drawn with the transform as a model matrix
+    rotated = rect.rotz(0.5)
+    mesh, transform = rotated.split_transform()
+    assert mesh is rect
+    assert np.allclose(transform[:3, :3], rotz_mat(0.5))
+
+    # pending color and texture shift stay with the vertex data
+    shifted = rect.setColor((0, 1, 0, 1)).shiftTexture((0.1, 0)).shiftTexture((0.2, 0.5)).rotz(0.5)
+    mesh, transform = shifted.split_transform()
+    assert mesh is shifted.split_transform()[0]
+    assert np.allclose(mesh.colors, np.array([[0, 1, 0, 1]]).T)
+    assert np.allclose(mesh.tex_coords, rect.tex_coords + np.array([[0.3, 0.5]]).T)
+    assert np.allclose(mesh.vertices, rect.vertices)
+    assert np.allclose(shifted.vertices, rotz(rect.vertices, 0.5), atol=1e-6)
+
+
+def test_indexed_builder():
+    quad = GlQuad((0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (1, 0, 0, 1))
+    tri = GlTri((0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 0, 1))
+    assert len(quad.buffer) == 4 and len(quad.indices) == 6
+
+    builder = GlVerticesBuilder()
+    for piece in [tri, quad, tri, quad.translate((0, 0, 2))]:
+        builder.append(piece)
+    built = builder.freeze()
+
+    added = GlVertices()
+    for piece in [tri, quad, tri, quad.translate((0, 0, 2))]:
+        added.add(piece)
+
+    expected = np.concatenate([x.expanded().buffer for x in [tri, quad, tri, quad.translate((0, 0, 2))]])
+    assert len(built.buffer) == 3 + 4 + 3 + 4
+    assert np.array_equal(built.expanded().buffer, expected)
+    assert np.array_equal(added.expanded().buffer, expected)
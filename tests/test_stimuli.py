@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+
+from common import HeadlessDisplay, render_stimulus, get_stimulus_names, KNOWN_BROKEN
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), 'data', 'stimuli_golden.npz')
+
+# rendering differences between GL drivers: pixels may differ by up to MAX_PIXEL_ERR levels, and up to
+# MAX_BAD_FRACTION of the pixels in an image may differ by more
+MAX_PIXEL_ERR = 8
+MAX_BAD_FRACTION = 0.01
+
+
+@pytest.fixture(scope='module')
+def display():
+    try:
+        return HeadlessDisplay(width=128, height=128)
+    except Exception as e:
+        pytest.skip('No OpenGL context available: {}'.format(e))
+
+
+@pytest.fixture(scope='module')
+def golden():
+    if not os.path.exists(GOLDEN_PATH):
+        pytest.skip('No golden images, create them with tests/benchmark_stimuli.py --save-golden')
+    return np.load(GOLDEN_PATH)
+
+
+@pytest.mark.parametrize('single_pass_subscreens', [False, True])
+@pytest.mark.parametrize('name', get_stimulus_names())
+def test_stimulus_matches_golden(name, single_pass_subscreens, display, golden):
+    if name in KNOWN_BROKEN:
+        pytest.xfail(KNOWN_BROKEN[name])
+    if name not in golden:
+        pytest.skip('No golden images for {}'.format(name))
+
+    # the golden images are drawn one subscreen at a time; single-pass rendering has to produce the same images
+    images = render_stimulus(display, name, single_pass_subscreens=single_pass_subscreens)
+    expected = golden[name]
+    assert images.shape == expected.shape
+
+    for t_ind, (image, ref) in enumerate(zip(images, expected)):
+        bad_fraction = np.mean(np.abs(image.astype(int) - ref.astype(int)) > MAX_PIXEL_ERR)
+        assert bad_fraction <= MAX_BAD_FRACTION, '{}: {:.2%} of pixels differ at sample {}'.format(name, bad_fraction, t_ind)
+
+
+@pytest.mark.parametrize('name', get_stimulus_names())
+def test_single_pass_matches_multi_pass(name, display):
+    if name in KNOWN_BROKEN:
+        pytest.xfail(KNOWN_BROKEN[name])
+
+    multi_pass = render_stimulus(display, name).astype(int)
+    single_pass = render_stimulus(display, name, single_pass_subscreens=True).astype(int)
+    assert np.abs(single_pass - multi_pass).max() <= 1
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from flystim.trajectory import Trajectory, return_for_time_t, return_for_times
+
+TRAJECTORIES = {
+    'tv_pairs': {'name': 'tv_pairs', 'tv_pairs': [(0, 0), (1, 10), (2, 5)], 'kind': 'linear'},
+    'tv_pairs_vector': {'name': 'tv_pairs', 'tv_pairs': [(0, [0, 1]), (1, [10, 2]), (2, [5, 3])], 'kind': 'previous'},
+    'tv_pairs_bounded': {'name': 'tv_pairs_bounded', 'tv_pairs': [(0, 0), (2, 720)], 'kind': 'linear', 'bounds': (-180, 180)},
+    'Sinusoid': {'name': 'Sinusoid', 'offset': 0.5, 'amplitude': 0.3, 'temporal_frequency': 2},
+    'SquareWave': {'name': 'SquareWave', 'offset': 0.5, 'amplitude': 0.3, 'temporal_frequency': 2},
+    'SinusoidInTimeWindow': {'name': 'SinusoidInTimeWindow', 'offset': 0.5, 'amplitude': 0.3, 'temporal_frequency': 2,
+                             'stim_start': 0.5, 'stim_end': 1.5},
+    'SinusoidInTimeWindow_rgba': {'name': 'SinusoidInTimeWindow', 'offset': np.array([0.5, 0.5, 0.5, 1]),
+                                  'amplitude': np.array([0.3, 0.3, 0.3, 0]), 'temporal_frequency': 2,
+                                  'stim_start': 0.5, 'stim_end': 1.5},
+    'Loom': {'name': 'Loom', 'rv_ratio': 0.1, 'stim_time': 1.5, 'start_size': 5, 'end_size': 80},
+    'Loom_Gabb': {'name': 'Loom_Gabb', 'rv_ratio': 0.1, 'end_radius': 60, 'collision_time': 1.5},
+    'Loom2': {'name': 'Loom2', 'rv_ratio': 0.1, 'start_size': 5, 'end_size': 80},
+}
+
+# includes the loom collision times, where the scalar path divides by zero
+TIMES = np.concatenate([np.linspace(-0.5, 2.5, 61), [1.5, 0.1 / np.tan(np.radians(2.5))]])
+# all inside, all outside and across the SinusoidInTimeWindow window
+TIME_SETS = {'all': TIMES, 'inside': np.linspace(0.5, 1.4, 10), 'outside': np.linspace(1.5, 2.5, 10)}
+
+
+@pytest.mark.parametrize('times', TIME_SETS)
+@pytest.mark.parametrize('name', TRAJECTORIES)
+def test_evaluate_matches_get_value(name, times):
+    times = TIME_SETS[times]
+    trajectory = Trajectory(TRAJECTORIES[name])
+    with np.errstate(divide='ignore'):
+        expected = [trajectory.getValue(t) for t in times]
+    values = trajectory.evaluate(times)
+
+    assert len(values) == len(expected)
+    for value, expected_value in zip(values, expected):
+        assert np.shape(value) == np.shape(expected_value)
+        assert np.allclose(value, expected_value, equal_nan=True)
+    if values.dtype != object:
+        # values of the same shape are stacked into one array
+        assert np.array_equal(values, np.array(expected), equal_nan=True)
+
+
+def test_return_for_times():
+    trajectory = Trajectory(TRAJECTORIES['tv_pairs'])
+    times = np.array([0, 0.5, 1.5])
+    assert np.allclose(return_for_times(trajectory, times), [return_for_time_t(trajectory, t) for t in times])
+
+    assert np.array_equal(return_for_times(3, times), [3, 3, 3])
+    assert return_for_times([1, 0, 0, 1], times).shape == (3, 4)